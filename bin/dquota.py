@@ -36,23 +36,80 @@ Script to check for quota transgressions and notify the offending users.
 
 @author Andy Georges
 """
+import signal
 import sys
-
+import time
 
 from vsc.accountpage.client import AccountpageClient
 from vsc.config.base import VscStorage
 from vsc.filesystem.gpfs import GpfsOperations
-from vsc.filesystem.quota.tools import get_mmrepquota_maps, map_uids_to_names
-from vsc.filesystem.quota.tools import process_user_quota, process_fileset_quota
-from vsc.utils.nagios import NAGIOS_EXIT_CRITICAL
+from vsc.filesystem.quota.cycle import FILESET_REFRESH_INTERVAL, QuotaCycle, nagios_exit
+from vsc.filesystem.quota.exceed import ExceedState
+from vsc.filesystem.quota.memory import report_memory_profile, start_memory_profiler
+from vsc.filesystem.quota.metrics import QuotaMetrics
+from vsc.filesystem.quota.snapshot import GPFS_SNAPSHOT_CACHE, GPFS_SNAPSHOT_MAX_AGE, GpfsSnapshot
+from vsc.filesystem.quota.tools import DELTA_FULL_RESYNC_INTERVAL, UID_CACHE_TTL, UidResolver
+from vsc.filesystem.quota.tools import USER_NAME_PREFIXES, parse_id_ranges
+from vsc.filesystem.quota.tools import PUSH_MAX_BATCH_BYTES, PUSH_MAX_BATCH_RECORDS, PUSH_TARGET_LATENCY
+from vsc.filesystem.quota.tools import PUSH_ENCODING_RECORDS, PUSH_ENCODINGS
+from vsc.utils.nagios import NAGIOS_EXIT_CRITICAL, NagiosResult
 from vsc.utils.script_tools import ExtendedSimpleOption
 
 # Constants
 NAGIOS_CHECK_INTERVAL_THRESHOLD = 60 * 60  # one hour
 
-QUOTA_USERS_WARNING = 20
-QUOTA_USERS_CRITICAL = 40
-QUOTA_FILESETS_CRITICAL = 1
+UID_CACHE_PATH = '/var/cache/quota/dquota_uids.json'
+EXCEED_STATE_PATH = '/var/cache/quota/dquota_exceeding.json'
+
+DAEMON_INTERVAL = 10 * 60
+
+
+def run_daemon(opts, cycle, profiler=None):
+    """
+    Run the cycle every interval seconds, until the process is terminated.
+
+    The caches of the cycle are kept warm between the cycles. The outcome and latency of each
+    cycle are reported to nagios, as the epilogue of a single run does. With a profiler, the
+    memory profile is reported after each cycle.
+    """
+    logger = opts.log
+    interval = opts.options.interval
+    stopping = []
+
+    def _stop(signum, _):
+        logger.info("Received signal %d, stopping after the current cycle", signum)
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    stats = {}
+    while not stopping:
+        start = time.time()
+        metrics = QuotaMetrics('dquota', profiler)
+
+        try:
+            with metrics.phase('cycle'):
+                stats = cycle.run(metrics)
+            stats['cycle_seconds'] = time.time() - start
+            stats['cycle_seconds_warning'] = interval
+            stats.update(metrics.perfdata())
+            opts.nagios_reporter.cache(nagios_exit(stats), NagiosResult("quota check cycle completed", **stats))
+            logger.info("Quota check cycle %d completed in %.1f seconds", cycle.cycles, stats['cycle_seconds'])
+            cycle.refresh()
+        except Exception, err:
+            logger.exception("critical exception caught in cycle %d: %s" % (cycle.cycles, err))
+            opts.nagios_reporter.cache(NAGIOS_EXIT_CRITICAL, NagiosResult("quota check cycle failed: %s" % (err,)))
+            cycle.refresh(full=True)
+
+        if opts.options.metrics_textfile:
+            metrics.write_textfile(opts.options.metrics_textfile)
+        report_memory_profile(profiler, opts.options.profile_memory_report)
+
+        while not stopping and time.time() < start + interval:
+            time.sleep(min(1, max(start + interval - time.time(), 0)))
+
+    return stats
 
 
 def main():
@@ -64,87 +121,103 @@ def main():
         'write-cache': ('Write the data into the cache files in the FS', None, 'store_true', False),
         'account_page_url': ('Base URL of the account page', None, 'store', 'https://account.vscentrum.be/django'),
         'access_token': ('OAuth2 token to access the account page REST API', None, 'store', None),
+        'workers': ('number of storages to process concurrently (threads, which only overlap the GPFS and '
+                    'account page I/O, the processing itself is serialised by the GIL)', int, 'store', 1),
+        'push-concurrency': ('number of batches in flight per account page storage endpoint', int, 'store', 1),
+        'push-rate': ('maximal number of requests per second to the account page (0: unlimited)',
+                      float, 'store', 0),
+        'push-delta-dir': ('only push records that changed since the last run, keeping state in this directory',
+                           None, 'store', None),
+        'push-full-resync': ('seconds between full pushes of all records in delta mode', int, 'store',
+                             DELTA_FULL_RESYNC_INTERVAL),
+        'push-max-batch-records': ('maximal number of records pushed in a single request', int, 'store',
+                                   PUSH_MAX_BATCH_RECORDS),
+        'push-max-batch-bytes': ('maximal size of the records pushed in a single request', int, 'store',
+                                 PUSH_MAX_BATCH_BYTES),
+        'push-target-latency': ('adapt the batch size to keep requests below this many seconds', float, 'store',
+                                PUSH_TARGET_LATENCY),
+        'push-encoding': ('encoding of the pushed records: records, or a compact (gzipped) table, which the account '
+                          'page must support', 'choice', 'store', PUSH_ENCODING_RECORDS, list(PUSH_ENCODINGS)),
+        'metrics-textfile': ('write node_exporter textfile metrics to this file', None, 'store', None),
+        'snapshot-cache': ('directory of the GPFS information shared with the other quota scripts',
+                           None, 'store', GPFS_SNAPSHOT_CACHE),
+        'max-snapshot-age': ('maximal age in seconds of shared GPFS information to reuse, 0 to always query GPFS',
+                             int, 'store', GPFS_SNAPSHOT_MAX_AGE),
+        'uid-cache': ('file caching the user names of the uids', None, 'store', UID_CACHE_PATH),
+        'uid-cache-ttl': ('seconds a cached user name remains valid', int, 'store', UID_CACHE_TTL),
+        'uid-ranges': ('only consider the users in these comma-separated uid ranges, e.g., 2500000-2599999',
+                       'strlist', 'store', []),
+        'user-prefixes': ('only consider the users whose name starts with one of these comma-separated prefixes',
+                          'strtuple', 'store', USER_NAME_PREFIXES),
+        'exceed-state': ('file with the users and filesets that exceeded their quota at the last run, only the '
+                         'changes are logged (empty: log all of them at every run)', None, 'store', EXCEED_STATE_PATH),
+        'profile-memory': ('trace the allocations, logging the peak and top allocation sites of each phase (slow)',
+                           None, 'store_true', False),
+        'profile-memory-report': ('write the memory profile to this file, to compare it with other runs',
+                                  None, 'store', None),
+        'daemon': ('keep running, checking the quota every interval seconds with warm caches',
+                   None, 'store_true', False),
+        'interval': ('seconds between the starts of the quota checks in daemon mode', int, 'store', DAEMON_INTERVAL),
+        'fileset-refresh': ('seconds after which the filesets are listed again in daemon mode', int, 'store',
+                            FILESET_REFRESH_INTERVAL),
     }
     opts = ExtendedSimpleOption(options)
     logger = opts.log
 
+    profiler = start_memory_profiler(opts.options.profile_memory)
+    metrics = QuotaMetrics('dquota', profiler)
+
     try:
         client = AccountpageClient(token=opts.options.access_token)
 
-        user_id_map = map_uids_to_names()  # is this really necessary?
-        gpfs = GpfsOperations()
+        # the storages share the GPFS information, which is only listed once
+        gpfs = GpfsSnapshot(GpfsOperations(), opts.options.snapshot_cache, opts.options.max_snapshot_age)
         storage = VscStorage()
 
-        target_filesystems = [storage[s].filesystem for s in opts.options.storage]
-
-        filesystems = gpfs.list_filesystems(target_filesystems).keys()
-        logger.debug("Found the following GPFS filesystems: %s" % (filesystems))
-
-        filesets = gpfs.list_filesets()
-        logger.debug("Found the following GPFS filesets: %s" % (filesets))
-
-        quota = gpfs.list_quota()
-        exceeding_filesets = {}
-        exceeding_users = {}
-        stats = {}
-
-        for storage_name in opts.options.storage:
-
-            logger.info("Processing quota for storage_name %s" % (storage_name))
-            filesystem = storage[storage_name].filesystem
-            replication_factor = storage[storage_name].data_replication_factor
-
-            if filesystem not in filesystems:
-                logger.error("Non-existent filesystem %s" % (filesystem))
-                continue
-
-            if filesystem not in quota.keys():
-                logger.error("No quota defined for storage_name %s [%s]" % (storage_name, filesystem))
-                continue
-
-            quota_storage_map = get_mmrepquota_maps(
-                quota[filesystem],
-                storage_name,
-                filesystem,
-                filesets,
-                replication_factor,
-            )
-
-            exceeding_filesets[storage_name] = process_fileset_quota(
-                storage, gpfs, storage_name, filesystem, quota_storage_map['FILESET'],
-                client, opts.options.dry_run)
-            exceeding_users[storage_name] = process_user_quota(
-                storage, gpfs, storage_name, None, quota_storage_map['USR'],
-                user_id_map, client, opts.options.dry_run)
-
-            stats["%s_fileset_critical" % (storage_name,)] = QUOTA_FILESETS_CRITICAL
-            if exceeding_filesets[storage_name]:
-                stats["%s_fileset" % (storage_name,)] = 1
-                logger.warning("storage_name %s found %d filesets that are exceeding their quota",
-                               storage_name, len(exceeding_filesets))
-                for (e_fileset, e_quota) in exceeding_filesets[storage_name]:
-                    logger.warning("%s has quota %s" % (e_fileset, str(e_quota)))
-            else:
-                stats["%s_fileset" % (storage_name,)] = 0
-                logger.debug("storage_name %s found no filesets that are exceeding their quota" % storage_name)
-
-            stats["%s_users_warning" % (storage_name,)] = QUOTA_USERS_WARNING
-            stats["%s_users_critical" % (storage_name,)] = QUOTA_USERS_CRITICAL
-            if exceeding_users[storage_name]:
-                stats["%s_users" % (storage_name,)] = len(exceeding_users[storage_name])
-                logger.warning("storage_name %s found %d users who are exceeding their quota" %
-                               (storage_name, len(exceeding_users[storage_name])))
-                for (e_user_id, e_quota) in exceeding_users[storage_name]:
-                    logger.warning("%s has quota %s" % (e_user_id, str(e_quota)))
-            else:
-                stats["%s_users" % (storage_name,)] = 0
-                logger.debug("storage_name %s found no users who are exceeding their quota" % storage_name)
+        pusher_options = {
+            'concurrency': opts.options.push_concurrency,
+            'rate': opts.options.push_rate,
+            'delta_dir': opts.options.push_delta_dir,
+            'full_resync': opts.options.push_full_resync,
+            'max_batch_records': opts.options.push_max_batch_records,
+            'max_batch_bytes': opts.options.push_max_batch_bytes,
+            'target_latency': opts.options.push_target_latency,
+            'encoding': opts.options.push_encoding,
+        }
+
+        exceed_state = None
+        if opts.options.exceed_state:
+            exceed_state = ExceedState(opts.options.exceed_state)
+
+        cycle = QuotaCycle(gpfs, storage, opts.options.storage, client,
+                           UidResolver(opts.options.uid_cache, opts.options.uid_cache_ttl),
+                           dry_run=opts.options.dry_run,
+                           pusher_options=pusher_options,
+                           workers=opts.options.workers,
+                           fileset_refresh=opts.options.fileset_refresh,
+                           uid_ranges=parse_id_ranges(opts.options.uid_ranges),
+                           user_prefixes=opts.options.user_prefixes,
+                           exceed_state=exceed_state)
+
+        if opts.options.daemon:
+            stats = run_daemon(opts, cycle, profiler)
+            opts.epilogue("quota check daemon stopped after %d cycles" % (cycle.cycles,), stats)
+            return
+
+        stats = cycle.run(metrics)
 
     except Exception, err:
         logger.exception("critical exception caught: %s" % (err))
+        report_memory_profile(profiler, opts.options.profile_memory_report)
         opts.critical("Script failed in a horrible way")
         sys.exit(NAGIOS_EXIT_CRITICAL)
 
+    report_memory_profile(profiler, opts.options.profile_memory_report)
+
+    stats.update(metrics.perfdata())
+    if opts.options.metrics_textfile:
+        metrics.write_textfile(opts.options.metrics_textfile)
+
     opts.epilogue("quota check completed", stats)
 
 if __name__ == '__main__':
@@ -30,14 +30,17 @@ in a zip file, named by date and filesystem.
 
 @author Andy Georges (Ghent University)
 """
-import gzip
-import json
 import os
 import sys
-import time
 
 
 from vsc.filesystem.gpfs import GpfsOperations
+from vsc.filesystem.quota.archive import ARCHIVE_CODECS, DEFAULT_ARCHIVE_CODEC, DEFAULT_ARCHIVE_LEVEL
+from vsc.filesystem.quota.archive import archive_filename, log_codec_benchmark, write_json_archive
+from vsc.filesystem.quota.forecast import FORECAST_HALF_LIFE, FORECAST_HORIZON, InodeForecaster
+from vsc.filesystem.quota.memory import report_memory_profile, start_memory_profiler
+from vsc.filesystem.quota.metrics import QuotaMetrics
+from vsc.filesystem.quota.snapshot import GPFS_SNAPSHOT_CACHE, GPFS_SNAPSHOT_MAX_AGE, GpfsSnapshot
 from vsc.utils.nagios import NAGIOS_EXIT_CRITICAL
 from vsc.utils.script_tools import ExtendedSimpleOption
 
@@ -45,8 +48,18 @@ from vsc.utils.script_tools import ExtendedSimpleOption
 NAGIOS_CHECK_INTERVAL_THRESHOLD = (6 * 60 + 5) * 60  # 365 minutes -- little over 6 hours.
 INODE_LOG_ZIP_PATH = '/var/log/quota/inode-zips'
 INODE_STORE_LOG_CRITICAL = 1
+INODE_FORECAST_STATE = '/var/cache/quota/inode_forecast.json'
 
-from vsc.filesystem.quota.tools import process_inodes_information, mail_admins
+from vsc.filesystem.quota.tools import INODE_SEVERITY_LEVELS, evaluate_inodes_all, mail_admins
+
+
+def parse_thresholds(values):
+    """Turn a list of filesystem:fraction strings into a dict."""
+    thresholds = {}
+    for value in values:
+        (filesystem, fraction) = value.rsplit(':', 1)
+        thresholds[filesystem] = float(fraction)
+    return thresholds
 
 
 def main():
@@ -57,54 +70,124 @@ def main():
     options = {
         'nagios-check-interval-threshold': NAGIOS_CHECK_INTERVAL_THRESHOLD,
         'location': ('path to store the gzipped files', None, 'store', INODE_LOG_ZIP_PATH),
+        'threshold': ('fraction of the maximal inodes from which a fileset is critical', float, 'store', 0.9),
+        'filesystem-thresholds': ('critical fraction for specific filesystems, given as filesystem:fraction',
+                                  'strlist', 'store', []),
+        'severity-levels': ('fractions of the maximal inodes that are reported as severity levels',
+                            'strlist', 'store', list(INODE_SEVERITY_LEVELS)),
+        'metrics-textfile': ('write node_exporter textfile metrics to this file', None, 'store', None),
+        'snapshot-cache': ('directory of the GPFS information shared with the other quota scripts',
+                           None, 'store', GPFS_SNAPSHOT_CACHE),
+        'max-snapshot-age': ('maximal age in seconds of shared GPFS information to reuse, 0 to always query GPFS',
+                             int, 'store', GPFS_SNAPSHOT_MAX_AGE),
+        'codec': ('compression codec of the stored files', 'choice', 'store', DEFAULT_ARCHIVE_CODEC,
+                  list(ARCHIVE_CODECS)),
+        'compress-level': ('compression level of the codec', int, 'store', DEFAULT_ARCHIVE_LEVEL),
+        'codec-benchmark': ('only report the time and size of each codec on the data, without storing it',
+                            None, 'store_true', False),
+        'forecast-state': ('file with the inode growth rates of the filesets', None, 'store', INODE_FORECAST_STATE),
+        'forecast-horizon': ('report filesets that are projected to run out of inodes within this many days',
+                             float, 'store', float(FORECAST_HORIZON) / (24 * 60 * 60)),
+        'forecast-half-life': ('number of days after which the weight of an inode usage sample halves',
+                               float, 'store', float(FORECAST_HALF_LIFE) / (24 * 60 * 60)),
+        'profile-memory': ('trace the allocations, logging the peak and top allocation sites of each phase (slow)',
+                           None, 'store_true', False),
+        'profile-memory-report': ('write the memory profile to this file, to compare it with other runs',
+                                  None, 'store', None),
     }
 
     opts = ExtendedSimpleOption(options)
     logger = opts.log
 
     stats = {}
+    profiler = start_memory_profiler(opts.options.profile_memory)
+    metrics = QuotaMetrics('inode_log', profiler)
 
     try:
-        gpfs = GpfsOperations()
-        filesets = gpfs.list_filesets()
-        quota = gpfs.list_quota()
+        gpfs = GpfsSnapshot(GpfsOperations(), opts.options.snapshot_cache, opts.options.max_snapshot_age)
+        with metrics.phase('list_filesets'):
+            filesets = gpfs.list_filesets()
+        with metrics.phase('list_quota'):
+            quota = gpfs.list_quota()
+
+        if opts.options.codec_benchmark:
+            for filesystem in filesets:
+                log_codec_benchmark(filesystem, filesets[filesystem])
+            opts.epilogue("Benchmarked the codecs on the GPFS inodes information", stats)
+            return
 
         if not os.path.exists(opts.options.location):
             os.makedirs(opts.options.location, 0755)
 
-        critical_filesets = dict()
-
         for filesystem in filesets:
             stats["%s_inodes_log_critical" % (filesystem,)] = INODE_STORE_LOG_CRITICAL
             try:
-                filename = "gpfs_inodes_%s_%s.gz" % (time.strftime("%Y%m%d-%H:%M"), filesystem)
+                filename = archive_filename('gpfs_inodes', filesystem, opts.options.codec)
                 path = os.path.join(opts.options.location, filename)
-                zipfile = gzip.open(path, 'wb', 9)  # Compress to the max
-                zipfile.write(json.dumps(filesets[filesystem]))
-                zipfile.close()
+                with metrics.phase('write_log', filesystem=filesystem):
+                    size = write_json_archive(path, filesets[filesystem],
+                                              opts.options.codec, opts.options.compress_level)
+                metrics.count('log_bytes', size, filesystem=filesystem)
                 stats["%s_inodes_log" % (filesystem,)] = 0
                 logger.info("Stored inodes information for FS %s" % (filesystem))
 
-                cfs = process_inodes_information(filesets[filesystem], quota[filesystem]['FILESET'], threshold=0.9)
-                logger.info("Processed inodes information for filesystem %s" % (filesystem,))
-                if cfs:
-                    critical_filesets[filesystem] = cfs
-                    logger.info("Filesystem %s has at least %d filesets reaching the limit" % (filesystem, len(cfs)))
-
             except Exception:
                 stats["%s_inodes_log" % (filesystem,)] = 1
                 logger.exception("Failed storing inodes information for FS %s" % (filesystem))
 
+        with metrics.phase('process_inodes'):
+            (critical_filesets, severities) = evaluate_inodes_all(
+                filesets, quota,
+                threshold=opts.options.threshold,
+                thresholds=parse_thresholds(opts.options.filesystem_thresholds),
+                levels=[float(level) for level in opts.options.severity_levels],
+            )
+        logger.info("Processed inodes information for filesystems %s" % (filesets.keys(),))
+
+        for (filesystem, cfs) in critical_filesets.items():
+            logger.info("Filesystem %s has at least %d filesets reaching the limit" % (filesystem, len(cfs)))
+
+        # every level is reported for every filesystem, so the perfdata always has the same keys
+        for (filesystem, fs_severities) in severities.items():
+            for (level, level_filesets) in fs_severities.items():
+                stats["%s_inodes_above_%d" % (filesystem, int(level * 100))] = len(level_filesets)
+                for (fileset_name, _) in level_filesets:
+                    logger.info("Fileset %s on %s uses over %d%% of its maximal inodes",
+                                   fileset_name, filesystem, int(level * 100))
+
         logger.info("Critical filesets: %s" % (critical_filesets,))
 
-        if critical_filesets:
-            mail_admins(critical_filesets, opts.options.dry_run)
+        with metrics.phase('forecast'):
+            forecaster = InodeForecaster(
+                opts.options.forecast_state,
+                half_life=opts.options.forecast_half_life * 24 * 60 * 60,
+                horizon=opts.options.forecast_horizon * 24 * 60 * 60,
+            )
+            projected_filesets = forecaster.update(filesets, quota)
+            if opts.options.dry_run:
+                logger.info("Dry run, not storing the inode forecast state in %s", opts.options.forecast_state)
+            else:
+                forecaster.store()
+        for filesystem in filesets:
+            stats["%s_inodes_projected" % (filesystem,)] = len(projected_filesets.get(filesystem, {}))
+        logger.info("Filesets projected to run out of inodes: %s" % (projected_filesets,))
+
+        if critical_filesets or projected_filesets:
+            with metrics.phase('mail'):
+                mail_admins(critical_filesets, opts.options.dry_run, projected_filesets)
 
     except Exception:
         logger.exception("Failure obtaining GPFS inodes")
+        report_memory_profile(profiler, opts.options.profile_memory_report)
         opts.critical("Failure to obtain GPFS inodes information")
         sys.exit(NAGIOS_EXIT_CRITICAL)
 
+    report_memory_profile(profiler, opts.options.profile_memory_report)
+
+    stats.update(metrics.perfdata())
+    if opts.options.metrics_textfile:
+        metrics.write_textfile(opts.options.metrics_textfile)
+
     opts.epilogue("Logged GPFS inodes", stats)
 
 if __name__ == '__main__':
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+This script benchmarks the quota processing on synthetic mmrepquota and mmlsfileset
+information, and compares the results with stored baselines.
+
+@author Andy Georges
+"""
+import sys
+
+from vsc.filesystem.quota.benchmark import BENCHMARK_SEED, BENCHMARK_SIZES, BENCHMARK_TOLERANCE
+from vsc.filesystem.quota.benchmark import compare_baselines, run_benchmarks, store_baselines
+from vsc.utils.generaloption import simple_option
+
+QUOTA_BENCHMARK_BASELINES = '/var/lib/quota/benchmark_baselines.json'
+
+
+def main():
+    """The main."""
+
+    options = {
+        'sizes': ('numbers of users to benchmark with', 'strlist', 'store', [str(s) for s in BENCHMARK_SIZES]),
+        'seed': ('seed for the synthetic data generators', int, 'store', BENCHMARK_SEED),
+        'baselines': ('file with the baseline results', None, 'store', QUOTA_BENCHMARK_BASELINES),
+        'update-baselines': ('store the results as the new baselines', None, 'store_true', False),
+        'tolerance': ('fraction of the baseline throughput that may be lost', float, 'store', BENCHMARK_TOLERANCE),
+    }
+    go = simple_option(options)
+
+    results = run_benchmarks([int(size) for size in go.options.sizes], go.options.seed)
+
+    print "%-30s %10s %10s %15s %15s" % ('function', 'users', 'seconds', 'users/s', 'peak bytes')
+    for result in results:
+        print "%-30s %10d %10.3f %15.0f %15d" % result
+
+    if go.options.update_baselines:
+        store_baselines(go.options.baselines, results)
+        print "Stored baselines in %s" % (go.options.baselines,)
+        return
+
+    regressions = compare_baselines(go.options.baselines, results, go.options.tolerance)
+    for (result, baseline) in regressions:
+        print "REGRESSION: %s with %d users: %.0f users/s, baseline %.0f users/s" % (
+            result.name, result.size, result.throughput, baseline)
+
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -30,13 +30,17 @@ in a zip file, named by date and filesystem.
 
 @author Andy Georges
 """
-import gzip
-import json
 import os
 import sys
 import time
 
 from vsc.filesystem.gpfs import GpfsOperations
+from vsc.filesystem.quota.archive import ARCHIVE_CODECS, DEFAULT_ARCHIVE_CODEC, DEFAULT_ARCHIVE_LEVEL
+from vsc.filesystem.quota.archive import archive_filename, log_codec_benchmark, write_json_archive
+from vsc.filesystem.quota.history import QuotaHistory
+from vsc.filesystem.quota.memory import report_memory_profile, start_memory_profiler
+from vsc.filesystem.quota.metrics import QuotaMetrics
+from vsc.filesystem.quota.snapshot import GPFS_SNAPSHOT_CACHE, GPFS_SNAPSHOT_MAX_AGE, GpfsSnapshot
 from vsc.utils import fancylogger
 from vsc.utils.nagios import NAGIOS_EXIT_CRITICAL
 from vsc.utils.script_tools import ExtendedSimpleOption
@@ -44,6 +48,7 @@ from vsc.utils.script_tools import ExtendedSimpleOption
 # Constants
 NAGIOS_CHECK_INTERVAL_THRESHOLD = (6 * 60 + 5) * 60  # 365 minutes -- little over 6 hours.
 QUOTA_LOG_ZIP_PATH = '/var/log/quota/zips'
+QUOTA_HISTORY_PATH = '/var/log/quota/history'
 
 logger = fancylogger.getLogger(__name__)
 fancylogger.logToScreen(True)
@@ -60,27 +65,64 @@ def main():
     options = {
         'nagios-check-interval-threshold': NAGIOS_CHECK_INTERVAL_THRESHOLD,
         'location': ('path to store the gzipped files', None, 'store', QUOTA_LOG_ZIP_PATH),
+        'metrics-textfile': ('write node_exporter textfile metrics to this file', None, 'store', None),
+        'snapshot-cache': ('directory of the GPFS information shared with the other quota scripts',
+                           None, 'store', GPFS_SNAPSHOT_CACHE),
+        'max-snapshot-age': ('maximal age in seconds of shared GPFS information to reuse, 0 to always query GPFS',
+                             int, 'store', GPFS_SNAPSHOT_MAX_AGE),
+        'codec': ('compression codec of the stored files', 'choice', 'store', DEFAULT_ARCHIVE_CODEC,
+                  list(ARCHIVE_CODECS)),
+        'compress-level': ('compression level of the codec', int, 'store', DEFAULT_ARCHIVE_LEVEL),
+        'codec-benchmark': ('only report the time and size of each codec on the data, without storing it',
+                            None, 'store_true', False),
+        'output': ('what to store: compressed JSON files (archive), the columnar history store (history) or both',
+                   'choice', 'store', 'archive', ['archive', 'history', 'both']),
+        'history-location': ('path of the columnar quota history store', None, 'store', QUOTA_HISTORY_PATH),
+        'profile-memory': ('trace the allocations, logging the peak and top allocation sites of each phase (slow)',
+                           None, 'store_true', False),
+        'profile-memory-report': ('write the memory profile to this file, to compare it with other runs',
+                                  None, 'store', None),
     }
 
     opts = ExtendedSimpleOption(options)
 
     stats = {}
+    profiler = start_memory_profiler(opts.options.profile_memory)
+    metrics = QuotaMetrics('quota_log', profiler)
 
     try:
-        gpfs = GpfsOperations()
-        quota = gpfs.list_quota()
+        gpfs = GpfsSnapshot(GpfsOperations(), opts.options.snapshot_cache, opts.options.max_snapshot_age)
+        with metrics.phase('list_quota'):
+            quota = gpfs.list_quota()
 
-        if not os.path.exists(opts.options.location):
+        if opts.options.codec_benchmark:
+            for key in quota:
+                log_codec_benchmark(key, quota[key])
+            opts.epilogue("Benchmarked the codecs on the GPFS quota information", stats)
+            return
+
+        store_archive = opts.options.output in ('archive', 'both')
+        history = None
+        if opts.options.output in ('history', 'both'):
+            history = QuotaHistory(opts.options.history_location)
+
+        if store_archive and not os.path.exists(opts.options.location):
             os.makedirs(opts.options.location, 0755)
 
+        timestamp = int(time.time())
         for key in quota:
             stats["%s_quota_log_critical" % (key,)] = QUOTA_STORE_LOG_CRITICAL
             try:
-                filename = "gpfs_quota_%s_%s.gz" % (time.strftime("%Y%m%d-%H:%M"), key)
-                path = os.path.join(opts.options.location, filename)
-                zipfile = gzip.open(path, 'wb', 9)  # Compress to the max
-                zipfile.write(json.dumps(quota[key]))
-                zipfile.close()
+                if store_archive:
+                    filename = archive_filename('gpfs_quota', key, opts.options.codec, timestamp)
+                    path = os.path.join(opts.options.location, filename)
+                    with metrics.phase('write_log', filesystem=key):
+                        size = write_json_archive(path, quota[key], opts.options.codec, opts.options.compress_level)
+                    metrics.count('log_bytes', size, filesystem=key)
+                if history:
+                    with metrics.phase('write_history', filesystem=key):
+                        rows = history.append(key, quota[key], timestamp)
+                    metrics.count('history_rows', rows, filesystem=key)
                 stats["%s_quota_log" % (key,)] = 0
                 logger.info("Stored quota information for FS %s" % (key))
             except Exception:
@@ -88,9 +130,16 @@ def main():
                 logger.exception("Failed storing quota information for FS %s" % (key))
     except Exception:
         logger.exception("Failure obtaining GPFS quota")
+        report_memory_profile(profiler, opts.options.profile_memory_report)
         opts.critical("Failure to obtain GPFS quota information")
         sys.exit(NAGIOS_EXIT_CRITICAL)
 
+    report_memory_profile(profiler, opts.options.profile_memory_report)
+
+    stats.update(metrics.perfdata())
+    if opts.options.metrics_textfile:
+        metrics.write_textfile(opts.options.metrics_textfile)
+
     opts.epilogue("Logged GPFS quota", stats)
 
 if __name__ == '__main__':
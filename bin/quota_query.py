@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+This script queries the quota and inode information archived by quota_log and inode_log
+for a user, fileset or VO, over a time range.
+
+@author Andy Georges
+"""
+import json
+import sys
+import time
+
+from vsc.config.base import GENT_VO_PREFIX, GENT_VO_SHARED_PREFIX
+from vsc.filesystem.quota.query import QueryIndex
+from vsc.utils.generaloption import simple_option
+
+QUOTA_LOG_ZIP_PATH = '/var/log/quota/zips'
+INODE_LOG_ZIP_PATH = '/var/log/quota/inode-zips'
+QUOTA_QUERY_INDEX_PATH = '/var/cache/quota/query-index'
+
+
+def parse_date(date):
+    """Turn a YYYYMMDD string into a timestamp."""
+    if date is None:
+        return None
+    return int(time.mktime(time.strptime(date, "%Y%m%d")))
+
+
+def format_result(result):
+    """A line with the information of a query result."""
+    date = time.strftime("%Y-%m-%d %H:%M", time.localtime(result.timestamp))
+    record = result.record
+
+    if result.source == 'inodes':
+        inodes = record['inodes']
+        return ["%s %-15s inodes %-6s %-15s allocated %s maximum %s" % (
+            date, result.filesystem, record['kind'], inodes.get('filesetName'),
+            inodes.get('allocInodes'), inodes.get('maxInodes'))]
+
+    return ["%s %-15s quota  %-6s %-15s fileset %-5s blocks %s/%s/%s files %s/%s/%s grace %s" % (
+        date, result.filesystem, record['kind'], quota['name'], quota['filesetname'],
+        quota['blockUsage'], quota['blockQuota'], quota['blockLimit'],
+        quota['filesUsage'], quota['filesQuota'], quota['filesLimit'], quota['blockGrace'])
+        for quota in record['quota']]
+
+
+def main():
+    """The main."""
+
+    options = {
+        'user': ('user name or uid to query', None, 'store', None),
+        'fileset': ('fileset name or id to query', None, 'store', None),
+        'vo': ('VO to query, including its shared fileset', None, 'store', None),
+        'start': ('only information from this date on (YYYYMMDD)', None, 'store', None),
+        'end': ('only information up to this date (YYYYMMDD)', None, 'store', None),
+        'filesystem': ('only information of this filesystem', None, 'store', None),
+        'quota-location': ('path of the archived quota information', None, 'store', QUOTA_LOG_ZIP_PATH),
+        'inode-location': ('path of the archived inode information', None, 'store', INODE_LOG_ZIP_PATH),
+        'index-location': ('path of the query index', None, 'store', QUOTA_QUERY_INDEX_PATH),
+        'no-update': ('do not index the newly archived information first', None, 'store_true', False),
+        'json': ('print the results as JSON', None, 'store_true', False),
+    }
+    go = simple_option(options)
+
+    if go.options.user:
+        (kind, names) = ('USR', [go.options.user])
+    elif go.options.fileset:
+        (kind, names) = ('FILESET', [go.options.fileset])
+    elif go.options.vo:
+        (kind, names) = ('FILESET', [go.options.vo, go.options.vo.replace(GENT_VO_PREFIX, GENT_VO_SHARED_PREFIX, 1)])
+    else:
+        go.parser.error("Specify one of --user, --fileset or --vo")
+
+    index = QueryIndex(go.options.index_location)
+    if not go.options.no_update:
+        indexed = index.update([go.options.quota_location, go.options.inode_location])
+        go.log.debug("Indexed %d archived files", indexed)
+
+    end = parse_date(go.options.end)
+    if end is not None:
+        end += 24 * 60 * 60 - 1
+    results = index.query(kind, names, parse_date(go.options.start), end, go.options.filesystem)
+
+    if go.options.json:
+        print json.dumps([result._asdict() for result in results], indent=2)
+    else:
+        for result in results:
+            for line in format_result(result):
+                print line
+
+    if not results:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Writing the JSON logs of the quota information.
+
+The data is encoded as JSON in one go, with the C encoder, and handed to the compressor in
+chunks, so the compressed data is never held in memory as a whole. The log file only appears
+once it has been written completely.
+
+@author: Andy Georges (Ghent University)
+"""
+
+import bz2
+import gzip
+import json
+import logging
+import time
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+from vsc.filesystem.quota.state import atomic_write
+from vsc.filesystem.quota.tools import QuotaException
+
+ARCHIVE_CODECS = ('gzip', 'bz2', 'lzma', 'none')
+ARCHIVE_EXTENSIONS = {
+    'gzip': '.gz',
+    'bz2': '.bz2',
+    'lzma': '.xz',
+    'none': '',
+}
+DEFAULT_ARCHIVE_CODEC = 'gzip'
+DEFAULT_ARCHIVE_LEVEL = 6
+
+ARCHIVE_BENCHMARK_LEVELS = {
+    'gzip': (1, 6, 9),
+    'bz2': (1, 9),
+    'lzma': (0, 6),
+    'none': (0,),
+}
+
+# size of the encoded chunks that are handed to the compressor at once
+ARCHIVE_CHUNK_SIZE = 64 * 1024
+
+
+class _Uncompressed(object):
+    """Compressor interface that passes the data through."""
+
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+def compressor(codec, level=DEFAULT_ARCHIVE_LEVEL):
+    """
+    Get a compressor object for the codec.
+
+    @returns: object with compress(data) and flush() methods, as those in zlib, bz2 and lzma
+    """
+    if codec == 'gzip':
+        # wbits 16 + MAX_WBITS yields the gzip format, so the files can be read with gzip
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif codec == 'bz2':
+        return bz2.BZ2Compressor(max(level, 1))
+    elif codec == 'lzma':
+        if lzma is None:
+            raise QuotaException("The lzma codec is not available")
+        return lzma.LZMACompressor(preset=level)
+    elif codec == 'none':
+        return _Uncompressed()
+    else:
+        raise QuotaException("Unknown archive codec %s" % (codec,))
+
+
+def open_archive(path):
+    """Open a log written by write_json_archive for reading, with the codec matching its extension."""
+    if path.endswith(ARCHIVE_EXTENSIONS['gzip']):
+        return gzip.open(path, 'rb')
+    elif path.endswith(ARCHIVE_EXTENSIONS['bz2']):
+        return bz2.BZ2File(path, 'rb')
+    elif path.endswith(ARCHIVE_EXTENSIONS['lzma']):
+        if lzma is None:
+            raise QuotaException("The lzma codec is not available")
+        return lzma.open(path, 'rb')
+    else:
+        return open(path, 'rb')
+
+
+def read_json_archive(path):
+    """Read the data in a log written by write_json_archive."""
+    archive = open_archive(path)
+    try:
+        return json.loads(archive.read().decode('utf-8'))
+    finally:
+        archive.close()
+
+
+def archive_filename(prefix, key, codec=DEFAULT_ARCHIVE_CODEC, timestamp=None):
+    """The file name of the log for key, named by date, with the extension of the codec."""
+    if timestamp is None:
+        timestamp = time.time()
+    return "%s_%s_%s%s" % (prefix, time.strftime("%Y%m%d-%H:%M", time.localtime(timestamp)), key,
+                           ARCHIVE_EXTENSIONS[codec])
+
+
+def write_json(fileobj, data, codec=DEFAULT_ARCHIVE_CODEC, level=DEFAULT_ARCHIVE_LEVEL):
+    """
+    Encode the data as JSON and compress it into fileobj, a chunk at a time.
+
+    @returns: the number of bytes written to fileobj
+    """
+    comp = compressor(codec, level)
+    written = 0
+
+    # json.dumps uses the C encoder, iterencode falls back to the (far slower) pure Python one
+    encoded = json.dumps(data)
+    if not isinstance(encoded, bytes):
+        encoded = encoded.encode('utf-8')
+
+    view = memoryview(encoded)
+    for offset in range(0, len(encoded), ARCHIVE_CHUNK_SIZE):
+        out = comp.compress(view[offset:offset + ARCHIVE_CHUNK_SIZE].tobytes())
+        fileobj.write(out)
+        written += len(out)
+
+    out = comp.flush()
+    fileobj.write(out)
+    written += len(out)
+
+    return written
+
+
+def write_json_archive(path, data, codec=DEFAULT_ARCHIVE_CODEC, level=DEFAULT_ARCHIVE_LEVEL):
+    """
+    Write the data as compressed JSON to path.
+
+    The data is written to a temporary file in the same directory, which then replaces path,
+    so a partially written log never exists under its final name.
+
+    @returns: the size of the written file
+    """
+    return atomic_write(path, lambda archive: write_json(archive, data, codec, level), permissions=0o644)
+
+
+class _Counter(object):
+    """File-like object that only counts what is written to it."""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+def benchmark_codecs(data, levels=None):
+    """
+    Measure the time and resulting size of compressing the data with each available codec and level.
+
+    @type levels: dict with the levels to try per codec, defaults to ARCHIVE_BENCHMARK_LEVELS
+
+    @returns: list of (codec, level, seconds, size) tuples
+    """
+    if levels is None:
+        levels = ARCHIVE_BENCHMARK_LEVELS
+
+    results = []
+    for codec in ARCHIVE_CODECS:
+        if codec not in levels or (codec == 'lzma' and lzma is None):
+            continue
+        for level in levels[codec]:
+            start = time.time()
+            size = write_json(_Counter(), data, codec, level)
+            results.append((codec, level, time.time() - start, size))
+
+    return results
+
+
+def log_codec_benchmark(name, data, levels=None):
+    """
+    Benchmark the codecs on the data and log the results, fastest first.
+
+    @returns: list of (codec, level, seconds, size) tuples, as returned by benchmark_codecs
+    """
+    results = benchmark_codecs(data, levels)
+    for (codec, level, seconds, size) in sorted(results, key=lambda r: r[2]):
+        logging.info("Codec benchmark for %s: %s level %d took %.3f s for %d bytes", name, codec, level, seconds, size)
+    return results
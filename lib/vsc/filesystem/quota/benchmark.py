@@ -0,0 +1,303 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Benchmarks for the quota processing, using synthetic mmrepquota and mmlsfileset information.
+
+The generators are deterministic for a given seed, so results can be compared between runs
+and against stored baselines.
+
+@author: Andy Georges (Ghent University)
+"""
+
+import gc
+import logging
+import random
+import resource
+import time
+
+from collections import namedtuple
+
+from vsc.config.base import GENT_VO_PREFIX, GENT_VO_SHARED_PREFIX
+from vsc.filesystem.gpfs import GpfsQuota
+from vsc.filesystem.quota.state import load_state, store_state
+from vsc.filesystem.quota.tools import clear_grace_cache, determine_grace_period, get_mmrepquota_maps
+from vsc.filesystem.quota.tools import process_inodes_information, push_user_quota_to_django
+from vsc.filesystem.quota.tools import sanitize_quota_information, sanitize_quota_map
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+BENCHMARK_SIZES = (10000, 100000, 1000000)
+BENCHMARK_SEED = 42
+BENCHMARK_TOLERANCE = 0.2  # fraction of the baseline throughput that we may lose before calling it a regression
+
+BENCHMARK_FILESYSTEM = 'benchmarkfs'
+BENCHMARK_STORAGE = 'VSC_BENCHMARK'
+BENCHMARK_USERS_PER_VO = 20
+
+GRACE_STRINGS = ('none', 'none', 'none', '6 days', '13 hours', '42 minutes', 'expired')
+
+BenchmarkResult = namedtuple('BenchmarkResult', ['name', 'size', 'seconds', 'throughput', 'peak_memory'])
+
+
+class NullClient(object):
+    """Stand-in for the AccountpageClient that drops everything that is pushed."""
+
+    def __init__(self):
+        self.puts = 0
+
+    def __getattr__(self, name):
+        return self
+
+    def __getitem__(self, name):
+        return self
+
+    def put(self, body=None, **kwargs):
+        self.puts += 1
+
+
+def synthetic_filesets(size, filesystem=BENCHMARK_FILESYSTEM, seed=BENCHMARK_SEED):
+    """
+    Generate mmlsfileset information for a filesystem with the given number of users.
+
+    There is a user fileset per thousand users (vsc400, vsc401, ...), a VO fileset and shared VO fileset
+    per BENCHMARK_USERS_PER_VO users, and a few filesets that should never be shown to users.
+
+    @returns: dict as returned by GpfsOperations.list_filesets
+    """
+    rng = random.Random(seed)
+    names = ['root', 'apps', 'project_benchmark']
+    names.extend("vsc%d" % (400 + index) for index in range(0, size // 1000 + 1))
+    for index in range(0, size // BENCHMARK_USERS_PER_VO + 1):
+        names.append("gvo%05d" % index)
+        names.append("gvos%05d" % index)
+
+    filesets = {}
+    for (fileset_id, name) in enumerate(names):
+        maxinodes = rng.choice((0, 1000000, 10000000))
+        filesets[str(fileset_id)] = {
+            'filesetName': name,
+            'path': "/%s/%s" % (filesystem, name),
+            'maxInodes': str(maxinodes),
+            'allocInodes': str(maxinodes // 2),
+        }
+
+    return {filesystem: filesets}
+
+
+def _synthetic_gpfs_quota(rng, name, fileset_id):
+    soft = rng.choice((0, 25 * 1024 ** 2, 100 * 1024 ** 2))
+    files_soft = rng.choice((0, 100000, 1000000))
+    return GpfsQuota(
+        name=name,
+        blockUsage=str(rng.randint(0, soft * 2 or 1024 ** 2)),
+        blockQuota=str(soft),
+        blockLimit=str(soft * 2),
+        blockInDoubt=str(rng.randint(0, 1024)),
+        blockGrace=rng.choice(GRACE_STRINGS),
+        filesUsage=str(rng.randint(0, files_soft * 2 or 1000)),
+        filesQuota=str(files_soft),
+        filesLimit=str(files_soft * 2),
+        filesInDoubt=str(rng.randint(0, 100)),
+        filesGrace=rng.choice(GRACE_STRINGS),
+        remarks='',
+        quota='on',
+        defQuota='off',
+        fid=fileset_id,
+        filesetname=fileset_id,
+    )
+
+
+def synthetic_quota(size, filesets, filesystem=BENCHMARK_FILESYSTEM, seed=BENCHMARK_SEED):
+    """
+    Generate mmrepquota information for the given number of users.
+
+    Every user has quota on their own user fileset, on a VO fileset and on a fileset that should
+    be sanitised away before pushing. Every fileset has its own FILESET quota.
+
+    @returns: tuple (quota dict as returned by GpfsOperations.list_quota, user_map from uid to user name)
+    """
+    rng = random.Random(seed)
+    ids = dict((info['filesetName'], fileset_id) for (fileset_id, info) in filesets[filesystem].items())
+
+    users = {}
+    user_map = {}
+    for index in range(0, size):
+        uid = 2540000 + index
+        name = "vsc4%05d" % index
+        user_map[uid] = name
+        user_filesets = ("vsc%d" % (400 + index // 1000), "gvo%05d" % (index // BENCHMARK_USERS_PER_VO), "apps")
+        users[str(uid)] = [_synthetic_gpfs_quota(rng, name, ids[fileset]) for fileset in user_filesets]
+
+    fileset_quota = {}
+    for (name, fileset_id) in ids.items():
+        fileset_quota[fileset_id] = [_synthetic_gpfs_quota(rng, name, fileset_id)]
+
+    return ({filesystem: {'USR': users, 'GRP': {}, 'FILESET': fileset_quota}}, user_map)
+
+
+def synthetic_path_template():
+    """Path template as found in the VSC storage configuration, for the benchmark storage."""
+    return {
+        'user': lambda name: ("/%s/%s/%s" % (BENCHMARK_FILESYSTEM, name[:6], name), name[:6]),
+    }
+
+
+def measure(name, size, function, setup=None):
+    """
+    Run the function, measuring the time it takes and the peak memory it allocates.
+
+    Tracing the allocations with tracemalloc slows the function down considerably, so where it is
+    available, the function is timed in a first run without tracing and its peak memory is measured
+    in a second run. Otherwise, a single run reports the increase of the maximal resident set size
+    of the process, which is only meaningful for the first function that grows it.
+
+    @type setup: function returning the tuple of arguments for a run, called before each run (untimed),
+                 so every run starts from the same data and caches
+
+    @returns: BenchmarkResult
+    """
+    def arguments():
+        args = setup() if setup is not None else ()
+        gc.collect()
+        return args
+
+    args = arguments()
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    function(*args)
+    seconds = time.time() - start
+
+    if tracemalloc:
+        args = arguments()
+        tracemalloc.start()
+        function(*args)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        peak_memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - maxrss) * 1024
+    del args
+
+    result = BenchmarkResult(name, size, seconds, size / max(seconds, 1e-9), peak_memory)
+    logging.info("%s with %d users: %.3f s, %.0f users/s, peak memory %d bytes", *result)
+
+    return result
+
+
+def reference_sanitize_quota_information(fileset_name, quota):
+    """
+    The original sanitize_quota_information, checking the prefixes one by one, as the reference for its benchmark.
+    """
+    for fileset in list(quota.quota_map.keys()):
+        if not fileset.startswith('vsc') and \
+           not fileset.startswith(GENT_VO_PREFIX) and \
+           not fileset.startswith(GENT_VO_SHARED_PREFIX) and \
+           not fileset.startswith(fileset_name):
+            quota.quota_map.pop(fileset)
+
+
+def run_benchmarks(sizes=BENCHMARK_SIZES, seed=BENCHMARK_SEED):
+    """
+    Run all benchmarks for each of the given numbers of users.
+
+    @returns: list of BenchmarkResult
+    """
+    results = []
+
+    for size in sizes:
+        filesets = synthetic_filesets(size, seed=seed)
+        (quota, user_map) = synthetic_quota(size, filesets, seed=seed)
+        fs_quota = quota[BENCHMARK_FILESYSTEM]
+        grace_strings = [q.blockGrace for quotas in fs_quota['USR'].values() for q in quotas]
+        path_template = synthetic_path_template()
+
+        def grace_periods():
+            for grace_string in grace_strings:
+                determine_grace_period(grace_string)
+
+        def cold_grace_cache():
+            clear_grace_cache()
+            return ()
+
+        def quota_arguments():
+            clear_grace_cache()
+            return (fs_quota, BENCHMARK_STORAGE, BENCHMARK_FILESYSTEM, filesets, 2)
+
+        def user_quota():
+            return (get_mmrepquota_maps(*quota_arguments())['USR'],)
+
+        def sanitize(quota_map, function):
+            for (user_id, quota) in quota_map.items():
+                function(path_template['user'](user_map[int(user_id)])[1], quota)
+
+        results.append(measure('determine_grace_period', size, grace_periods, cold_grace_cache))
+        results.append(measure('get_mmrepquota_maps', size, get_mmrepquota_maps, quota_arguments))
+        results.append(measure('sanitize_quota_information_reference', size,
+                               lambda quota: sanitize(quota, reference_sanitize_quota_information), user_quota))
+        results.append(measure('sanitize_quota_information', size,
+                               lambda quota: sanitize(quota, sanitize_quota_information), user_quota))
+        results.append(measure('sanitize_quota_map', size,
+                               lambda quota: sanitize_quota_map(quota, user_map, path_template), user_quota))
+        results.append(measure('push_user_quota_to_django', size,
+                               lambda quota: push_user_quota_to_django(user_map, BENCHMARK_STORAGE, path_template,
+                                                                       quota, NullClient()),
+                               user_quota))
+        results.append(measure('process_inodes_information', size, process_inodes_information,
+                               lambda: (filesets[BENCHMARK_FILESYSTEM], fs_quota['FILESET'])))
+
+    return results
+
+
+def _baseline_key(result):
+    return "%s:%d" % (result.name, result.size)
+
+
+def store_baselines(path, results):
+    """Store the results as baselines, keeping the baselines of benchmarks that were not run."""
+    baselines = load_state(path, {})
+    for result in results:
+        baselines[_baseline_key(result)] = result._asdict()
+    store_state(path, baselines)
+
+
+def compare_baselines(path, results, tolerance=BENCHMARK_TOLERANCE):
+    """
+    Compare the results with the stored baselines.
+
+    @returns: list of (BenchmarkResult, baseline throughput) for results that are more than
+              tolerance slower than their baseline
+    """
+    baselines = load_state(path, {})
+    regressions = []
+
+    for result in results:
+        baseline = baselines.get(_baseline_key(result))
+        if baseline and result.throughput < (1 - tolerance) * baseline['throughput']:
+            regressions.append((result, baseline['throughput']))
+
+    return regressions
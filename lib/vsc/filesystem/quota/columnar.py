@@ -0,0 +1,205 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Columnar storage of quota information.
+
+Rather than keeping a QuotaUser or QuotaFileset object per entity, each quota field is kept
+in a typed array, with one row per (entity, fileset) pair. Operations work on whole columns.
+
+@author: Andy Georges (Ghent University)
+"""
+
+from array import array
+from itertools import compress
+
+try:
+    array('q')
+    INT64 = 'q'
+except ValueError:
+    INT64 = 'l'  # Python 2 has no 'q', but long is 64 bit on our platforms
+
+BLOCK_COLUMNS = ('used', 'soft', 'hard', 'doubt')
+FILES_COLUMNS = ('files_used', 'files_soft', 'files_hard', 'files_doubt')
+GRACE_COLUMNS = ('expired', 'remaining', 'files_expired', 'files_remaining')
+
+NO_GRACE = -1  # stored in the remaining columns when there is no grace period
+
+
+class QuotaTable(object):
+    """
+    Quota information of a single kind (USR, FILESET) for a filesystem, stored column by column.
+
+    Entity ids and fileset names are interned: the id and fileset columns hold indices
+    into the ids and filesets lists.
+    """
+
+    def __init__(self, storage, filesystem, kind, timestamp=None):
+        self.storage = storage
+        self.filesystem = filesystem
+        self.kind = kind
+        self.timestamp = timestamp
+
+        self.ids = []
+        self.filesets = []
+        self._id_index = {}
+        self._fileset_index = {}
+
+        self.columns = {
+            'id': array(INT64),
+            'fileset': array(INT64),
+            'expired': array('b'),
+            'files_expired': array('b'),
+        }
+        for name in BLOCK_COLUMNS + FILES_COLUMNS + ('remaining', 'files_remaining'):
+            self.columns[name] = array(INT64)
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def _intern(self, value, values, index):
+        try:
+            return index[value]
+        except KeyError:
+            index[value] = len(values)
+            values.append(value)
+            return index[value]
+
+    def add(self, entity_id):
+        """Add an entity, also when it has no rows, and return the index of its id."""
+        return self._intern(entity_id, self.ids, self._id_index)
+
+    def append(self, entity_id, fileset, used=0, soft=0, hard=0, doubt=0, expired=(False, None),
+               files_used=0, files_soft=0, files_hard=0, files_doubt=0, files_expired=(False, None)):
+        """Add a row, taking the same fields as QuotaEntity.update."""
+        columns = self.columns
+        columns['id'].append(self.add(entity_id))
+        columns['fileset'].append(self._intern(fileset, self.filesets, self._fileset_index))
+        columns['used'].append(used)
+        columns['soft'].append(soft)
+        columns['hard'].append(hard)
+        columns['doubt'].append(doubt)
+        columns['expired'].append(int(expired[0]))
+        columns['remaining'].append(NO_GRACE if expired[1] is None else expired[1])
+        columns['files_used'].append(files_used)
+        columns['files_soft'].append(files_soft)
+        columns['files_hard'].append(files_hard)
+        columns['files_doubt'].append(files_doubt)
+        columns['files_expired'].append(int(files_expired[0]))
+        columns['files_remaining'].append(NO_GRACE if files_expired[1] is None else files_expired[1])
+
+    def divide(self, replication_factor):
+        """Divide the block columns by the replication factor of the filesystem."""
+        if replication_factor == 1:
+            return
+        for name in BLOCK_COLUMNS:
+            self.columns[name] = array(INT64, [value // replication_factor for value in self.columns[name]])
+
+    def exceeding_rows(self):
+        """
+        Determine the rows that exceed their (block) soft limit, the column-wise QuotaEntity.exceeds().
+
+        @returns: list of booleans, one per row
+        """
+        return [used > soft for (used, soft) in zip(self.columns['used'], self.columns['soft'])]
+
+    def exceeding(self):
+        """
+        Determine the entities that exceed their soft limit on at least one fileset, see exceeding_rows.
+
+        @returns: sorted list of entity ids
+        """
+        rows = compress(self.columns['id'], self.exceeding_rows())
+        return [self.ids[index] for index in sorted(set(rows))]
+
+    def payloads(self, key, names):
+        """
+        Generate the account page payloads, as built by the push_*_quota_to_django functions.
+
+        @type key: string, the payload field that holds the entity name ('user', 'vo')
+        @type names: dict mapping entity ids to the name to push, entities that are not in it are skipped
+
+        @returns: generator of (entity id, payload dict) tuples
+        """
+        columns = self.columns
+        id_names = [names.get(entity_id) for entity_id in self.ids]
+
+        for row in range(len(self)):
+            entity_id = columns['id'][row]
+            name = id_names[entity_id]
+            if name is None:
+                continue
+
+            remaining = columns['remaining'][row]
+            files_remaining = columns['files_remaining'][row]
+            yield (self.ids[entity_id], {
+                "fileset": self.filesets[columns['fileset'][row]],
+                key: name,
+                "used": columns['used'][row],
+                "soft": columns['soft'][row],
+                "hard": columns['hard'][row],
+                "doubt": columns['doubt'][row],
+                "expired": bool(columns['expired'][row]),
+                "remaining": max(remaining, 0),  # seconds
+                "files_used": columns['files_used'][row],
+                "files_soft": columns['files_soft'][row],
+                "files_hard": columns['files_hard'][row],
+                "files_doubt": columns['files_doubt'][row],
+                "files_expired": bool(columns['files_expired'][row]),
+                "files_remaining": None if files_remaining == NO_GRACE else files_remaining,  # seconds
+            })
+
+    def entities(self, entity_class):
+        """
+        Build quota entities from the table, for code that expects QuotaUser or QuotaFileset instances.
+
+        @returns: list of (entity id, entity) tuples, in order of first appearance
+        """
+        columns = self.columns
+        entities = [entity_class(self.storage, self.filesystem, entity_id) for entity_id in self.ids]
+
+        for row in range(len(self)):
+            remaining = columns['remaining'][row]
+            files_remaining = columns['files_remaining'][row]
+            entities[columns['id'][row]].update(
+                fileset=self.filesets[columns['fileset'][row]],
+                used=columns['used'][row],
+                soft=columns['soft'][row],
+                hard=columns['hard'][row],
+                doubt=columns['doubt'][row],
+                expired=(bool(columns['expired'][row]), None if remaining == NO_GRACE else remaining),
+                files_used=columns['files_used'][row],
+                files_soft=columns['files_soft'][row],
+                files_hard=columns['files_hard'][row],
+                files_doubt=columns['files_doubt'][row],
+                files_expired=(bool(columns['files_expired'][row]),
+                               None if files_remaining == NO_GRACE else files_remaining),
+                timestamp=self.timestamp,
+            )
+
+        return list(zip(self.ids, entities))
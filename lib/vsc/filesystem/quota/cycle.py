@@ -0,0 +1,306 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+The collect, map, push and check cycle of dquota.
+
+A QuotaCycle holds everything that can be reused between cycles: the GPFS snapshot with the
+fileset index, the uid resolver and the account page client. dquota runs a single cycle, while
+its daemon mode keeps the cycle around and runs it at a fixed interval.
+
+@author: Andy Georges (Ghent University)
+"""
+
+import logging
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from vsc.filesystem.quota.exceed import log_transitions
+from vsc.filesystem.quota.metrics import QuotaMetrics
+from vsc.filesystem.quota.tools import USER_NAME_PREFIXES, EntityFilter, QuotaCounter
+from vsc.filesystem.quota.tools import iter_mmrepquota_entities, process_user_quota, process_fileset_quota
+from vsc.utils.nagios import NAGIOS_EXIT_CRITICAL, NAGIOS_EXIT_OK, NAGIOS_EXIT_WARNING, NagiosRange
+
+QUOTA_USERS_WARNING = 20
+QUOTA_USERS_CRITICAL = 40
+QUOTA_FILESETS_CRITICAL = 1
+
+FILESET_REFRESH_INTERVAL = 60 * 60  # filesets are created and removed rarely
+
+
+def process_storage(storage, gpfs, storage_name, filesystems, filesets, quota, user_id_map, client, dry_run=False,
+                    pusher_options=None, metrics=None, user_filter=None, log_exceeding=True,
+                    user_prefixes=USER_NAME_PREFIXES):
+    """
+    Process the quota for a single storage, using the given filesets and quota information.
+
+    This is safe to run concurrently for different storages, as the shared data is only read.
+    The time spent building the quota maps is recorded separately in the metrics, it is
+    included in the time spent processing the fileset and user quota.
+
+    @type user_filter: EntityFilter instance, the users it skips are counted as skipped_entities in the metrics
+    @type log_exceeding: bool, log every exceeding fileset and user while they are processed
+    @type user_prefixes: tuple, only the users whose name starts with one of these are pushed and checked,
+                         this should match the name prefixes of the user_filter
+
+    @returns: tuple (exceeding filesets, exceeding users) or None if the storage could not be processed
+    """
+    logging.info("Processing quota for storage_name %s" % (storage_name))
+    metrics = metrics or QuotaMetrics('dquota')
+    filesystem = storage[storage_name].filesystem
+    replication_factor = storage[storage_name].data_replication_factor
+
+    if filesystem not in filesystems:
+        logging.error("Non-existent filesystem %s" % (filesystem))
+        return None
+
+    if filesystem not in quota.keys():
+        logging.error("No quota defined for storage_name %s [%s]" % (storage_name, filesystem))
+        return None
+
+    # stream the entities, so they are pushed and checked without keeping them all in memory
+    timestamp = int(time.time())
+    fileset_quota = metrics.timed_iter(
+        iter_mmrepquota_entities(quota[filesystem], 'FILESET', storage_name, filesystem, filesets,
+                                 replication_factor, timestamp),
+        'build_maps', storage=storage_name, kind='FILESET')
+    user_quota = metrics.timed_iter(
+        iter_mmrepquota_entities(quota[filesystem], 'USR', storage_name, filesystem, filesets,
+                                 replication_factor, timestamp, user_filter),
+        'build_maps', storage=storage_name, kind='USR')
+
+    # the exceeding entities are counted (and logged) in the same pass over the entities as the push
+    with metrics.phase('process_fileset_quota', storage=storage_name):
+        exceeding_filesets = process_fileset_quota(
+            storage, gpfs, storage_name, filesystem, fileset_quota,
+            client, dry_run, pusher_options, filesets,
+            sinks=[QuotaCounter(metrics, storage=storage_name, kind='FILESET')], log_exceeding=log_exceeding)
+    with metrics.phase('process_user_quota', storage=storage_name):
+        exceeding_users = process_user_quota(
+            storage, gpfs, storage_name, None, user_quota,
+            user_id_map, client, dry_run, pusher_options,
+            sinks=[QuotaCounter(metrics, storage=storage_name, kind='USR')], log_exceeding=log_exceeding,
+            user_prefixes=user_prefixes)
+
+    if user_filter is not None:
+        metrics.count('skipped_entities', user_filter.skipped, storage=storage_name, kind='USR')
+
+    return (exceeding_filesets, exceeding_users)
+
+
+def nagios_exit(stats):
+    """
+    Evaluate the stats against the thresholds they hold, as the nagios epilogue of the scripts does.
+
+    A value is checked against the NagiosRange of the <name>_critical and <name>_warning entries, if any.
+
+    @returns: NAGIOS_EXIT_OK, NAGIOS_EXIT_WARNING or NAGIOS_EXIT_CRITICAL
+    """
+    result = NAGIOS_EXIT_OK
+    for (name, value) in stats.items():
+        if name.endswith('_warning') or name.endswith('_critical'):
+            continue
+        critical = stats.get("%s_critical" % (name,))
+        if critical is not None and NagiosRange(critical).alert(value):
+            return NAGIOS_EXIT_CRITICAL
+        warning = stats.get("%s_warning" % (name,))
+        if warning is not None and NagiosRange(warning).alert(value):
+            result = NAGIOS_EXIT_WARNING
+    return result
+
+
+class QuotaCycle(object):
+    """
+    A single pass over the storages: list the quota, map the uids, push to the account page and check.
+    """
+
+    def __init__(self, gpfs, storage, storage_names, client, uid_resolver, dry_run=False, pusher_options=None,
+                 workers=1, fileset_refresh=FILESET_REFRESH_INTERVAL, uid_ranges=None,
+                 user_prefixes=USER_NAME_PREFIXES, exceed_state=None):
+        """
+        @type gpfs: GpfsSnapshot instance
+        @type storage: VscStorage instance
+        @type uid_resolver: UidResolver instance
+        @type pusher_options: dict with the options for the DjangoPusher, except the metrics
+        @type fileset_refresh: int, seconds after which the filesets are listed again in the next cycle
+        @type uid_ranges: list of inclusive (low, high) tuples, only the users in these ranges are considered
+        @type user_prefixes: tuple, only the users whose name starts with one of these are considered
+        @type exceed_state: ExceedState instance, if given only the changes in the exceeding filesets and users
+                            are logged, rather than all of them
+        """
+        self.gpfs = gpfs
+        self.storage = storage
+        self.storage_names = storage_names
+        self.client = client
+        self.uid_resolver = uid_resolver
+        self.dry_run = dry_run
+        self.pusher_options = pusher_options or {}
+        self.workers = workers
+        self.fileset_refresh = fileset_refresh
+        self.uid_ranges = uid_ranges
+        self.user_prefixes = user_prefixes
+        self.exceed_state = exceed_state
+
+        self.cycles = 0
+        self.filesets_timestamp = None
+
+    def refresh(self, full=False):
+        """
+        Forget the quota listing, so the next cycle gets the current quota.
+
+        The filesystems and filesets (with their index) are kept, unless they are older than the
+        fileset refresh interval or a full refresh is asked for.
+        """
+        if full or self.filesets_timestamp is None or time.time() - self.filesets_timestamp >= self.fileset_refresh:
+            self.gpfs.refresh()
+            self.filesets_timestamp = None
+        else:
+            self.gpfs.refresh(['list_quota'])
+
+    def run(self, metrics=None):
+        """
+        Run a single cycle.
+
+        @returns: dict with the nagios stats of the cycle
+        """
+        metrics = metrics or QuotaMetrics('dquota')
+        self.cycles += 1
+
+        target_filesystems = [self.storage[s].filesystem for s in self.storage_names]
+
+        with metrics.phase('list_filesystems'):
+            filesystems = self.gpfs.list_filesystems(target_filesystems).keys()
+        logging.debug("Found the following GPFS filesystems: %s" % (filesystems))
+
+        with metrics.phase('list_filesets'):
+            if self.filesets_timestamp is None:
+                self.filesets_timestamp = time.time()
+            filesets = self.gpfs.list_filesets()
+        logging.debug("Found the following GPFS filesets: %s" % (filesets))
+
+        with metrics.phase('list_quota'):
+            quota = self.gpfs.list_quota()
+
+        # only resolve the users that have quota on the filesystems we process and are in the uid ranges
+        in_ranges = EntityFilter(self.uid_ranges).in_ranges
+        uids = set()
+        for filesystem in set(target_filesystems) & set(quota.keys()):
+            uids.update(uid for uid in quota[filesystem]['USR'] if in_ranges(uid))
+        with metrics.phase('map_uids'):
+            user_id_map = self.uid_resolver.resolve(uids)
+
+        pusher_options = dict(self.pusher_options, metrics=metrics)
+
+        def _process(storage_name):
+            # users that would not be pushed are skipped before their quota entities are created
+            user_filter = EntityFilter(self.uid_ranges, self.user_prefixes, user_id_map)
+            return process_storage(self.storage, self.gpfs, storage_name, filesystems, filesets, quota, user_id_map,
+                                   self.client, self.dry_run, pusher_options, metrics, user_filter,
+                                   log_exceeding=self.exceed_state is None, user_prefixes=self.user_prefixes)
+
+        workers = min(self.workers, len(self.storage_names))
+        if workers > 1:
+            logging.info("Processing %d storages with %d workers", len(self.storage_names), workers)
+            pool = ThreadPool(workers)
+            try:
+                results = pool.map(_process, self.storage_names)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_process(storage_name) for storage_name in self.storage_names]
+
+        logging.debug("GPFS snapshot statistics: %s", self.gpfs.stats)
+
+        if self.exceed_state is not None:
+            self.transitions(results, metrics)
+
+        return self.check(results)
+
+    def transitions(self, results, metrics):
+        """
+        Update the exceed state with the exceeding filesets and users per storage, and log the changes.
+
+        In a dry run, the state is only updated in memory.
+
+        @returns: list of ExceedTransition
+        """
+        transitions = []
+
+        for (storage_name, result) in zip(self.storage_names, results):
+            if result is None:
+                continue  # keep the state of storages that could not be processed
+
+            for (kind, exceeding) in zip(('FILESET', 'USR'), result):
+                changes = self.exceed_state.update(storage_name, kind, exceeding)
+                for change in changes:
+                    metrics.count('exceed_transitions', storage=storage_name, kind=kind,
+                                  transition=change.transition)
+                transitions.extend(changes)
+
+        log_transitions(transitions)
+        if self.dry_run:
+            logging.info("Dry run, not storing the exceed state")
+        else:
+            self.exceed_state.store()
+
+        return transitions
+
+    def check(self, results):
+        """
+        Determine the nagios stats from the exceeding filesets and users per storage.
+
+        The exceeding filesets and users themselves have already been logged while they were processed,
+        or as transitions of the exceed state.
+        """
+        stats = {}
+
+        for (storage_name, result) in zip(self.storage_names, results):
+            if result is None:
+                continue
+
+            (exceeding_filesets, exceeding_users) = result
+
+            stats["%s_fileset_critical" % (storage_name,)] = QUOTA_FILESETS_CRITICAL
+            if exceeding_filesets:
+                stats["%s_fileset" % (storage_name,)] = 1
+                logging.warning("storage_name %s found %d filesets that are exceeding their quota",
+                                storage_name, len(exceeding_filesets))
+            else:
+                stats["%s_fileset" % (storage_name,)] = 0
+                logging.debug("storage_name %s found no filesets that are exceeding their quota" % storage_name)
+
+            stats["%s_users_warning" % (storage_name,)] = QUOTA_USERS_WARNING
+            stats["%s_users_critical" % (storage_name,)] = QUOTA_USERS_CRITICAL
+            if exceeding_users:
+                stats["%s_users" % (storage_name,)] = len(exceeding_users)
+                logging.warning("storage_name %s found %d users who are exceeding their quota" %
+                                (storage_name, len(exceeding_users)))
+            else:
+                stats["%s_users" % (storage_name,)] = 0
+                logging.debug("storage_name %s found no users who are exceeding their quota" % storage_name)
+
+        return stats
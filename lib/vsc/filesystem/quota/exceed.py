@@ -0,0 +1,139 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tracking which users and filesets exceed their quota across the runs of dquota.
+
+Most of the entities that exceed their quota still do so at the next run, ten minutes later.
+The entities that exceeded their quota at the last run are kept in a state file, so each run
+only needs to report the transitions: entities that started exceeding their quota, entities
+whose grace period expired since, and entities that no longer exceed their quota. Logging and
+notifying the offenders then only costs work for the entities that changed.
+
+@author: Andy Georges (Ghent University)
+"""
+
+import logging
+import threading
+import time
+
+from collections import namedtuple
+
+from vsc.filesystem.quota.state import load_state, store_state
+
+EXCEED_STARTED = 'exceeding'
+EXCEED_GRACE_EXPIRED = 'grace_expired'
+EXCEED_RECOVERED = 'recovered'
+
+ExceedTransition = namedtuple("ExceedTransition", ['storage', 'kind', 'name', 'transition', 'since', 'quota'])
+
+
+def _expired(grace):
+    """Has the grace period, as returned by determine_grace_period, run out (rather than still be running)?"""
+    return grace[0] and grace[1] == 0
+
+
+def grace_expired(quota):
+    """Has the grace period expired on any of the filesets of the quota entity?"""
+    return any(_expired(q.expired) or _expired(q.files_expired) for q in quota.quota_map.values())
+
+
+class ExceedState(object):
+    """
+    The users and filesets that exceeded their quota at the last run, per storage and kind.
+
+    For each entity, the time it started exceeding its quota and whether its grace period had expired
+    are kept. Safe to update from several threads, for different storages.
+    """
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.state = load_state(state_path, {})
+        self.lock = threading.Lock()
+
+    def update(self, storage_name, kind, exceeding, timestamp=None):
+        """
+        Replace the exceeding entities of a storage and kind, and determine the transitions since the last run.
+
+        @type kind: string, 'USR' or 'FILESET'
+        @type exceeding: list of (name, quota entity) tuples, as returned by process_user_quota or process_fileset_quota
+        @type timestamp: int, defaults to the current time
+
+        @returns: list of ExceedTransition, the recovered entities have no quota
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+
+        with self.lock:
+            previous = self.state.setdefault(storage_name, {}).get(kind, {})
+            current = {}
+            transitions = []
+
+            for (name, quota) in exceeding:
+                expired = grace_expired(quota)
+                try:
+                    last = previous.pop(name)
+                except KeyError:
+                    current[name] = {'since': timestamp, 'expired': expired}
+                    transitions.append(ExceedTransition(storage_name, kind, name, EXCEED_STARTED, timestamp, quota))
+                    continue
+
+                current[name] = {'since': last['since'], 'expired': expired}
+                if expired and not last['expired']:
+                    transitions.append(
+                        ExceedTransition(storage_name, kind, name, EXCEED_GRACE_EXPIRED, last['since'], quota))
+
+            # what is left no longer exceeds its quota
+            for (name, last) in sorted(previous.items()):
+                transitions.append(ExceedTransition(storage_name, kind, name, EXCEED_RECOVERED, last['since'], None))
+
+            self.state[storage_name][kind] = current
+
+        return transitions
+
+    def exceeding(self, storage_name, kind):
+        """The names of the entities that exceeded their quota at the last update."""
+        with self.lock:
+            return sorted(self.state.get(storage_name, {}).get(kind, {}))
+
+    def store(self):
+        """Store the state for the next run."""
+        with self.lock:
+            store_state(self.state_path, self.state)
+
+
+def log_transitions(transitions):
+    """Log the transitions, the entities that keep exceeding their quota were logged when they started."""
+    for transition in transitions:
+        since = time.strftime("%Y-%m-%d %H:%M", time.localtime(transition.since))
+        if transition.transition == EXCEED_STARTED:
+            logging.warning("%s %s %s started exceeding its quota: %s", transition.storage, transition.kind,
+                            transition.name, transition.quota)
+        elif transition.transition == EXCEED_GRACE_EXPIRED:
+            logging.warning("%s %s %s exceeds its quota since %s and its grace period expired: %s",
+                            transition.storage, transition.kind, transition.name, since, transition.quota)
+        else:
+            logging.info("%s %s %s no longer exceeds its quota, it did since %s", transition.storage,
+                         transition.kind, transition.name, since)
@@ -0,0 +1,158 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Forecasting when filesets run out of inodes.
+
+Each inode_log run feeds the inode usage of all filesets to the forecaster, which keeps a
+least-squares fit of the usage over time per fileset. Older samples weigh exponentially less,
+so the growth rate follows the recent behaviour of the fileset. The fit is kept as a handful of
+running sums, which is all the state that is stored between runs.
+
+@author: Andy Georges (Ghent University)
+"""
+
+import logging
+import time
+
+from collections import namedtuple
+
+from vsc.filesystem.quota.state import load_state, store_state
+
+DAY = 24 * 60 * 60
+
+FORECAST_HALF_LIFE = 7 * DAY  # weight of a sample halves every week
+FORECAST_HORIZON = 14 * DAY  # report filesets that run out within two weeks
+FORECAST_MIN_SAMPLES = 3
+
+InodeForecast = namedtuple("InodeForecast", ['used', 'maxinodes', 'rate', 'exhausted'])
+
+# the running sums of the weighted fit, with the time in days since the first sample
+_SUMS = ('n', 't', 'u', 'tt', 'tu')
+
+
+class InodeForecaster(object):
+    """
+    Rolling per-fileset growth rate of the inode usage, stored in a state file between runs.
+    """
+
+    def __init__(self, state_path, half_life=FORECAST_HALF_LIFE, horizon=FORECAST_HORIZON,
+                 min_samples=FORECAST_MIN_SAMPLES):
+        self.state_path = state_path
+        self.half_life = half_life
+        self.horizon = horizon
+        self.min_samples = min_samples
+
+        self.state = load_state(state_path, {})
+
+    def update(self, filesets, quota, timestamp=None):
+        """
+        Add the current inode usage of all filesets and forecast when they run out of inodes.
+
+        All filesets are processed as columns, as in process_inodes_information_all.
+
+        @type filesets: dict with the filesets per filesystem, as returned by GpfsOperations.list_filesets
+        @type quota: dict with the quota per filesystem, as returned by GpfsOperations.list_quota
+
+        @returns: dict with (filesystem, {filesetname: InodeForecast}) key-value pairs, for the filesets
+                  that are projected to run out of inodes within the horizon
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+
+        keys = []
+        filesystems = []
+        names = []
+        used = []
+        maxinodes = []
+
+        for (filesystem, fs_filesets) in filesets.items():
+            try:
+                fileset_quota = quota[filesystem]['FILESET']
+            except KeyError:
+                logging.warning("No fileset quota information for filesystem %s", filesystem)
+                continue
+
+            for (fs_key, fs_info) in fs_filesets.items():
+                try:
+                    files_usage = int(fileset_quota[fs_key][0].filesUsage)
+                except (KeyError, IndexError):
+                    logging.warning("No quota information for fileset %s on filesystem %s", fs_key, filesystem)
+                    continue
+                keys.append("%s:%s" % (filesystem, fs_key))
+                filesystems.append(filesystem)
+                names.append(fs_info['filesetName'])
+                used.append(files_usage)
+                maxinodes.append(int(fs_info['maxInodes']))
+
+        previous = [self.state.get(key) for key in keys]
+        start = [p['start'] if p else timestamp for p in previous]
+        last = [p['last'] if p else timestamp for p in previous]
+
+        # decay the old sums, then add the new sample
+        decay = [0.5 ** (float(timestamp - seen) / self.half_life) for seen in last]
+        t = [float(timestamp - s) / DAY for s in start]
+        sums = {}
+        for name in _SUMS:
+            sums[name] = [(p['sums'][name] * d if p else 0.0) for (p, d) in zip(previous, decay)]
+        sums['n'] = [n + 1.0 for n in sums['n']]
+        sums['t'] = [s + x for (s, x) in zip(sums['t'], t)]
+        sums['u'] = [s + y for (s, y) in zip(sums['u'], used)]
+        sums['tt'] = [s + x * x for (s, x) in zip(sums['tt'], t)]
+        sums['tu'] = [s + x * y for (s, x, y) in zip(sums['tu'], t, used)]
+        samples = [(p['samples'] if p else 0) + 1 for p in previous]
+
+        # weighted least squares slope, in inodes per day
+        denominator = [n * tt - st * st for (n, tt, st) in zip(sums['n'], sums['tt'], sums['t'])]
+        rate = [(n * tu - st * su) / d if d > 1e-12 else 0.0
+                for (n, tu, st, su, d) in zip(sums['n'], sums['tu'], sums['t'], sums['u'], denominator)]
+
+        self.state = {}
+        for (row, key) in enumerate(keys):
+            self.state[key] = {
+                'start': start[row],
+                'last': timestamp,
+                'samples': samples[row],
+                'sums': dict((name, sums[name][row]) for name in _SUMS),
+            }
+
+        forecasts = {}
+        for row in range(len(keys)):
+            if samples[row] < self.min_samples or rate[row] <= 0 or maxinodes[row] <= 0:
+                continue
+            left = max(maxinodes[row] - used[row], 0) / rate[row] * DAY
+            if left <= self.horizon:
+                forecasts.setdefault(filesystems[row], dict())[names[row]] = InodeForecast(
+                    used=used[row],
+                    maxinodes=maxinodes[row],
+                    rate=rate[row],
+                    exhausted=int(timestamp + left),
+                )
+
+        return forecasts
+
+    def store(self):
+        """Store the state for the next run."""
+        store_state(self.state_path, self.state)
@@ -0,0 +1,218 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Append-only columnar store for the history of the quota information.
+
+The store is partitioned per filesystem and per month. Each partition holds one file per
+column, with a fixed-width little-endian 64-bit integer per row, so a run only appends to the
+column files. The rows of an entity are appended contiguously, and each append writes a small
+sorted segment mapping the (hashed) key of each entity to its rows. The history of a single entity
+is read with a binary search per segment and a contiguous read of its rows per column, without
+going through the other entities.
+
+    <root>/<filesystem>/<YYYYMM>/<column>.col
+    <root>/<filesystem>/<YYYYMM>/<first row>-<end row>-<timestamp>.seg
+
+A segment is written atomically after the columns, so the segments determine the valid rows:
+rows of an interrupted append are ignored and overwritten later on. Column files that hold fewer
+rows than the segments refer to are corrupt. Appends to a partition are serialised with a lock.
+
+@author: Andy Georges (Ghent University)
+"""
+
+import fcntl
+import logging
+import os
+import re
+import struct
+import time
+
+from collections import namedtuple
+
+from vsc.filesystem.quota.index import IndexReader, key_hash, write_index
+from vsc.filesystem.quota.tools import QuotaException
+
+HISTORY_COLUMNS = (
+    'timestamp',
+    'blockUsage', 'blockQuota', 'blockLimit', 'blockInDoubt',
+    'filesUsage', 'filesQuota', 'filesLimit', 'filesInDoubt',
+)
+HISTORY_LOCK = '.lock'
+
+# the fileset id is stored as a column as well, -1 for records without a fileset
+_STORED_COLUMNS = ('fileset',) + HISTORY_COLUMNS
+_NO_FILESET = -1
+
+_ROW_SIZE = 8
+_SEGMENT_REGEX = re.compile(r'^(\d+)-(\d+)-(\d+)\.seg$')
+
+HistoryRecord = namedtuple('HistoryRecord', ('fileset',) + HISTORY_COLUMNS)
+
+
+def history_key(kind, entity):
+    """The key of the quota records of the entity (user or fileset id) in the index."""
+    return "%s:%s" % (kind, entity)
+
+
+def partition_name(timestamp):
+    """The name of the (monthly) partition holding the records at timestamp."""
+    return time.strftime("%Y%m", time.gmtime(timestamp))
+
+
+def _segments(partition):
+    """The (first row, end row, timestamp, path) of the segments of a partition, oldest first."""
+    segments = []
+    for name in os.listdir(partition):
+        match = _SEGMENT_REGEX.match(name)
+        if match:
+            (first, end, timestamp) = [int(group) for group in match.groups()]
+            segments.append((first, end, timestamp, os.path.join(partition, name)))
+    return sorted(segments)
+
+
+class QuotaHistory(object):
+    """
+    The quota history stored under root.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def partition(self, filesystem, timestamp):
+        """The directory of the partition of the filesystem holding the records at timestamp."""
+        return os.path.join(self.root, filesystem, partition_name(timestamp))
+
+    def partitions(self, filesystem, start=None, end=None):
+        """The directories of the partitions of the filesystem that overlap with [start, end], oldest first."""
+        directory = os.path.join(self.root, filesystem)
+        if not os.path.isdir(directory):
+            return []
+
+        names = sorted(os.listdir(directory))
+        if start is not None:
+            names = [n for n in names if n >= partition_name(start)]
+        if end is not None:
+            names = [n for n in names if n <= partition_name(end)]
+
+        return [os.path.join(directory, n) for n in names]
+
+    def append(self, filesystem, quota, timestamp=None):
+        """
+        Append the quota information of a filesystem.
+
+        @type quota: dict with the quota per kind, per entity, as in GpfsOperations.list_quota()[filesystem]
+        @type timestamp: int, the time of the records, defaults to the current time
+
+        @returns: the number of appended rows
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+
+        partition = self.partition(filesystem, timestamp)
+        if not os.path.exists(partition):
+            os.makedirs(partition)
+
+        with open(os.path.join(partition, HISTORY_LOCK), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            segments = _segments(partition)
+            first = segments and max(segment[1] for segment in segments) or 0
+            row = first
+
+            entries = []
+            columns = dict((column, []) for column in _STORED_COLUMNS)
+            for (kind, entities) in quota.items():
+                for (entity, records) in entities.items():
+                    if not records:
+                        continue
+                    # the segment maps the key hash to the first row and the number of rows
+                    entries.append((key_hash(history_key(kind, entity)), row, len(records)))
+                    for record in records:
+                        if record.filesetname:
+                            columns['fileset'].append(int(record.filesetname))
+                        else:
+                            columns['fileset'].append(_NO_FILESET)
+                        columns['timestamp'].append(timestamp)
+                        for column in HISTORY_COLUMNS[1:]:
+                            columns[column].append(int(getattr(record, column)))
+                    row += len(records)
+
+            appended = row - first
+            paths = [os.path.join(partition, "%s.col" % column) for column in _STORED_COLUMNS]
+            for path in paths:
+                size = os.path.exists(path) and os.path.getsize(path) or 0
+                if size < first * _ROW_SIZE:
+                    raise QuotaException("Column %s holds fewer rows than the segments of %s refer to" %
+                                         (path, partition))
+
+            for (column, path) in zip(_STORED_COLUMNS, paths):
+                with open(path, 'ab') as column_file:
+                    # drop the rows of an earlier, interrupted append
+                    column_file.truncate(first * _ROW_SIZE)
+                    column_file.write(struct.pack("<%dq" % appended, *columns[column]))
+
+            write_index(os.path.join(partition, "%012d-%012d-%d.seg" % (first, row, timestamp)), entries)
+
+        logging.info("Appended %d quota history rows for %s to %s", appended, filesystem, partition)
+        return appended
+
+    def _read(self, partition, column, first, count):
+        """Read count rows of a column, starting at row first."""
+        path = os.path.join(partition, "%s.col" % column)
+        with open(path, 'rb') as column_file:
+            column_file.seek(first * _ROW_SIZE)
+            data = column_file.read(count * _ROW_SIZE)
+        if len(data) != count * _ROW_SIZE:
+            raise QuotaException("Column %s of %s holds fewer rows than its segments refer to" % (column, partition))
+        return struct.unpack("<%dq" % count, data)
+
+    def history(self, filesystem, kind, entity, start=None, end=None):
+        """
+        Get the history of the quota of an entity (user or fileset id), for all its filesets.
+
+        @type kind: string, 'USR' or 'FILESET'
+        @type start: int, only records from this time on
+        @type end: int, only records up to this time
+
+        @returns: list of HistoryRecord, sorted by time
+        """
+        hashed = key_hash(history_key(kind, entity))
+        records = []
+
+        for partition in self.partitions(filesystem, start, end):
+            for (_, _, timestamp, path) in _segments(partition):
+                if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+                    continue
+                with IndexReader(path) as index:
+                    rows = index.find(hashed)
+
+                for (first, count) in rows:
+                    values = [self._read(partition, column, first, count) for column in _STORED_COLUMNS]
+                    for row in zip(*values):
+                        fileset = str(row[0]) if row[0] != _NO_FILESET else None
+                        records.append(HistoryRecord(fileset, *row[1:]))
+
+        return records
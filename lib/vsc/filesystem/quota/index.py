@@ -0,0 +1,109 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Sorted, fixed-size index files mapping hashed keys to a pair of numbers, e.g., an offset and a length.
+
+The index is written once, sorted by key hash, and looked up by memory-mapping it and doing a binary
+search, so a lookup only touches a few pages of the index. Used by the query index of the archived
+logs and by the quota history store.
+
+@author: Andy Georges (Ghent University)
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+
+from vsc.filesystem.quota.state import atomic_write
+
+# key hash and two unsigned numbers, whose meaning is up to the user of the index
+INDEX_ENTRY = struct.Struct('<QQI')
+
+
+def key_hash(key):
+    """The 64-bit hash of a key, the first 8 bytes of its SHA-1. Different keys may have the same hash."""
+    return struct.unpack('<Q', hashlib.sha1(key.encode('utf-8')).digest()[:8])[0]
+
+
+def write_index(path, entries):
+    """
+    Write the (key hash, number, number) entries as an index to path, atomically.
+
+    @returns: the number of entries
+    """
+    entries = sorted(entries)
+    atomic_write(path, lambda index: index.writelines(INDEX_ENTRY.pack(*entry) for entry in entries))
+    return len(entries)
+
+
+def find_entries(index, hashed):
+    """Binary search of the entries with the key hash in the (memory-mapped) index, yields (number, number)."""
+    entries = len(index) // INDEX_ENTRY.size
+    (low, high) = (0, entries)
+    while low < high:
+        middle = (low + high) // 2
+        if INDEX_ENTRY.unpack_from(index, middle * INDEX_ENTRY.size)[0] < hashed:
+            low = middle + 1
+        else:
+            high = middle
+
+    while low < entries:
+        (entry_hash, first, second) = INDEX_ENTRY.unpack_from(index, low * INDEX_ENTRY.size)
+        if entry_hash != hashed:
+            break
+        yield (first, second)
+        low += 1
+
+
+class IndexReader(object):
+    """
+    Context manager memory-mapping an index written by write_index, for one or more lookups.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = None
+        self._file = None
+
+    def __enter__(self):
+        # an empty file cannot be memory-mapped, it has no entries anyway
+        if os.path.getsize(self.path):
+            self._file = open(self.path, 'rb')
+            self.index = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if self.index is not None:
+            self.index.close()
+            self._file.close()
+        return False
+
+    def find(self, hashed):
+        """The (number, number) pairs of the entries with the key hash."""
+        if self.index is None:
+            return []
+        return list(find_entries(self.index, hashed))
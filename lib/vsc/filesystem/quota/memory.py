@@ -0,0 +1,246 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Memory profiling of the phases of the quota scripts, with tracemalloc.
+
+The profiler takes a snapshot of the traced allocations at the start and the end of each phase
+of QuotaMetrics, and reports per phase the traced memory at its start and end, the peak during
+the phase, and the allocation sites that grew the most. Tracing the allocations slows the
+scripts down considerably, so this is meant for finding out where the memory goes, not for
+regular runs.
+
+Python 2 needs the pytracemalloc backport (with a patched interpreter) for this. Without
+tracemalloc, the profiler falls back to the resident set size of the process at the start and
+the end of each phase, and its maximum so far (ru_maxrss) as the peak, without allocation sites.
+
+@author: Andy Georges (Ghent University)
+"""
+
+import logging
+import resource
+import threading
+
+from collections import namedtuple
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from vsc.filesystem.quota.state import atomic_write
+
+MEMORY_PROFILE_TOP = 10  # allocation sites reported per phase
+
+MEMORY_PROFILE_TRACEMALLOC = 'tracemalloc'
+MEMORY_PROFILE_RSS = 'rss'
+
+PhaseMemory = namedtuple('PhaseMemory', ['phase', 'labels', 'start', 'peak', 'end', 'top'])
+AllocationSite = namedtuple('AllocationSite', ['site', 'size', 'count'])
+
+
+def _phase_name(phase, labels):
+    return " ".join([phase] + ["%s=%s" % label for label in sorted(labels.items())])
+
+
+def _maxrss():
+    """The maximal resident set size of the process so far, in bytes (ru_maxrss is in KiB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _rss():
+    """The current resident set size of the process in bytes, or its maximum so far if that is unknown."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, IndexError, ValueError):
+        return _maxrss()
+
+
+class MemoryProfiler(object):
+    """
+    Trace the allocations during the phases of a run, see QuotaMetrics.
+
+    Phases may be nested. The peak of a phase includes the peaks of the phases nested in it. When
+    phases run concurrently (e.g., dquota with several workers), their figures include each other's
+    allocations. The peak is only per phase with tracemalloc.reset_peak (python 3.9 and later), before
+    that it is the peak since the start of the tracing.
+
+    Without tracemalloc, the start and end of a phase are the resident set size of the whole process,
+    and the peak is the maximal resident set size of the process so far.
+    """
+
+    def __init__(self, top=MEMORY_PROFILE_TOP):
+        self.top = top
+        self.phases = {}
+        self.tracing = False
+        self.mode = None  # how the phases are profiled
+        self.active = False
+
+        self._open = {}  # the peaks of the phases in progress
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        """Can the allocations be traced in this interpreter?"""
+        return tracemalloc is not None
+
+    def start(self, fallback=True):
+        """
+        Start tracing the allocations, or fall back to the resident set size if that is not possible.
+
+        @returns: True if the phases are profiled
+        """
+        if self.available():
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.tracing = True
+            self.mode = MEMORY_PROFILE_TRACEMALLOC
+        elif fallback:
+            logging.warning("Cannot trace the allocations: tracemalloc is not available, "
+                            "profiling the resident set size per phase instead")
+            self.mode = MEMORY_PROFILE_RSS
+        else:
+            logging.warning("Cannot profile the memory usage: tracemalloc is not available")
+        self.active = self.mode is not None
+        return self.active
+
+    def stop(self):
+        """Stop tracing the allocations, the profiled phases are kept."""
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+        self.active = False
+
+    def _snapshot(self):
+        """A snapshot of the traced allocations, without those made while taking snapshots."""
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+
+    def _fold_peak(self):
+        """Add the peak so far to the open phases and start measuring the next peak."""
+        (_, peak) = tracemalloc.get_traced_memory()
+        with self._lock:
+            for frame in self._open.values():
+                frame['peak'] = max(frame['peak'], peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    @contextmanager
+    def phase(self, phase, **labels):
+        """Context manager profiling the memory usage of the code it wraps as the given phase."""
+        if self.active and self.mode == MEMORY_PROFILE_RSS:
+            start = _rss()
+            try:
+                yield
+            finally:
+                end = _rss()
+                self.phases[_phase_name(phase, labels)] = PhaseMemory(
+                    phase, labels, start, max(_maxrss(), start, end), end, [])
+            return
+
+        if not self.tracing:
+            yield
+            return
+
+        self._fold_peak()
+        start = self._snapshot()
+        (current, _) = tracemalloc.get_traced_memory()
+        frame = {'peak': current}
+        with self._lock:
+            self._open[id(frame)] = frame
+
+        try:
+            yield
+        finally:
+            self._fold_peak()
+            with self._lock:
+                del self._open[id(frame)]
+
+            end = self._snapshot()
+            top = [AllocationSite(str(stat.traceback[0]), stat.size_diff, stat.count_diff)
+                   for stat in end.compare_to(start, 'lineno')[:self.top]]
+            self.phases[_phase_name(phase, labels)] = PhaseMemory(
+                phase, labels,
+                sum(trace.size for trace in start.traces),
+                frame['peak'],
+                sum(trace.size for trace in end.traces),
+                top,
+            )
+
+    def report(self):
+        """
+        A report of the profiled phases, sorted by phase, that can be compared with the report of another run.
+
+        @returns: list of lines
+        """
+        lines = ["profile %s" % (self.mode,)]
+        for name in sorted(self.phases):
+            memory = self.phases[name]
+            lines.append("phase %s" % (name,))
+            lines.append("  start %d end %d retained %+d peak %d" % (
+                memory.start, memory.end, memory.end - memory.start, memory.peak))
+            for site in memory.top:
+                lines.append("  site %s %+d bytes %+d blocks" % (site.site, site.size, site.count))
+        return lines
+
+    def log_report(self):
+        """Log the report, one line per phase and allocation site."""
+        for line in self.report():
+            logging.info("memory profile: %s", line.strip())
+
+    def write_report(self, path):
+        """Write the report as a text file to path, replacing any previous report."""
+        lines = self.report()
+        atomic_write(path, lambda report: report.write("\n".join(lines) + "\n"), binary=False)
+
+
+def start_memory_profiler(enabled, top=MEMORY_PROFILE_TOP):
+    """
+    Start profiling the memory usage, for the --profile-memory option of the quota scripts.
+
+    @returns: MemoryProfiler instance that is profiling, or None if not enabled
+    """
+    if not enabled:
+        return None
+    profiler = MemoryProfiler(top)
+    if not profiler.start():
+        return None
+    return profiler
+
+
+def report_memory_profile(profiler, path=None):
+    """Log the memory profile and write it to path, if given. Does nothing without a profiler."""
+    if profiler is None:
+        return
+    profiler.log_report()
+    if path:
+        try:
+            profiler.write_report(path)
+        except (IOError, OSError) as err:
+            logging.error("Cannot write the memory profile to %s: %s", path, err)
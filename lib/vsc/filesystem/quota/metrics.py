@@ -0,0 +1,195 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Instrumentation of the quota scripts.
+
+Collects the time spent in each phase of a run (GPFS listing, building the maps, pushing, ...)
+and counters such as the number of pushed records, and exports them as a textfile for the
+node_exporter textfile collector and as nagios performance data.
+
+@author: Andy Georges (Ghent University)
+"""
+
+import threading
+import time
+
+from contextlib import contextmanager
+
+from vsc.filesystem.quota.state import atomic_write
+
+METRICS_PREFIX = 'vsc_quota'
+
+PHASE_METRIC = 'phase_duration_seconds'
+
+METRICS_HELP = {
+    PHASE_METRIC: 'Time spent in each phase of the last run.',
+    'last_run_timestamp_seconds': 'Time at which the last run finished.',
+    'pushed_records': 'Number of quota records pushed to the account page in the last run.',
+    'pushed_batches': 'Number of requests made to the account page in the last run.',
+    'pushed_bytes': 'Size of the serialised quota records pushed to the account page in the last run.',
+    'skipped_records': 'Number of unchanged quota records that were not pushed in the last run.',
+    'log_bytes': 'Size of the compressed quota or inode log written in the last run.',
+    'history_rows': 'Number of rows appended to the quota history store in the last run.',
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class QuotaMetrics(object):
+    """
+    Phase durations and counters for a single run of one of the quota scripts.
+
+    Durations and counters with the same name and labels are summed. Safe to use from several threads.
+    """
+
+    def __init__(self, script, profiler=None):
+        """
+        @type profiler: MemoryProfiler instance that profiles the memory usage of the phases
+        """
+        self.script = script
+        self.profiler = profiler
+        self.durations = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def add_duration(self, phase, seconds, **labels):
+        """Add seconds to the duration of the given phase."""
+        key = self._key(phase, labels)
+        with self.lock:
+            self.durations[key] = self.durations.get(key, 0.0) + seconds
+
+    def count(self, name, value=1, **labels):
+        """Add value to the named counter."""
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def _profile(self, phase, **labels):
+        """Profile the memory usage of the code it wraps as the given phase, if there is a profiler."""
+        if self.profiler is None:
+            yield
+        else:
+            with self.profiler.phase(phase, **labels):
+                yield
+
+    @contextmanager
+    def phase(self, phase, **labels):
+        """
+        Context manager timing the code it wraps as the given phase.
+
+        With a profiler, the time spent profiling the memory usage is included.
+        """
+        start = time.time()
+        try:
+            with self._profile(phase, **labels):
+                yield
+        finally:
+            self.add_duration(phase, time.time() - start, **labels)
+
+    def timed_iter(self, iterable, phase, **labels):
+        """
+        Wrap an iterable, timing how long it takes to produce its items as the given phase.
+
+        This allows timing the producer of a stream separately from its consumer. With a profiler,
+        the memory usage is profiled as the given phase from the first item until the stream ends,
+        so this includes what the consumer allocates in the meantime.
+        """
+        iterator = iter(iterable)
+        seconds = 0.0
+        try:
+            with self._profile(phase, **labels):
+                while True:
+                    start = time.time()
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        break
+                    finally:
+                        seconds += time.time() - start
+                    yield item
+        finally:
+            self.add_duration(phase, seconds, **labels)
+
+    def perfdata(self):
+        """
+        The phase durations as nagios performance data.
+
+        @returns: dict with (label values and phase joined by underscores, suffixed with _seconds; rounded seconds)
+        """
+        with self.lock:
+            durations = list(self.durations.items())
+
+        perfdata = {}
+        for ((phase, labels), seconds) in durations:
+            name = "_".join([str(value) for (_, value) in labels] + [phase, 'seconds'])
+            perfdata[name] = round(seconds, 3)
+        return perfdata
+
+    def textfile(self):
+        """
+        The metrics in the Prometheus text exposition format.
+
+        Every sample is labelled with the script name.
+        """
+        with self.lock:
+            samples = [(PHASE_METRIC, (('phase', phase),) + labels, value)
+                       for ((phase, labels), value) in self.durations.items()]
+            samples.extend([(name, labels, value) for ((name, labels), value) in self.counters.items()])
+        samples.append(('last_run_timestamp_seconds', (), time.time()))
+
+        lines = []
+        for name in sorted(set(sample[0] for sample in samples)):
+            metric = "%s_%s" % (METRICS_PREFIX, name)
+            lines.append("# HELP %s %s" % (metric, METRICS_HELP.get(name, name.replace('_', ' '))))
+            lines.append("# TYPE %s gauge" % (metric,))
+            for (sample_name, labels, value) in sorted(samples):
+                if sample_name != name:
+                    continue
+                labels = (('script', self.script),) + labels
+                lines.append("%s{%s} %s" % (
+                    metric,
+                    ",".join('%s="%s"' % (label, _escape(label_value)) for (label, label_value) in labels),
+                    repr(float(value)),
+                ))
+
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """
+        Write the metrics to path, for the node_exporter textfile collector.
+
+        The file is written next to its destination first and then renamed, so the collector
+        never reads a partial file.
+        """
+        text = self.textfile()
+        atomic_write(path, lambda textfile: textfile.write(text), binary=False, permissions=0o644)
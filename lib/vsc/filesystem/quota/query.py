@@ -0,0 +1,239 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Querying the quota and inode logs archived by quota_log and inode_log.
+
+Every archived log gets an index segment the first time it is seen: a data file with one
+compressed JSON record per user or fileset, and a sorted index of (key hash, offset, length)
+entries. Queries memory-map the index of each relevant log, look up the key with a binary search
+and only read and decompress the byte range of the matching record.
+
+@author: Andy Georges (Ghent University)
+"""
+
+import json
+import logging
+import os
+import re
+import time
+import zlib
+
+from collections import namedtuple
+
+from vsc.filesystem.gpfs import GpfsQuota
+from vsc.filesystem.quota.archive import read_json_archive
+from vsc.filesystem.quota.index import IndexReader, key_hash, write_index
+from vsc.filesystem.quota.state import atomic_write, load_state, store_state
+
+QUERY_SOURCES = ('quota', 'inodes')
+QUERY_MANIFEST = 'manifest.json'
+
+# gpfs_<source>_<date>_<filesystem><extension>, as named by archive_filename
+ARCHIVE_NAME_REGEX = re.compile(r'^gpfs_(?P<source>quota|inodes)_(?P<date>\d{8}-\d{2}:\d{2})_(?P<filesystem>[^.]+)')
+
+QueryResult = namedtuple('QueryResult', ['timestamp', 'filesystem', 'source', 'record'])
+
+
+def query_key(kind, name):
+    """The key of a user or fileset, known by id or by name, in the index."""
+    return "%s:%s" % (kind, name)
+
+
+def parse_archive_name(filename):
+    """
+    Get the information in the name of an archived log.
+
+    @returns: tuple (source, timestamp, filesystem) or None if this is not an archived log
+    """
+    match = ARCHIVE_NAME_REGEX.match(filename)
+    if not match or filename.startswith('.'):
+        return None
+    timestamp = int(time.mktime(time.strptime(match.group('date'), "%Y%m%d-%H:%M")))
+    return (match.group('source'), timestamp, match.group('filesystem'))
+
+
+def archive_records(source, data):
+    """
+    Split the data of an archived log into the records per user or fileset.
+
+    Quota records are found under the id and the name of the user or fileset, inode records
+    under the id and the name of the fileset.
+
+    @returns: generator of (keys, record) tuples
+    """
+    if source == 'quota':
+        for (kind, entities) in data.items():
+            for (entity, quotas) in entities.items():
+                quotas = [dict(zip(GpfsQuota._fields, quota)) for quota in quotas]
+                keys = set([query_key(kind, entity)])
+                keys.update(query_key(kind, quota['name']) for quota in quotas if quota['name'])
+                yield (sorted(keys), {'kind': kind, 'id': entity, 'quota': quotas})
+    else:
+        for (fileset, info) in data.items():
+            keys = set([query_key('FILESET', fileset)])
+            if info.get('filesetName'):
+                keys.add(query_key('FILESET', info['filesetName']))
+            yield (sorted(keys), {'kind': 'FILESET', 'id': fileset, 'inodes': info})
+
+
+class QueryIndex(object):
+    """
+    The index segments of the archived logs, kept in a single directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, QUERY_MANIFEST)
+        self.manifest = load_state(self.manifest_path, {})
+
+    def _segment(self, name):
+        return (os.path.join(self.directory, name + '.dat'), os.path.join(self.directory, name + '.idx'))
+
+    def build_segment(self, path, source):
+        """Index a single archived log."""
+        (data_path, index_path) = self._segment(os.path.basename(path))
+
+        entries = []
+        chunks = []
+        offset = 0
+        for (keys, record) in archive_records(source, read_json_archive(path)):
+            chunk = zlib.compress(json.dumps({'keys': keys, 'record': record}).encode('utf-8'))
+            chunks.append(chunk)
+            # the index maps the key hash to the offset and length of the record in the data file
+            entries.extend((key_hash(key), offset, len(chunk)) for key in keys)
+            offset += len(chunk)
+
+        atomic_write(data_path, lambda segment: segment.writelines(chunks))
+        write_index(index_path, entries)
+
+        return len(chunks)
+
+    def update(self, locations):
+        """
+        Bring the index up to date with the archived logs in the given directories.
+
+        Only logs that are new or changed since the last update are indexed, and the segments
+        of logs that are no longer there are removed.
+
+        @returns: the number of (re)indexed logs
+        """
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        seen = {}
+        indexed = 0
+        for location in locations:
+            if not os.path.isdir(location):
+                continue
+            for filename in os.listdir(location):
+                info = parse_archive_name(filename)
+                if info is None:
+                    continue
+                path = os.path.join(location, filename)
+                st = os.stat(path)
+                entry = {
+                    'source': info[0],
+                    'timestamp': info[1],
+                    'filesystem': info[2],
+                    'size': st.st_size,
+                    'mtime': int(st.st_mtime),
+                }
+                seen[filename] = entry
+                if self.manifest.get(filename) != entry:
+                    try:
+                        records = self.build_segment(path, info[0])
+                    except Exception as err:
+                        logging.warning("Cannot index %s: %s", path, err)
+                        del seen[filename]
+                        continue
+                    logging.debug("Indexed %d records of %s", records, path)
+                    indexed += 1
+
+        for filename in set(self.manifest) - set(seen):
+            for segment_path in self._segment(filename):
+                if os.path.exists(segment_path):
+                    os.unlink(segment_path)
+
+        self.manifest = seen
+        store_state(self.manifest_path, self.manifest)
+
+        return indexed
+
+    def lookup(self, filename, keys):
+        """
+        Get the records of an indexed log that match any of the keys.
+
+        Only the index and the byte ranges of the matching records are read.
+        """
+        (data_path, index_path) = self._segment(filename)
+
+        records = []
+        offsets = set()
+        with IndexReader(index_path) as index:
+            with open(data_path, 'rb') as data_file:
+                for key in keys:
+                    for (offset, length) in index.find(key_hash(key)):
+                        if offset in offsets:
+                            continue
+                        data_file.seek(offset)
+                        chunk = json.loads(zlib.decompress(data_file.read(length)).decode('utf-8'))
+                        # the hash may collide
+                        if key in chunk['keys']:
+                            offsets.add(offset)
+                            records.append(chunk['record'])
+
+        return records
+
+    def query(self, kind, names, start=None, end=None, filesystem=None, source=None):
+        """
+        Get the archived records of users or filesets.
+
+        @type kind: string, 'USR' or 'FILESET'
+        @type names: list of ids or names of the users or filesets
+        @type start: int, only logs from this time on
+        @type end: int, only logs up to this time
+        @type filesystem: string, only logs of this filesystem
+        @type source: string, only 'quota' or 'inodes' logs
+
+        @returns: list of QueryResult, sorted by time
+        """
+        keys = [query_key(kind, name) for name in names]
+        results = []
+
+        for (filename, entry) in self.manifest.items():
+            if start is not None and entry['timestamp'] < start:
+                continue
+            if end is not None and entry['timestamp'] > end:
+                continue
+            if filesystem is not None and entry['filesystem'] != filesystem:
+                continue
+            if source is not None and entry['source'] != source:
+                continue
+            for record in self.lookup(filename, keys):
+                results.append(QueryResult(entry['timestamp'], entry['filesystem'], entry['source'], record))
+
+        results.sort(key=lambda r: (r.timestamp, r.filesystem, r.source, r.record['id']))
+        return results
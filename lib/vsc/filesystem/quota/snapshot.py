@@ -0,0 +1,187 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+A snapshot of the GPFS information used during a single run of the quota scripts.
+
+Listing the filesystems, filesets and quota runs expensive GPFS admin commands, so the
+results are obtained once per run and shared by everything that needs them.
+
+The listings can also be shared between the scripts that run around the same time, through
+a cache directory. Each listing is kept in its own file, with the time it was obtained. The
+first script that needs a listing which is missing or older than the maximal age obtains it
+from GPFS, while holding a lock on the file, so the other scripts wait and then reuse it.
+
+The listings are pickled, so only a cache directory and files that are owned by the user running
+the script, and that nobody else can write to, are used.
+
+@author: Andy Georges (Ghent University)
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+import stat
+import threading
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from vsc.filesystem.quota.state import atomic_write
+from vsc.filesystem.quota.tools import index_filesets
+
+GPFS_SNAPSHOT_CACHE = '/var/cache/quota/gpfs-snapshot'
+GPFS_SNAPSHOT_MAX_AGE = 5 * 60
+
+
+def _trusted(path):
+    """Is path owned by the current user, and not writable by the group or others?"""
+    st = os.lstat(path)
+    return st.st_uid == os.getuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+class GpfsSnapshot(object):
+    """
+    Wrapper around GpfsOperations that memoises the listings for the lifetime of the instance.
+
+    The filesets are returned indexed per filesystem, see vsc.filesystem.quota.tools.FilesetIndex.
+    All other attributes are those of the wrapped GpfsOperations instance.
+
+    With a cache directory and a positive maximal age (in seconds), listings that another
+    process stored in the cache directory less than max_age ago are reused.
+    """
+
+    def __init__(self, gpfs, cache_dir=None, max_age=0):
+        self.gpfs = gpfs
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.stats = {'hits': 0, 'misses': 0, 'shared': 0}
+
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.gpfs, name)
+
+    def _memoize(self, name, convert, args, kwargs):
+        """
+        Call the named GpfsOperations method only the first time it is used with these arguments.
+
+        The lock is held while calling GPFS, so concurrent users wait for the single listing.
+        """
+        key = (name, repr(args), repr(sorted(kwargs.items())))
+
+        with self._lock:
+            try:
+                result = self._cache[key]
+                self.stats['hits'] += 1
+            except KeyError:
+                if self.cache_dir and self.max_age > 0:
+                    result = convert(self._shared(name, key, args, kwargs))
+                else:
+                    result = convert(self._list(name, args, kwargs))
+                self._cache[key] = result
+                self.stats['misses'] += 1
+
+        return result
+
+    def _list(self, name, args, kwargs):
+        logging.debug("Obtaining %s%s from GPFS", name, args)
+        return getattr(self.gpfs, name)(*args, **kwargs)
+
+    def _shared(self, name, key, args, kwargs):
+        """
+        Get the listing from the cache directory, or from GPFS if there is no fresh one.
+
+        The listing is obtained from GPFS while holding the lock, so concurrent scripts do not
+        all run the same GPFS command.
+        """
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, 0o700)
+        if not _trusted(self.cache_dir):
+            logging.warning("Not sharing GPFS information through %s, it is not owned by us or is writable by others",
+                            self.cache_dir)
+            return self._list(name, args, kwargs)
+
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        path = os.path.join(self.cache_dir, "%s-%s.pickle" % (name, digest))
+
+        with open(path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                if not _trusted(path):
+                    raise ValueError("not owned by us or writable by others")
+                with open(path, 'rb') as cached:
+                    snapshot = pickle.load(cached)
+                age = time.time() - snapshot['timestamp']
+                if snapshot['key'] == key and 0 <= age <= self.max_age:
+                    logging.debug("Reusing %s%s obtained %d seconds ago", name, args, age)
+                    self.stats['shared'] += 1
+                    return snapshot['result']
+            except (IOError, OSError, EOFError, ValueError, KeyError, TypeError, pickle.UnpicklingError) as err:
+                logging.debug("No usable shared %s%s in %s: %s", name, args, path, err)
+
+            timestamp = time.time()
+            result = self._list(name, args, kwargs)
+            self._store(path, {'key': key, 'timestamp': timestamp, 'result': result})
+
+        return result
+
+    def _store(self, path, snapshot):
+        """Atomically store the snapshot of a listing, the listing itself is still usable if this fails."""
+        try:
+            atomic_write(path, lambda tmp: pickle.dump(snapshot, tmp, pickle.HIGHEST_PROTOCOL))
+        except (IOError, OSError, pickle.PicklingError) as err:
+            logging.warning("Cannot store the shared GPFS snapshot in %s: %s", path, err)
+
+    def list_filesystems(self, *args, **kwargs):
+        """Memoised GpfsOperations.list_filesystems."""
+        return self._memoize('list_filesystems', lambda x: x, args, kwargs)
+
+    def list_filesets(self, *args, **kwargs):
+        """Memoised GpfsOperations.list_filesets, with a FilesetIndex per filesystem."""
+        return self._memoize('list_filesets', index_filesets, args, kwargs)
+
+    def list_quota(self, *args, **kwargs):
+        """Memoised GpfsOperations.list_quota."""
+        return self._memoize('list_quota', lambda x: x, args, kwargs)
+
+    def refresh(self, names=None):
+        """
+        Forget the listings, so the next calls obtain fresh information from GPFS.
+
+        @type names: list of the names of the listings to forget, e.g., ['list_quota'], defaults to all of them
+        """
+        with self._lock:
+            if names is None:
+                self._cache = {}
+            else:
+                for key in [key for key in self._cache if key[0] in names]:
+                    del self._cache[key]
@@ -0,0 +1,88 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Persistent state that the quota scripts keep between runs.
+
+@author: Andy Georges (Ghent University)
+"""
+
+import json
+import logging
+import os
+import tempfile
+
+
+def load_state(path, default=None):
+    """
+    Load the JSON state stored in path.
+
+    @returns: the stored state, or default if there is no (readable) state
+    """
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except (IOError, OSError, ValueError) as err:
+        logging.info("No usable state in %s (%s), starting from scratch", path, err)
+        return default
+
+
+def atomic_write(path, writer, binary=True, permissions=None):
+    """
+    Write a file with writer, so readers never see a partially written file.
+
+    The writer gets a file object of a temporary file in the same directory, which then replaces
+    path. The temporary file is removed if writing fails.
+
+    @type writer: function writing to the given file object
+    @type binary: bool, open the file in binary rather than text mode
+    @type permissions: int, the mode of the file, rather than the owner-only mode of temporary files
+
+    @returns: what writer returns
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    (fd, tmp_path) = tempfile.mkstemp(dir=directory, prefix=".%s." % os.path.basename(path))
+    try:
+        with os.fdopen(fd, binary and 'wb' or 'w') as tmp:
+            result = writer(tmp)
+        if permissions is not None:
+            os.chmod(tmp_path, permissions)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+    return result
+
+
+def store_state(path, state):
+    """
+    Store the state as JSON in path, atomically, see atomic_write.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(directory):
+        os.makedirs(directory, 0o700)
+
+    atomic_write(path, lambda state_file: json.dump(state, state_file), binary=False)
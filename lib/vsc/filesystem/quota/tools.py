@@ -29,17 +29,28 @@ Helper functions for all things quota related.
 @author: Andy Georges (Ghent University)
 """
 
+import base64
+import hashlib
 import inspect
+import json
 import logging
+import os
 import pwd
 import re
 import socket
+import sys
+import threading
 import time
+import zlib
 
 from collections import namedtuple
+from itertools import compress
+from multiprocessing.pool import ThreadPool
 
 from vsc.config.base import GENT_VO_PREFIX, GENT_VO_SHARED_PREFIX, STORAGE_SHARED_SUFFIX, GENT
+from vsc.filesystem.quota.columnar import QuotaTable
 from vsc.filesystem.quota.entities import QuotaUser, QuotaFileset
+from vsc.filesystem.quota.state import load_state, store_state
 from vsc.utils.mail import VscMail
 
 GPFS_GRACE_REGEX = re.compile(
@@ -48,9 +59,41 @@ GPFS_GRACE_REGEX = re.compile(
 
 GPFS_NOGRACE_REGEX = re.compile(r"none", re.I)
 
+GPFS_GRACE_UNITS = {
+    'day': 86400,
+    'days': 86400,
+    'hour': 3600,
+    'hours': 3600,
+    'minute': 60,
+    'minutes': 60,
+}
+
+GRACE_CACHE_SIZE = 1024
+GRACE_CACHE_STATS = {'hits': 0, 'misses': 0}
+_grace_cache = {}
+
 QUOTA_USER_KIND = 'user'
 QUOTA_VO_KIND = 'vo'
 
+DELTA_FULL_RESYNC_INTERVAL = 6 * 60 * 60  # seconds
+
+UID_CACHE_TTL = 24 * 60 * 60  # seconds
+UID_CACHE_MISS_TTL = 5 * 60  # seconds, for uids without a passwd entry, which may be created at any time
+UID_CACHE_JITTER = 0.5  # fraction of the ttl by which the ttl of a uid can be shortened
+
+PUSH_BATCH_RECORDS = 100  # initial number of records per batch
+PUSH_MIN_BATCH_RECORDS = 10
+PUSH_MAX_BATCH_RECORDS = 2000
+PUSH_MAX_BATCH_BYTES = 1024 * 1024
+PUSH_TARGET_LATENCY = 2.0  # seconds
+
+# request body encodings: a list of records, a table with a header of columns and rows,
+# or such a table compressed with gzip and base64 encoded, as the REST client sends JSON bodies
+PUSH_ENCODING_RECORDS = 'records'
+PUSH_ENCODING_COMPACT = 'compact'
+PUSH_ENCODING_COMPACT_GZIP = 'compact-gzip'
+PUSH_ENCODINGS = (PUSH_ENCODING_RECORDS, PUSH_ENCODING_COMPACT, PUSH_ENCODING_COMPACT_GZIP)
+
 
 class QuotaException(Exception):
     pass
@@ -58,64 +101,441 @@ class QuotaException(Exception):
 
 InodeCritical = namedtuple("InodeCritical", ['used', 'allocated', 'maxinodes'])
 
+INODE_SEVERITY_LEVELS = (0.8, 0.9, 0.95)
 
-CRITICAL_INODE_COUNT_MESSAGE = """
+# the quota of filesets starting with these is shown to the users, besides their own fileset
+SANITIZE_PREFIXES = ('vsc', GENT_VO_PREFIX, GENT_VO_SHARED_PREFIX)
+
+# only the quota of these users is pushed and checked
+USER_NAME_PREFIXES = ('vsc4',)
+
+
+INODE_MAIL_HEADER = """
 Dear HPC admins,
+"""
 
+CRITICAL_INODE_COUNT_MESSAGE = """
 The following filesets will be running out of inodes soon (or may already have run out).
 
 %(fileset_info)s
+"""
 
+PROJECTED_INODE_COUNT_MESSAGE = """
+The following filesets are projected to run out of inodes, given their recent growth.
+
+%(projected_info)s
+"""
+
+INODE_MAIL_FOOTER = """
 Kind regards,
 Your friendly inode-watching script
 """
 
 
+class FilesetIndex(dict):
+    """
+    The filesets of a single filesystem, with the information derived from their names.
+
+    This is a dict from fileset id to fileset information, as found in the per-filesystem dicts that
+    GpfsOperations.list_filesets returns, so it can be used wherever those are. On top of that, it
+    holds the fileset name per id, and for the VO filesets the derived VO name and whether the VO
+    fileset is shared, all computed once.
+    """
+
+    def __init__(self, filesets):
+        super(FilesetIndex, self).__init__(filesets)
+
+        self.names = {}
+        self.vos = {}
+
+        for (fileset_id, info) in self.items():
+            fileset_name = info['filesetName']
+            self.names[fileset_id] = fileset_name
+
+            if fileset_name.startswith(GENT_VO_PREFIX):
+                if fileset_name.startswith(GENT_VO_SHARED_PREFIX):
+                    self.vos[fileset_id] = (fileset_name.replace(GENT_VO_SHARED_PREFIX, GENT_VO_PREFIX), True)
+                else:
+                    self.vos[fileset_id] = (fileset_name, False)
+
+    def name(self, fileset_id):
+        """The name of the fileset."""
+        return self.names[fileset_id]
+
+    def is_vo(self, fileset_id):
+        """Is this a (shared or non-shared) VO fileset?"""
+        return fileset_id in self.vos
+
+    def vo(self, fileset_id, storage_name):
+        """
+        The VO and the storage under which the quota of a VO fileset is known in the account page.
+
+        Shared VO filesets are reported for the corresponding VO, on the shared storage.
+
+        @returns: tuple (derived VO name, derived storage name) or None if this is not a VO fileset
+        """
+        try:
+            (vo_name, shared) = self.vos[fileset_id]
+        except KeyError:
+            return None
+
+        if shared:
+            return (vo_name, storage_name + STORAGE_SHARED_SUFFIX)
+        else:
+            return (vo_name, storage_name)
+
+
+def fileset_index(filesets, filesystem):
+    """
+    Get the FilesetIndex for the filesystem.
+
+    @type filesets: dict with the filesets per filesystem, either plain dicts or FilesetIndex instances
+
+    @returns: FilesetIndex, only built if filesets does not already hold one
+    """
+    index = filesets[filesystem]
+    if isinstance(index, FilesetIndex):
+        return index
+    return FilesetIndex(index)
+
+
+def index_filesets(filesets):
+    """
+    Build a FilesetIndex for every filesystem, so it can be shared across the pipeline.
+
+    @type filesets: dict with the filesets per filesystem, as returned by GpfsOperations.list_filesets
+
+    @returns: dict with (filesystem, FilesetIndex) key-value pairs
+    """
+    return dict((filesystem, fileset_index(filesets, filesystem)) for filesystem in filesets)
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket, limiting the rate at which requests are made.
+
+    Tokens are added at C{rate} per second, up to C{burst} tokens.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, self.rate))
+        self.tokens = self.burst
+        self.timestamp = time.time()
+        self.lock = threading.Lock()
+
+    def consume(self, tokens=1):
+        """Take tokens from the bucket, blocking until enough are available."""
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.timestamp) * self.rate)
+                self.timestamp = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class PushDigests(object):
+    """
+    Digests of the records that were last pushed successfully to a storage endpoint for a quota kind.
+
+    The digests are kept on disk in the given directory. When the last full push is older than
+    full_resync seconds, the old digests are ignored, so every record gets pushed again.
+    """
+
+    def __init__(self, directory, storage_name, kind, full_resync=DELTA_FULL_RESYNC_INTERVAL):
+        self.path = os.path.join(directory, "%s_%s.json" % (storage_name, kind))
+        self.kind = kind
+
+        state = load_state(self.path, {})
+        now = int(time.time())
+        if now - state.get('timestamp', 0) >= full_resync:
+            logging.info("Full resync of %s quota for %s", kind, storage_name)
+            self.timestamp = now
+            self.previous = {}
+        else:
+            self.timestamp = state['timestamp']
+            self.previous = state.get('digests', {})
+
+        self.current = {}
+
+    def changed(self, payload, serialized):
+        """
+        Record the digest of the serialized payload.
+
+        @returns: True if the payload differs from what was pushed last time
+        """
+        key = "%s:%s" % (payload[self.kind], payload['fileset'])
+        digest = hashlib.md5(serialized.encode('utf-8')).hexdigest()
+        self.current[key] = digest
+        return self.previous.get(key) != digest
+
+    def store(self):
+        """Store the digests of this run, to be used as reference by the next run."""
+        store_state(self.path, {'timestamp': self.timestamp, 'digests': self.current})
+
+
+def encode_payload(payload, encoding=PUSH_ENCODING_RECORDS):
+    """
+    Encode a list of quota records as the body of a request to the account page.
+
+    The compact encodings give the keys once, as the columns of a table with a row per record:
+        {'format': 'compact', 'columns': [...], 'rows': [[...], ...]}
+    and compressed:
+        {'format': 'compact-gzip', 'data': base64 encoded gzip of the JSON encoded compact table}
+    """
+    if encoding == PUSH_ENCODING_RECORDS:
+        return payload
+
+    columns = set()
+    for record in payload:
+        columns.update(record)
+    columns = sorted(columns)
+
+    table = {
+        'format': PUSH_ENCODING_COMPACT,
+        'columns': columns,
+        'rows': [[record.get(column) for column in columns] for record in payload],
+    }
+
+    if encoding == PUSH_ENCODING_COMPACT:
+        return table
+    elif encoding == PUSH_ENCODING_COMPACT_GZIP:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        data = compressor.compress(json.dumps(table, separators=(',', ':')).encode('utf-8')) + compressor.flush()
+        return {
+            'format': PUSH_ENCODING_COMPACT_GZIP,
+            'data': base64.b64encode(data).decode('ascii'),
+        }
+    else:
+        raise QuotaException("Unknown push encoding %s" % (encoding,))
+
+
+def decode_payload(body):
+    """
+    Decode the body of a request to the account page into the list of quota records.
+
+    This is the counterpart of encode_payload, for the receiving side.
+    """
+    if isinstance(body, list):
+        return body
+
+    if body.get('format') == PUSH_ENCODING_COMPACT_GZIP:
+        body = json.loads(zlib.decompress(base64.b64decode(body['data']), 16 + zlib.MAX_WBITS).decode('utf-8'))
+
+    if body.get('format') != PUSH_ENCODING_COMPACT:
+        raise QuotaException("Unknown push body format %s" % (body.get('format'),))
+
+    columns = body['columns']
+    return [dict(zip(columns, row)) for row in body['rows']]
+
+
 class DjangoPusher(object):
-    """Context manager for pushing stuff to django"""
+    """Context manager for pushing stuff to django
+
+    @param concurrency: number of batches that can be in flight at the same time for each storage endpoint
+    @param rate: maximal number of requests per second to the account page (None or 0 means no limit)
+    @param delta_dir: if set, only push records that changed since the last successful push, keeping
+                      the digests of the pushed records in this directory
+    @param full_resync: number of seconds after which all records are pushed again in delta mode
+    @param max_batch_records: maximal number of records in a single batch
+    @param max_batch_bytes: maximal size of the serialised records in a single batch
+    @param target_latency: the batch size is halved when pushing a batch takes longer than this many seconds, and
+                           doubled when it takes less than half of this. None keeps the batch size fixed.
+    @param metrics: QuotaMetrics instance that gets the push statistics and durations
+    @param encoding: the encoding of the request bodies, one of PUSH_ENCODINGS, see encode_payload. The compact
+                     encodings need an account page that accepts them.
+
+    The chosen batch sizes and measured latencies are kept in stats.
+    """
 
-    def __init__(self, storage_name, client, kind, dry_run):
+    def __init__(self, storage_name, client, kind, dry_run, concurrency=1, rate=None,
+                 delta_dir=None, full_resync=DELTA_FULL_RESYNC_INTERVAL,
+                 max_batch_records=PUSH_MAX_BATCH_RECORDS, max_batch_bytes=PUSH_MAX_BATCH_BYTES,
+                 target_latency=PUSH_TARGET_LATENCY, metrics=None, encoding=PUSH_ENCODING_RECORDS):
         self.storage_name = storage_name
-        self.storage_name_shared = storage_name + "_SHARED"
+        self.storage_name_shared = storage_name + STORAGE_SHARED_SUFFIX
         self.client = client
         self.kind = kind
         self.dry_run = dry_run
 
+        self.concurrency = max(1, concurrency)
+        self.bucket = rate and TokenBucket(rate) or None
+        self.metrics = metrics
+        if encoding not in PUSH_ENCODINGS:
+            raise QuotaException("Unknown push encoding %s" % (encoding,))
+        self.encoding = encoding
+
+        self.pools = {}
+        self.slots = {}
+        self.errors = []
+
+        self.max_batch_records = max_batch_records
+        self.max_batch_bytes = max_batch_bytes
+        self.target_latency = target_latency
+        self.batch_size = min(PUSH_BATCH_RECORDS, max_batch_records)
+        self.lock = threading.Lock()
+
+        self.stats = {
+            'records': 0,
+            'batches': 0,
+            'bytes': 0,
+            'batch_sizes': [],
+            'latencies': [],
+        }
+
         self.count = {
             self.storage_name: 0,
             self.storage_name_shared: 0
         }
 
+        self.size = {
+            self.storage_name: 0,
+            self.storage_name_shared: 0
+        }
+
         self.payload = {
             self.storage_name: [],
             self.storage_name_shared: []
         }
 
+        self.skipped = 0
+        if delta_dir:
+            self.digests = dict([
+                (name, PushDigests(delta_dir, name, kind, full_resync)) for name in self.payload
+            ])
+        else:
+            self.digests = None
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
-        if self.payload[self.storage_name]:
-            self._push(self.storage_name, self.payload[self.storage_name])
-        if self.payload[self.storage_name_shared]:
-            self._push(self.storage_name_shared, self.payload[self.storage_name_shared])
+        try:
+            try:
+                if self.payload[self.storage_name]:
+                    self._flush(self.storage_name)
+                if self.payload[self.storage_name_shared]:
+                    self._flush(self.storage_name_shared)
+            finally:
+                self._wait()
+        except Exception as err:
+            if exc_type is None:
+                raise
+            # do not mask the exception raised in the with block by the push errors
+            for error in self.errors or [err]:
+                logging.error("Failed to push %s quota records: %s", self.kind, error)
 
         if exc_type is not None:
             logging.error("Received exception %s in DjangoPusher: %s", exc_type, exc_value)
             return False
 
+        logging.info("Pushed %d %s quota records in %d batches (%d bytes)",
+                     self.stats['records'], self.kind, self.stats['batches'], self.stats['bytes'])
+        logging.debug("Batch sizes %s, latencies %s", self.stats['batch_sizes'], self.stats['latencies'])
+
+        if self.metrics:
+            labels = {'storage': self.storage_name, 'kind': self.kind}
+            self.metrics.add_duration('push', sum(self.stats['latencies']), **labels)
+            self.metrics.count('pushed_records', self.stats['records'], **labels)
+            self.metrics.count('pushed_batches', self.stats['batches'], **labels)
+            self.metrics.count('pushed_bytes', self.stats['bytes'], **labels)
+            self.metrics.count('skipped_records', self.skipped, **labels)
+
+        if self.digests:
+            logging.info("Skipped pushing %d unchanged %s quota records", self.skipped, self.kind)
+            if not self.dry_run:
+                for digests in self.digests.values():
+                    digests.store()
+
         return True
 
     def push(self, storage_name, payload):
+        serialized = json.dumps(payload, sort_keys=True)
+
+        if self.digests and not self.digests[storage_name].changed(payload, serialized):
+            self.skipped += 1
+            return
+
+        if self.payload[storage_name] and self.size[storage_name] + len(serialized) > self.max_batch_bytes:
+            self._flush(storage_name)
+
         self.payload[storage_name].append(payload)
         self.count[storage_name] += 1
+        self.size[storage_name] += len(serialized)
 
-        if self.count[storage_name] > 100:
-            self._push(storage_name, self.payload[storage_name])
-            self.count[storage_name] = 0
-            self.payload[storage_name] = []
+        if self.count[storage_name] >= min(self.batch_size, self.max_batch_records):
+            self._flush(storage_name)
 
-    def _push(self, storage_name, payload):
+    def _flush(self, storage_name):
+        """Hand the pending payload for the given storage to the (a)synchronous pusher"""
+        payload = self.payload[storage_name]
+        size = self.size[storage_name]
+        self.count[storage_name] = 0
+        self.size[storage_name] = 0
+        self.payload[storage_name] = []
+
+        if self.concurrency > 1:
+            self._push_async(storage_name, payload, size)
+        else:
+            self._push(storage_name, payload, size)
+
+    def _adapt(self, records, size, latency):
+        """Record the statistics of a pushed batch and adjust the batch size to the measured latency"""
+        with self.lock:
+            self.stats['records'] += records
+            self.stats['batches'] += 1
+            self.stats['bytes'] += size
+            self.stats['batch_sizes'].append(records)
+            self.stats['latencies'].append(latency)
+
+            if self.target_latency is None:
+                return
+
+            if latency > self.target_latency:
+                self.batch_size = max(PUSH_MIN_BATCH_RECORDS, self.batch_size // 2)
+            elif latency < self.target_latency / 2 and records >= self.batch_size:
+                self.batch_size = min(self.max_batch_records, self.batch_size * 2)
+
+    def _push_async(self, storage_name, payload, size):
+        """
+        Push the payload in a worker thread.
+
+        Blocks while there are already concurrency batches in flight for this storage endpoint.
+        """
+        self._raise_error()
+
+        if storage_name not in self.pools:
+            self.pools[storage_name] = ThreadPool(self.concurrency)
+            self.slots[storage_name] = threading.BoundedSemaphore(self.concurrency)
+
+        self.slots[storage_name].acquire()
+        self.pools[storage_name].apply_async(self._push_worker, (storage_name, payload, size))
+
+    def _push_worker(self, storage_name, payload, size):
+        try:
+            self._push(storage_name, payload, size)
+        except Exception as err:
+            self.errors.append(err)
+        finally:
+            self.slots[storage_name].release()
+
+    def _wait(self):
+        """Wait for all batches in flight and raise the first error that occurred, if any"""
+        for pool in self.pools.values():
+            pool.close()
+            pool.join()
+        self.pools = {}
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.errors:
+            raise self.errors[0]
+
+    def _push(self, storage_name, payload, size=0):
         """Does the actual pushing to the REST API"""
 
         if self.dry_run:
@@ -132,30 +552,278 @@ class DjangoPusher(object):
                 else:
                     logging.error("Unknown quota kind, not pushing any quota to the account page")
                     return
-                cl.size.put(body=payload)  # if all is well, there's nothing returned except (200, empty string)
+                if self.bucket:
+                    self.bucket.consume()
+                start = time.time()
+                body = encode_payload(payload, self.encoding)
+                cl.size.put(body=body)  # if all is well, there's nothing returned except (200, empty string)
+                self._adapt(len(payload), size, time.time() - start)
             except Exception:
                 logging.error("Could not store quota info in account web app")
                 raise
 
 
-def process_user_quota(storage, gpfs, storage_name, filesystem, quota_map, user_map, client, dry_run=False):
+class QuotaSink(object):
+    """
+    A sink of a QuotaPipeline, which is shown every quota entity that passes through the pipeline.
+    """
+
+    def consume(self, entity_id, quota):
+        """Called once for each (id, quota entity) pair."""
+        raise NotImplementedError
+
+    def close(self, exc_info=(None, None, None)):
+        """Called after the last entity, with the exception information if the pipeline failed."""
+        pass
+
+
+class QuotaPipeline(object):
     """
-    Wrapper around the new function to keep the old behaviour intact.
+    Feed the quota entities to a number of sinks, visiting each entity exactly once.
+
+    The sinks see each entity in the order in which they are given, so a sink sees the changes made
+    by the sinks before it, e.g., the sanitising done by the UserPushSink.
+    """
+
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def run(self, quota_map):
+        """
+        Feed the entities to the sinks and close the sinks afterwards, also when feeding them fails.
+
+        @type quota_map: dict or stream of (id, quota entity) tuples, e.g., from iter_mmrepquota_entities
+
+        @returns: the number of entities
+        """
+        consumers = [sink.consume for sink in self.sinks]
+        count = 0
+
+        try:
+            for (entity_id, quota) in _quota_items(quota_map):
+                for consume in consumers:
+                    consume(entity_id, quota)
+                count += 1
+        except Exception:
+            exc_info = sys.exc_info()
+            for sink in self.sinks:
+                try:
+                    sink.close(exc_info)
+                except Exception as err:
+                    logging.error("Cannot close quota sink %s after a failure: %s", sink, err)
+            raise
+
+        error = None
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as err:
+                logging.error("Cannot close quota sink %s: %s", sink, err)
+                error = error or err
+        if error is not None:
+            raise error
+
+        return count
+
+
+class PushSink(QuotaSink):
+    """
+    Push the quota of the entities to the account page, see DjangoPusher for the pusher options.
+    """
+
+    kind = None
+
+    def __init__(self, storage_name, client, dry_run=False, **pusher_options):
+        self.storage_name = storage_name
+        self.pusher = DjangoPusher(storage_name, client, self.kind, dry_run, **pusher_options)
+
+    def close(self, exc_info=(None, None, None)):
+        self.pusher.__exit__(*exc_info)
+
+
+class UserPushSink(PushSink):
+    """
+    Push the sanitised quota of the users to the account page.
+
+    Only the users in the user_map with one of the user_prefixes are pushed.
+    """
+
+    kind = QUOTA_USER_KIND
+
+    def __init__(self, user_map, storage_name, path_template, client, dry_run=False,
+                 user_prefixes=USER_NAME_PREFIXES, **pusher_options):
+        super(UserPushSink, self).__init__(storage_name, client, dry_run, **pusher_options)
+        self.user_name = user_name_lookup(user_map, user_prefixes)
+        self.sanitizer = FilesetSanitizer(path_template)
+        self.sanitize_time = 0.0
+
+    def consume(self, user_id, quota):
+        user_name = self.user_name(user_id)
+        if not user_name:
+            return
+
+        start = time.time()
+        self.sanitizer.sanitize_user(user_name, quota)
+        self.sanitize_time += time.time() - start
+
+        for (fileset, quota_) in quota.quota_map.items():
+
+            params = {
+                "fileset": fileset,
+                "user": user_name,
+                "used": quota_.used,
+                "soft": quota_.soft,
+                "hard": quota_.hard,
+                "doubt": quota_.doubt,
+                "expired": quota_.expired[0],
+                "remaining": quota_.expired[1] or 0,  # seconds
+                "files_used": quota_.files_used,
+                "files_soft": quota_.files_soft,
+                "files_hard": quota_.files_hard,
+                "files_doubt": quota_.files_doubt,
+                "files_expired": quota_.files_expired[0],
+                "files_remaining": quota_.files_expired[1],  # seconds
+            }
+            self.pusher.push(self.storage_name, params)
+
+    def close(self, exc_info=(None, None, None)):
+        super(UserPushSink, self).close(exc_info)
+        if self.pusher.metrics:
+            self.pusher.metrics.add_duration('sanitize', self.sanitize_time, storage=self.storage_name)
+
+
+class VoPushSink(PushSink):
+    """
+    Push the quota of the VO filesets to the account page, the other filesets are not pushed.
+    """
+
+    kind = QUOTA_VO_KIND
+
+    def __init__(self, storage_name, client, index, dry_run=False, **pusher_options):
+        """
+        @type index: FilesetIndex of the filesystem
+        """
+        super(VoPushSink, self).__init__(storage_name, client, dry_run, **pusher_options)
+        self.index = index
+
+    def consume(self, fileset, quota):
+        logging.debug("Fileset %s quota: %s", self.index.name(fileset), quota)
+
+        vo = self.index.vo(fileset, self.storage_name)
+        if vo is None:
+            return
+
+        (derived_vo_name, derived_storage_name) = vo
+
+        for (fileset_, quota_) in quota.quota_map.items():
+
+            params = {
+                "vo": derived_vo_name,
+                "fileset": fileset_,
+                "used": quota_.used,
+                "soft": quota_.soft,
+                "hard": quota_.hard,
+                "doubt": quota_.doubt,
+                "expired": quota_.expired[0],
+                "remaining": quota_.expired[1] or 0,  # seconds
+                "files_used": quota_.files_used,
+                "files_soft": quota_.files_soft,
+                "files_hard": quota_.files_hard,
+                "files_doubt": quota_.files_doubt,
+                "files_expired": quota_.files_expired[0],
+                "files_remaining": quota_.files_expired[1], # seconds
+            }
+            self.pusher.push(derived_storage_name, params)
+
+
+class ExceedCollector(QuotaSink):
+    """
+    Collect the (name, quota) pairs of the entities that exceed their quota.
+
+    The name function maps an entity id to its name, entities without a name are not collected.
+    With log set, every exceeding entity is logged as a warning when it passes.
+    """
+
+    def __init__(self, name, log=False):
+        self.name = name
+        self.log = log
+        self.exceeding = []
+
+    def consume(self, entity_id, quota):
+        if not quota.exceeds():
+            return
+
+        name = self.name(entity_id)
+        if name:
+            self.exceeding.append((name, quota))
+            if self.log:
+                logging.warning("%s has quota %s" % (name, str(quota)))
+
+
+class QuotaCounter(QuotaSink):
+    """
+    Count the entities and the entities that exceed their quota, as the quota_entities and exceeding_entities
+    counters of the metrics, with the given labels.
+    """
+
+    def __init__(self, metrics, **labels):
+        self.metrics = metrics
+        self.labels = labels
+        self.entities = 0
+        self.exceeding = 0
+
+    def consume(self, entity_id, quota):
+        self.entities += 1
+        if quota.exceeds():
+            self.exceeding += 1
+
+    def close(self, exc_info=(None, None, None)):
+        self.metrics.count('quota_entities', self.entities, **self.labels)
+        self.metrics.count('exceeding_entities', self.exceeding, **self.labels)
+
+
+def user_name_lookup(user_map, user_prefixes=USER_NAME_PREFIXES):
+    """
+    A function giving the name of a user id, or None if that user is not in the user_map or not one of ours.
+
+    @type user_map: dict with (uid, user name) key-value pairs
+    @type user_prefixes: tuple, the users whose name starts with one of these are ours
+    """
+    def user_name(user_id):
+        user_name = user_map.get(int(user_id), None)
+        if user_name and user_name.startswith(user_prefixes):
+            return user_name
+        return None
+    return user_name
+
+
+def process_user_quota(storage, gpfs, storage_name, filesystem, quota_map, user_map, client, dry_run=False,
+                       pusher_options=None, sinks=None, log_exceeding=False, user_prefixes=USER_NAME_PREFIXES):
+    """
+    Push the quota of the users to the account page and collect the users that exceed their quota.
+
+    The users are checked once they have been sanitised, in a single pass over the quota_map.
+
+    @type pusher_options: dict with extra keyword arguments for the DjangoPusher
+    @type sinks: list of additional QuotaSink instances that see the users
+    @type log_exceeding: bool, log the users that exceed their quota
+    @type user_prefixes: tuple, only the users whose name starts with one of these are pushed and checked
+
+    @returns: list of (user name, QuotaUser) tuples
     """
     del filesystem
     del gpfs
 
-    exceeding_users = []
     path_template = storage.path_templates[GENT][storage_name]
+    exceeding = ExceedCollector(user_name_lookup(user_map, user_prefixes), log_exceeding)
 
-    push_user_quota_to_django(user_map, storage_name, path_template, quota_map, client, dry_run)
+    QuotaPipeline([
+        UserPushSink(user_map, storage_name, path_template, client, dry_run, user_prefixes,
+                     **(pusher_options or {})),
+        exceeding,
+    ] + list(sinks or [])).run(quota_map)
 
-    for (user_id, quota) in quota_map.items():
-        user_name = user_map.get(int(user_id), None)
-        if user_name and user_name.startswith('vsc4') and quota.exceeds():
-            exceeding_users.append((user_name, quota))
-
-    return exceeding_users
+    return exceeding.exceeding
 
 
 def process_user_quota_store_optional(storage, gpfs, storage_name, filesystem, quota_map, user_map, client,
@@ -178,8 +846,71 @@ def process_user_quota_store_optional(storage, gpfs, storage_name, filesystem, q
     pass
 
 
+def parse_id_ranges(ranges):
+    """
+    Parse id ranges such as ['2500000-2599999', '2000'] into a list of inclusive (low, high) tuples.
+
+    @raises QuotaException: if a range cannot be parsed
+    """
+    id_ranges = []
+    for id_range in ranges or []:
+        try:
+            (low, _, high) = id_range.partition('-')
+            id_ranges.append((int(low), int(high or low)))
+        except ValueError:
+            raise QuotaException("Cannot parse the id range %s" % (id_range,))
+    return id_ranges
+
+
+class EntityFilter(object):
+    """
+    Pre-filter for the quota entities, so the entities that would be discarded later on are never created.
+
+    An entity is kept if its id lies in one of the id ranges and its name starts with one of the
+    name prefixes. Without id ranges or name prefixes, that check is not done. The names are looked
+    up in the names dict (e.g., the uid to user name map) or, without it, taken from the GPFS quota.
+
+    The number of skipped entities is kept in the skipped attribute.
+    """
+
+    def __init__(self, id_ranges=None, name_prefixes=None, names=None):
+        """
+        @type id_ranges: list of inclusive (low, high) tuples, see parse_id_ranges
+        @type name_prefixes: tuple of strings
+        @type names: dict with (id, name) key-value pairs, with int ids
+        """
+        self.id_ranges = list(id_ranges or [])
+        self.name_prefixes = tuple(name_prefixes or ())
+        self.names = names
+        self.skipped = 0
+
+    def in_ranges(self, entity_id):
+        """Is the id in one of the id ranges?"""
+        if not self.id_ranges:
+            return True
+        entity_id = int(entity_id)
+        return any(low <= entity_id <= high for (low, high) in self.id_ranges)
+
+    def accept(self, entity_id, gpfs_quotas):
+        """Should an entity be created for these GPFS quota, counting the entity as skipped if not."""
+        if not self.in_ranges(entity_id):
+            self.skipped += 1
+            return False
+
+        if self.name_prefixes:
+            if self.names is None:
+                name = gpfs_quotas and gpfs_quotas[0].name
+            else:
+                name = self.names.get(int(entity_id))
+            if not name or not name.startswith(self.name_prefixes):
+                self.skipped += 1
+                return False
+
+        return True
+
+
 def get_mmrepquota_maps(quota_map, storage, filesystem, filesets,
-                        replication_factor=1):
+                        replication_factor=1, user_filter=None):
     """Obtain the quota information.
 
     This function uses vsc.filesystem.gpfs.GpfsOperations to obtain
@@ -189,46 +920,175 @@ def get_mmrepquota_maps(quota_map, storage, filesystem, filesets,
     and per fileset basis for the given filesystem. Users with multiple
     quota settings across different filesets are processed correctly.
 
+    The entities are built from the columnar tables of get_mmrepquota_tables.
+
     Returns { "USR": user dictionary, "FILESET": fileset dictionary}.
 
     @type replication_factor: int, describing the number of copies the FS holds for each file
     @type metadata_replication_factor: int, describing the number of copies the FS metadata holds for each file
+    @type user_filter: EntityFilter instance, only the users it accepts are in the user dictionary
     """
-    user_map = {}
-    fs_map = {}
+    tables = get_mmrepquota_tables(quota_map, storage, filesystem, filesets, replication_factor, user_filter)
 
-    timestamp = int(time.time())
+    user_map = dict(tables['USR'].entities(QuotaUser))
+    fs_map = dict(tables['FILESET'].entities(QuotaFileset))
 
-    logging.info("ordering USR quota for storage %s", storage)
-    # Iterate over a list of named tuples -- GpfsQuota
-    for (user, gpfs_quota) in quota_map['USR'].items():
-        user_quota = user_map.get(user, QuotaUser(storage, filesystem, user))
-        user_map[user] = _update_quota_entity(
-            filesets,
-            user_quota,
-            filesystem,
-            gpfs_quota,
-            timestamp,
-            replication_factor
-        )
+    logging.debug("Grace period cache statistics: %s", GRACE_CACHE_STATS)
+
+    return {"USR": user_map, "FILESET": fs_map}
 
-    logging.info("ordering FILESET quota for storage %s", storage)
+
+def iter_mmrepquota_entities(quota_map, kind, storage, filesystem, filesets, replication_factor=1, timestamp=None,
+                             entity_filter=None):
+    """Yield the quota information, one finished entity at a time.
+
+    This is the streaming counterpart of get_mmrepquota_maps, for a single kind of quota,
+    so only a single entity needs to be kept in memory while it is being processed.
+
+    @type kind: string, 'USR' or 'FILESET'
+    @type replication_factor: int, describing the number of copies the FS holds for each file
+    @type timestamp: int, defaults to the current time
+    @type entity_filter: EntityFilter instance, the entities it does not accept are skipped before they are created
+
+    @returns: generator of (id, QuotaUser or QuotaFileset) tuples
+    """
+    if kind == 'USR':
+        entity_class = QuotaUser
+    elif kind == 'FILESET':
+        entity_class = QuotaFileset
+    else:
+        raise QuotaException("Unknown quota kind %s" % (kind,))
+
+    if timestamp is None:
+        timestamp = int(time.time())
+
+    filesets = {filesystem: fileset_index(filesets, filesystem)}
+
+    logging.info("ordering %s quota for storage %s", kind, storage)
     # Iterate over a list of named tuples -- GpfsQuota
-    for (fileset, gpfs_quota) in quota_map['FILESET'].items():
-        fileset_quota = fs_map.get(fileset, QuotaFileset(storage, filesystem, fileset))
-        fs_map[fileset] = _update_quota_entity(
+    for (entity_id, gpfs_quota) in quota_map[kind].items():
+        if entity_filter is not None and not entity_filter.accept(entity_id, gpfs_quota):
+            continue
+        entity = _update_quota_entity(
             filesets,
-            fileset_quota,
+            entity_class(storage, filesystem, entity_id),
             filesystem,
             gpfs_quota,
             timestamp,
             replication_factor
         )
+        yield (entity_id, entity)
 
-    return {"USR": user_map, "FILESET": fs_map}
+    if entity_filter is not None:
+        logging.info("skipped %d %s quota entities for storage %s", entity_filter.skipped, kind, storage)
+
+
+def get_mmrepquota_tables(quota_map, storage, filesystem, filesets, replication_factor=1, user_filter=None):
+    """Obtain the quota information as columnar tables.
+
+    Rather than creating a quota entity per user and fileset, the fields are appended to a QuotaTable
+    per kind, which get_mmrepquota_maps then turns into entities.
+
+    Returns { "USR": user QuotaTable, "FILESET": fileset QuotaTable}.
+
+    @type replication_factor: int, describing the number of copies the FS holds for each file
+    @type user_filter: EntityFilter instance, only the users it accepts are in the user table
+    """
+    timestamp = int(time.time())
+    index = fileset_index(filesets, filesystem)
+    tables = {}
+
+    for kind in ('USR', 'FILESET'):
+        logging.info("tabulating %s quota for storage %s", kind, storage)
+        table = QuotaTable(storage, filesystem, kind, timestamp)
+        entity_filter = kind == 'USR' and user_filter or None
+
+        for (entity_id, gpfs_quotas) in quota_map[kind].items():
+            if entity_filter is not None and not entity_filter.accept(entity_id, gpfs_quotas):
+                continue
+            table.add(entity_id)
+            for quota in gpfs_quotas:
+                if quota.filesetname:
+                    fileset_name = index.names[quota.filesetname]
+                else:
+                    fileset_name = None
+
+                table.append(entity_id, fileset_name,
+                             used=int(quota.blockUsage),
+                             soft=int(quota.blockQuota),
+                             hard=int(quota.blockLimit),
+                             doubt=int(quota.blockInDoubt),
+                             expired=determine_grace_period(quota.blockGrace),
+                             files_used=int(quota.filesUsage),
+                             files_soft=int(quota.filesQuota),
+                             files_hard=int(quota.filesLimit),
+                             files_doubt=int(quota.filesInDoubt),
+                             files_expired=determine_grace_period(quota.filesGrace))
+
+        # see _update_quota_entity: only the block usage is divided by the replication factor
+        table.divide(replication_factor)
+        tables[kind] = table
+
+        if entity_filter is not None:
+            logging.info("skipped %d %s quota entities for storage %s", entity_filter.skipped, kind, storage)
+
+    return tables
+
+
+def _quota_items(quota_map):
+    """Iterate over the (id, quota) pairs of a quota dict or of a stream of such pairs."""
+    if isinstance(quota_map, dict):
+        return quota_map.items()
+    return quota_map
 
 
 def determine_grace_period(grace_string):
+    """
+    Determine the grace period from the grace string mmrepquota reports.
+
+    The results are memoised, since the grace strings come from a very small vocabulary.
+    Hits and misses are counted in GRACE_CACHE_STATS.
+
+    @returns: tuple (grace period active, remaining seconds)
+    """
+    try:
+        expired = _grace_cache[grace_string]
+        GRACE_CACHE_STATS['hits'] += 1
+        return expired
+    except KeyError:
+        pass
+
+    GRACE_CACHE_STATS['misses'] += 1
+    expired = _parse_grace_period(grace_string)
+    if len(_grace_cache) < GRACE_CACHE_SIZE:
+        _grace_cache[grace_string] = expired
+
+    return expired
+
+
+def clear_grace_cache():
+    """Empty the grace period cache and reset its statistics."""
+    _grace_cache.clear()
+    GRACE_CACHE_STATS['hits'] = 0
+    GRACE_CACHE_STATS['misses'] = 0
+
+
+def _parse_grace_period(grace_string):
+    """Parse the common forms ("none", "expired", "N days", ...) without regexes, fall back to the regexes."""
+    words = grace_string.split()
+
+    if len(words) == 1:
+        if words[0].lower() == 'none':
+            return (False, None)
+        elif words[0] == 'expired':
+            return (True, 0)
+    elif len(words) == 2 and words[0].isdigit() and words[1] in GPFS_GRACE_UNITS:
+        return (True, int(words[0]) * GPFS_GRACE_UNITS[words[1]])
+
+    return _parse_grace_period_regex(grace_string)
+
+
+def _parse_grace_period_regex(grace_string):
     grace = GPFS_GRACE_REGEX.search(grace_string)
     nograce = GPFS_NOGRACE_REGEX.search(grace_string)
 
@@ -261,21 +1121,23 @@ def _update_quota_entity(filesets, entity, filesystem, gpfs_quotas, timestamp, r
     """
     Update the quota information for an entity (user or fileset).
 
-    @type filesets: string
+    @type filesets: dict with the FilesetIndex of the filesystem
     @type entity: QuotaEntity instance
     @type filesystem: string
     @type gpfs_quota: list of GpfsQuota namedtuple instances
     @type timestamp: a timestamp, duh. an integer
     @type replication_factor: int, describing the number of copies the FS holds for each file
     """
+    fileset_names = filesets[filesystem].names
+
     for quota in gpfs_quotas:
-        logging.debug("gpfs_quota = %s" % (str(quota)))
+        logging.debug("gpfs_quota = %s", quota)
 
         block_expired = determine_grace_period(quota.blockGrace)
         files_expired = determine_grace_period(quota.filesGrace)
 
         if quota.filesetname:
-            fileset_name = filesets[filesystem][quota.filesetname]['filesetName']
+            fileset_name = fileset_names[quota.filesetname]
         else:
             fileset_name = None
 
@@ -301,24 +1163,34 @@ def _update_quota_entity(filesets, entity, filesystem, gpfs_quotas, timestamp, r
     return entity
 
 
-def process_fileset_quota(storage, gpfs, storage_name, filesystem, quota_map, client, dry_run=False):
-    """wrapper around the new function to keep the old behaviour intact"""
-    del storage
-    filesets = gpfs.list_filesets()
-    exceeding_filesets = []
+def process_fileset_quota(storage, gpfs, storage_name, filesystem, quota_map, client, dry_run=False,
+                          pusher_options=None, filesets=None, sinks=None, log_exceeding=False):
+    """
+    Push the quota of the VO filesets to the account page and collect the filesets that exceed their quota.
+
+    The filesets, preferably already indexed with index_filesets, are only fetched from GPFS when not given.
+
+    @type pusher_options: dict with extra keyword arguments for the DjangoPusher
+    @type sinks: list of additional QuotaSink instances that see the filesets
+    @type log_exceeding: bool, log the filesets that exceed their quota
 
-    push_vo_quota_to_django(storage_name, quota_map, client, dry_run, filesets, filesystem)
+    @returns: list of (fileset name, QuotaFileset) tuples
+    """
+    del storage
+    if filesets is None:
+        filesets = gpfs.list_filesets()
 
     logging.debug("filesets = %s", filesets)
 
-    for (fileset, quota) in quota_map.items():
-        fileset_name = filesets[filesystem][fileset]['filesetName']
-        logging.debug("Fileset %s quota: %s", fileset_name, quota)
+    index = fileset_index(filesets, filesystem)
+    exceeding = ExceedCollector(index.name, log_exceeding)
 
-        if quota.exceeds():
-            exceeding_filesets.append((fileset_name, quota))
+    QuotaPipeline([
+        VoPushSink(storage_name, client, index, dry_run, **(pusher_options or {})),
+        exceeding,
+    ] + list(sinks or [])).run(quota_map)
 
-    return exceeding_filesets
+    return exceeding.exceeding
 
 
 def process_fileset_quota_store_optional(storage, gpfs, storage_name, filesystem, quota_map, client,
@@ -339,85 +1211,97 @@ def process_fileset_quota_store_optional(storage, gpfs, storage_name, filesystem
     pass
 
 
-def push_user_quota_to_django(user_map, storage_name, path_template, quota_map, client, dry_run=False):
+def push_user_quota_to_django(user_map, storage_name, path_template, quota_map, client, dry_run=False,
+                              **pusher_options):
     """
     Upload the quota information to the account page, so it can be displayed for the users in the web application.
+
+    The quota_map is either a dict or a stream of (user id, QuotaUser) tuples, e.g., from iter_mmrepquota_entities.
+    Any additional keyword arguments are passed to the DjangoPusher.
     """
     logging.info("Logging user quota to account page")
     logging.debug("Considering the following quota items for pushing: %s", quota_map)
 
-    with DjangoPusher(storage_name, client, QUOTA_USER_KIND, dry_run) as pusher:
-        for (user_id, quota) in quota_map.items():
-
-            user_name = user_map.get(int(user_id), None)
-            if not user_name or not user_name.startswith('vsc4'):
-                continue
-
-            sanitize_quota_information(path_template['user'](user_name)[1], quota)
-
-            for (fileset, quota_) in quota.quota_map.items():
+    pusher = UserPushSink(user_map, storage_name, path_template, client, dry_run, **pusher_options)
+    QuotaPipeline([pusher]).run(quota_map)
 
-                params = {
-                    "fileset": fileset,
-                    "user": user_name,
-                    "used": quota_.used,
-                    "soft": quota_.soft,
-                    "hard": quota_.hard,
-                    "doubt": quota_.doubt,
-                    "expired": quota_.expired[0],
-                    "remaining": quota_.expired[1] or 0,  # seconds
-                    "files_used": quota_.files_used,
-                    "files_soft": quota_.files_soft,
-                    "files_hard": quota_.files_hard,
-                    "files_doubt": quota_.files_doubt,
-                    "files_expired": quota_.files_expired[0],
-                    "files_remaining": quota_.files_expired[1],  # seconds
-                }
-                pusher.push(storage_name, params)
 
-
-def push_vo_quota_to_django(storage_name, quota_map, client, dry_run=False, filesets=None, filesystem=None):
+def push_vo_quota_to_django(storage_name, quota_map, client, dry_run=False, filesets=None, filesystem=None,
+                            **pusher_options):
     """
     Upload the VO usage information to the account page, so it can be displayed in the web interface.
+
+    The quota_map is either a dict or a stream of (fileset id, QuotaFileset) tuples, e.g., from
+    iter_mmrepquota_entities. Any additional keyword arguments are passed to the DjangoPusher.
     """
     logging.info("Logging VO quota to account page")
     logging.debug("Considering the following quota items for pushing: %s", quota_map)
 
-    with DjangoPusher(storage_name, client, QUOTA_VO_KIND, dry_run) as pusher:
+    index = fileset_index(filesets, filesystem)
+    QuotaPipeline([VoPushSink(storage_name, client, index, dry_run, **pusher_options)]).run(quota_map)
 
-        for (fileset, quota) in quota_map.items():
-            fileset_name = filesets[filesystem][fileset]['filesetName']
-            logging.debug("Fileset %s quota: %s", fileset_name, quota)
 
-            if not fileset_name.startswith(GENT_VO_PREFIX):
+class FilesetSanitizer(object):
+    """
+    Allow-list of the filesets whose quota is shown to the users, compiled once per storage.
+
+    A user gets to see the quota of the filesets that start with one of the prefixes, or with
+    the name of the user's own fileset, as given by the path template of the storage.
+    """
+
+    def __init__(self, path_template=None, prefixes=SANITIZE_PREFIXES):
+        self.path_template = path_template
+        self._match = re.compile("|".join(re.escape(prefix) for prefix in prefixes)).match
+
+    def allowed(self, fileset, user_fileset=None):
+        """Can the quota on this fileset be shown to the user with the given fileset?"""
+        return self._match(fileset) is not None or (user_fileset is not None and fileset.startswith(user_fileset))
+
+    def sanitize(self, quota, user_fileset):
+        """
+        Remove the quota on the filesets that are not allowed from the quota entity.
+
+        @returns: the number of removed filesets
+        """
+        removed = [fileset for fileset in quota.quota_map if not self.allowed(fileset, user_fileset)]
+        for fileset in removed:
+            del quota.quota_map[fileset]
+        return len(removed)
+
+    def sanitize_user(self, user_name, quota):
+        """Sanitize the quota of the user, with the user's fileset from the path template."""
+        return self.sanitize(quota, self.path_template['user'](user_name)[1])
+
+    def sanitize_all(self, quota_map, user_map):
+        """
+        Sanitize the quota of all users at once.
+
+        @type quota_map: dict with (user id, QuotaUser) key-value pairs
+        @type user_map: dict with (uid, user name) key-value pairs, users that are not in it are left alone
+
+        @returns: the number of removed filesets
+        """
+        # there are far fewer distinct filesets than users, so the prefixes are only matched once per fileset
+        filesets = set()
+        for quota in quota_map.values():
+            filesets.update(quota.quota_map)
+        rejected = set(fileset for fileset in filesets if self._match(fileset) is None)
+        if not rejected:
+            return 0
+
+        user_fileset = self.path_template['user']
+        removed = 0
+        for (user_id, quota) in quota_map.items():
+            if rejected.isdisjoint(quota.quota_map):
                 continue
+            user_name = user_map.get(int(user_id))
+            if user_name:
+                removed += self.sanitize(quota, user_fileset(user_name)[1])
+
+        return removed
 
-            if fileset_name.startswith(GENT_VO_SHARED_PREFIX):
-                derived_vo_name = fileset_name.replace(GENT_VO_SHARED_PREFIX, GENT_VO_PREFIX)
-                derived_storage_name = storage_name + STORAGE_SHARED_SUFFIX
-            else:
-                derived_vo_name = fileset_name
-                derived_storage_name = storage_name
-
-            for (fileset_, quota_) in quota.quota_map.items():
-
-                params = {
-                    "vo": derived_vo_name,
-                    "fileset": fileset_,
-                    "used": quota_.used,
-                    "soft": quota_.soft,
-                    "hard": quota_.hard,
-                    "doubt": quota_.doubt,
-                    "expired": quota_.expired[0],
-                    "remaining": quota_.expired[1] or 0,  # seconds
-                    "files_used": quota_.files_used,
-                    "files_soft": quota_.files_soft,
-                    "files_hard": quota_.files_hard,
-                    "files_doubt": quota_.files_doubt,
-                    "files_expired": quota_.files_expired[0],
-                    "files_remaining": quota_.files_expired[1], # seconds
-                }
-                pusher.push(derived_storage_name, params)
+
+_default_sanitizer = FilesetSanitizer()
 
 
 def sanitize_quota_information(fileset_name, quota):
@@ -427,17 +1311,32 @@ def sanitize_quota_information(fileset_name, quota):
         - vscixy (note that on muk, each user had his own fileset, so vsc1, vsc2, and vsc3 prefixes are possible)
         - gvo*
         - project
+
+    To sanitize many users, use a FilesetSanitizer.
+    """
+    _default_sanitizer.sanitize(quota, fileset_name)
+
+
+def sanitize_quota_map(quota_map, user_map, path_template):
+    """
+    Sanitize the quota of all users in the quota_map at once, see FilesetSanitizer.sanitize_all.
+
+    @returns: the number of removed filesets
     """
-    for fileset in quota.quota_map.keys():
-        if not fileset.startswith('vsc') and \
-           not fileset.startswith(GENT_VO_PREFIX) and \
-           not fileset.startswith(GENT_VO_SHARED_PREFIX) and \
-           not fileset.startswith(fileset_name):
-            quota.quota_map.pop(fileset)
+    return FilesetSanitizer(path_template).sanitize_all(quota_map, user_map)
+
+
+def map_uids_to_names(uids=None, cache_path=None, ttl=UID_CACHE_TTL):
+    """Determine the mapping between user ids and user names.
 
+    Without uids, this maps all passwd entries. Otherwise, only the given uids are resolved,
+    see UidResolver.
+
+    @returns: dict with (uid, user name) key-value pairs
+    """
+    if uids is not None:
+        return UidResolver(cache_path, ttl).resolve(uids)
 
-def map_uids_to_names():
-    """Determine the mapping between user ids and user names."""
     ul = pwd.getpwall()
     d = {}
     for u in ul:
@@ -445,6 +1344,85 @@ def map_uids_to_names():
     return d
 
 
+class UidResolver(object):
+    """
+    Resolve user ids to user names, only looking up the uids that are asked for.
+
+    The results are kept in a cache for ttl seconds, uids that have no passwd entry (yet) only for
+    miss_ttl seconds. The ttl of each uid is shortened by up to the jitter fraction, so the uids that
+    were looked up together do not all expire together. Expired entries of uids that are no longer
+    asked for are dropped. If a cache_path is given, the cache is persisted there between runs.
+    """
+
+    def __init__(self, cache_path=None, ttl=UID_CACHE_TTL, miss_ttl=UID_CACHE_MISS_TTL, jitter=UID_CACHE_JITTER):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.jitter = jitter
+        self.cache = {}
+        if cache_path:
+            self.cache = load_state(cache_path, {})
+
+    def _expired(self, uid, entry, now):
+        """Has the cache entry of the uid expired?"""
+        ttl = self.ttl if entry[0] is not None else self.miss_ttl
+        # a fixed fraction per uid, spread over [0, 1)
+        spread = ((uid * 2654435761) % 1000) / 1000.0
+        return now - entry[1] >= ttl * (1.0 - self.jitter * spread)
+
+    def resolve(self, uids):
+        """
+        Resolve the given uids, looking up those that are not in the cache (or expired) in a single pass.
+
+        @returns: dict with (uid, user name) key-value pairs, for the uids that have a passwd entry
+        """
+        now = int(time.time())
+        uid_map = {}
+        missing = []
+
+        requested = set(int(uid) for uid in uids)
+        for uid in requested:
+            entry = self.cache.get(str(uid))
+            if entry is None or self._expired(uid, entry, now):
+                missing.append(uid)
+            elif entry[0] is not None:
+                uid_map[uid] = entry[0]
+
+        cached = len(uid_map)
+        for uid in missing:
+            try:
+                name = pwd.getpwuid(uid).pw_name
+                uid_map[uid] = name
+            except KeyError:
+                name = None
+            self.cache[str(uid)] = [name, now]
+
+        # uids that are no longer asked for, e.g., because they no longer have quota
+        pruned = [key for (key, entry) in self.cache.items()
+                  if int(key) not in requested and self._expired(int(key), entry, now)]
+        for key in pruned:
+            del self.cache[key]
+
+        logging.info("Resolved %d uids: %d from the cache, %d looked up, %d dropped from the cache",
+                     len(uid_map), cached, len(missing), len(pruned))
+
+        if (missing or pruned) and self.cache_path:
+            store_state(self.cache_path, self.cache)
+
+        return uid_map
+
+    def invalidate(self, uids=None):
+        """Drop the given uids from the cache, or the whole cache if no uids are given."""
+        if uids is None:
+            self.cache = {}
+        else:
+            for uid in uids:
+                self.cache.pop(str(uid), None)
+
+        if self.cache_path:
+            store_state(self.cache_path, self.cache)
+
+
 def process_inodes_information(filesets, quota, threshold=0.9):
     """
     Determines which filesets have reached a critical inode limit.
@@ -454,25 +1432,125 @@ def process_inodes_information(filesets, quota, threshold=0.9):
 
     @returns: dict with (filesetname, InodeCritical) key-value pairs
     """
+    critical = process_inodes_information_all({None: filesets}, {None: {'FILESET': quota}}, threshold)
+    return critical.get(None, dict())
+
+
+def process_inodes_information_all(filesets, quota, threshold=0.9, thresholds=None):
+    """
+    Determines which filesets have reached a critical inode limit, for all filesystems in one go.
+
+    @type filesets: dict with the filesets per filesystem, as returned by GpfsOperations.list_filesets
+    @type quota: dict with the quota per filesystem, as returned by GpfsOperations.list_quota
+    @type threshold: float, the default fraction of the maximal inodes that is considered critical
+    @type thresholds: dict with the threshold for specific filesystems
+
+    @returns: dict with (filesystem, {filesetname: InodeCritical}) key-value pairs, for filesystems with
+              critical filesets
+    """
+    return evaluate_inodes_all(filesets, quota, threshold, thresholds, levels=())[0]
+
+
+def inode_severity(inode_info, levels=INODE_SEVERITY_LEVELS):
+    """
+    Determine the severity of the inode usage of a fileset.
+
+    @type inode_info: InodeCritical instance
+    @type levels: sequence of fractions of the maximal inodes
+
+    @returns: the highest level that the usage exceeds, or None
+    """
+    if inode_info.maxinodes <= 0:
+        return None
+
+    fraction = float(inode_info.used) / inode_info.maxinodes
+    exceeded = [level for level in levels if fraction > level]
+    return exceeded and max(exceeded) or None
+
+
+def evaluate_inodes_all(filesets, quota, threshold=0.9, thresholds=None, levels=INODE_SEVERITY_LEVELS):
+    """
+    Determine the critical filesets and the severity of the inode usage of all filesets, for all filesystems.
+
+    The usage, allocated and maximal inodes of all filesets are gathered in columns first, after which
+    they are compared with the threshold of their filesystem and with the severity levels in a single pass.
+
+    @type filesets: dict with the filesets per filesystem, as returned by GpfsOperations.list_filesets
+    @type quota: dict with the quota per filesystem, as returned by GpfsOperations.list_quota
+    @type threshold: float, the default fraction of the maximal inodes that is considered critical
+    @type thresholds: dict with the threshold for specific filesystems
+    @type levels: sequence of fractions of the maximal inodes
+
+    @returns: tuple with
+              - dict with (filesystem, {filesetname: InodeCritical}) key-value pairs, for filesystems with
+                critical filesets
+              - dict with (filesystem, {level: [(filesetname, InodeCritical)]}) key-value pairs, holding
+                every level for every filesystem, with the filesets whose highest exceeded level it is
+    """
+    thresholds = thresholds or {}
+    levels = sorted(levels)
+
+    filesystems = []
+    names = []
+    used = []
+    allocated = []
+    maxinodes = []
+    limits = []
+
+    for (filesystem, fs_filesets) in filesets.items():
+        try:
+            fileset_quota = quota[filesystem]['FILESET']
+        except KeyError:
+            logging.warning("No fileset quota information for filesystem %s", filesystem)
+            continue
+
+        fs_threshold = thresholds.get(filesystem, threshold)
+        for (fs_key, fs_info) in fs_filesets.items():
+            try:
+                fs_used = fileset_quota[fs_key][0].filesUsage
+            except (KeyError, IndexError):
+                logging.warning("No quota information for fileset %s on filesystem %s",
+                                fs_info['filesetName'], filesystem)
+                continue
+            filesystems.append(filesystem)
+            names.append(fs_info['filesetName'])
+            used.append(fs_used)
+            allocated.append(fs_info['allocInodes'])
+            maxinodes.append(fs_info['maxInodes'])
+            limits.append(fs_threshold)
+
+    used = [int(u) for u in used]
+    maxinodes = [int(m) for m in maxinodes]
+    critical_rows = [m > 0 and u > t * m for (u, m, t) in zip(used, maxinodes, limits)]
+    # the number of levels that the usage exceeds, the highest exceeded level is the one before
+    exceeded_levels = [m > 0 and len([level for level in levels if u > level * m]) or 0
+                       for (u, m) in zip(used, maxinodes)]
+
     critical_filesets = dict()
+    severities = dict((filesystem, dict((level, []) for level in levels)) for filesystem in filesets)
+    for row in compress(range(len(names)), [c or e for (c, e) in zip(critical_rows, exceeded_levels)]):
+        inode_info = InodeCritical(used=used[row], allocated=int(allocated[row]), maxinodes=maxinodes[row])
+        if critical_rows[row]:
+            critical_filesets.setdefault(filesystems[row], dict())[names[row]] = inode_info
+        if exceeded_levels[row]:
+            severities[filesystems[row]][levels[exceeded_levels[row] - 1]].append((names[row], inode_info))
 
-    for (fs_key, fs_info) in filesets.items():
-        allocated = int(fs_info['allocInodes'])
-        maxinodes = int(fs_info['maxInodes'])
-        used = int(quota[fs_key][0].filesUsage)
+    for fs_severities in severities.values():
+        for level_filesets in fs_severities.values():
+            level_filesets.sort()
 
-        if maxinodes > 0 and used > threshold * maxinodes:
-            critical_filesets[fs_info['filesetName']] = InodeCritical(used=used, allocated=allocated,
-                                                                      maxinodes=maxinodes)
+    return (critical_filesets, severities)
 
-    return critical_filesets
 
+def mail_admins(critical_filesets, dry_run=True, projected_filesets=None):
+    """
+    Send email to the HPC admin about the inodes running out soonish.
 
-def mail_admins(critical_filesets, dry_run=True):
-    """Send email to the HPC admin about the inodes running out soonish."""
+    @type critical_filesets: dict with (filesystem, {filesetname: InodeCritical}) key-value pairs
+    @type projected_filesets: dict with (filesystem, {filesetname: InodeForecast}) key-value pairs
+    """
     mail = VscMail(mail_host="smtp.ugent.be")
 
-    message = CRITICAL_INODE_COUNT_MESSAGE
     fileset_info = []
     for (fs_name, fs_info) in critical_filesets.items():
         for (fileset_name, inode_info) in fs_info.items():
@@ -484,7 +1562,23 @@ def mail_admins(critical_filesets, dry_run=True):
                                  inode_info.maxinodes,
                                  inode_info.allocated))
 
-    message = message % ({'fileset_info': "\n".join(fileset_info)})
+    projected_info = []
+    for (fs_name, fs_info) in sorted((projected_filesets or {}).items()):
+        for (fileset_name, forecast) in sorted(fs_info.items(), key=lambda i: i[1].exhausted):
+            projected_info.append("%s - %s: used %d of max %d, growing %d inodes/day, full around %s" %
+                                  (fs_name,
+                                   fileset_name,
+                                   forecast.used,
+                                   forecast.maxinodes,
+                                   int(round(forecast.rate)),
+                                   time.strftime("%Y-%m-%d %H:%M", time.localtime(forecast.exhausted))))
+
+    message = INODE_MAIL_HEADER
+    if fileset_info:
+        message += CRITICAL_INODE_COUNT_MESSAGE % ({'fileset_info': "\n".join(fileset_info)})
+    if projected_info:
+        message += PROJECTED_INODE_COUNT_MESSAGE % ({'projected_info': "\n".join(projected_info)})
+    message += INODE_MAIL_FOOTER
 
     if dry_run:
         logging.info("Would have sent this message: %s" % (message,))
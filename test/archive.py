@@ -0,0 +1,98 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for writing the JSON logs in vsc.filesystem.quota.archive.
+
+@author: Andy Georges (Ghent University)
+"""
+import bz2
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+import vsc.filesystem.quota.archive as archive
+
+from vsc.filesystem.gpfs import GpfsQuota
+from vsc.filesystem.quota.archive import archive_filename, benchmark_codecs, write_json_archive
+from vsc.filesystem.quota.tools import QuotaException
+from vsc.install.testing import TestCase
+
+
+class TestArchive(TestCase):
+    """
+    Check that the written logs hold the JSON encoded data.
+    """
+
+    def setUp(self):
+        super(TestArchive, self).setUp()
+
+        self.tmpdir = tempfile.mkdtemp()
+        quota = GpfsQuota(name="vsc40075", blockUsage=2048, blockQuota=1024, blockLimit=4096, blockInDoubt=0,
+                          blockGrace="6 days", filesUsage=10, filesQuota=100, filesLimit=200, filesInDoubt=0,
+                          filesGrace="none", remarks="", quota="on", defQuota="off", fid=0, filesetname='1')
+        self.data = {'USR': dict((str(uid), [quota]) for uid in range(2540000, 2542000))}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(TestArchive, self).tearDown()
+
+    def test_codecs(self):
+        """Each codec writes the same JSON as json.dumps, under a name with the matching extension."""
+        expected = json.loads(json.dumps(self.data))
+        readers = {
+            'gzip': gzip.open,
+            'bz2': bz2.BZ2File,
+            'none': open,
+        }
+
+        for (codec, reader) in readers.items():
+            path = os.path.join(self.tmpdir, archive_filename('gpfs_quota', 'kyukondata', codec, 0))
+            size = write_json_archive(path, self.data, codec, 1)
+
+            self.assertEqual(os.path.getsize(path), size)
+            self.assertEqual(os.listdir(self.tmpdir), [os.path.basename(path)])
+            with reader(path, 'rb') as log:
+                self.assertEqual(json.loads(log.read().decode('utf-8')), expected)
+            os.unlink(path)
+
+        self.assertTrue(archive_filename('gpfs_quota', 'kyukondata', 'gzip').endswith('_kyukondata.gz'))
+        self.assertRaises(QuotaException, archive.compressor, 'zip')
+
+    def test_failed_write(self):
+        """A failed write leaves no file behind."""
+        path = os.path.join(self.tmpdir, 'gpfs_quota.gz')
+        self.assertRaises(TypeError, write_json_archive, path, {'USR': object()})
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_benchmark(self):
+        """The benchmark covers the requested levels and reports the compressed sizes."""
+        results = benchmark_codecs(self.data, {'gzip': (1, 9), 'none': (0,)})
+
+        self.assertEqual([(codec, level) for (codec, level, _, _) in results], [('gzip', 1), ('gzip', 9), ('none', 0)])
+        self.assertEqual(results[2][3], len(json.dumps(self.data)))
+        self.assertTrue(results[1][3] < results[2][3])
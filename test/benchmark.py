@@ -0,0 +1,131 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for the benchmark suite in vsc.filesystem.quota.benchmark.
+
+@author: Andy Georges (Ghent University)
+"""
+import os
+import shutil
+import tempfile
+
+import vsc.filesystem.quota.benchmark as benchmark
+
+from vsc.filesystem.quota.tools import get_mmrepquota_maps, sanitize_quota_information
+
+from vsc.install.testing import TestCase
+
+
+class TestBenchmark(TestCase):
+    """
+    Check the synthetic data generators and the baseline handling, on a tiny scale.
+    """
+
+    def setUp(self):
+        super(TestBenchmark, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(TestBenchmark, self).tearDown()
+
+    def test_generators(self):
+        """The generators are deterministic and consistent with each other."""
+        filesets = benchmark.synthetic_filesets(50)
+        (quota, user_map) = benchmark.synthetic_quota(50, filesets)
+
+        self.assertEqual(filesets, benchmark.synthetic_filesets(50))
+        self.assertEqual((quota, user_map), benchmark.synthetic_quota(50, filesets))
+        self.assertNotEqual(quota, benchmark.synthetic_quota(50, filesets, seed=1)[0])
+
+        fs_quota = quota[benchmark.BENCHMARK_FILESYSTEM]
+        fs_filesets = filesets[benchmark.BENCHMARK_FILESYSTEM]
+        self.assertEqual(len(fs_quota['USR']), 50)
+        self.assertEqual(len(user_map), 50)
+        self.assertEqual(sorted(fs_quota['FILESET'].keys()), sorted(fs_filesets.keys()))
+        for quotas in fs_quota['USR'].values():
+            for q in quotas:
+                self.assertTrue(q.filesetname in fs_filesets)
+
+    def test_reference_sanitize(self):
+        """The reference of the sanitize benchmark removes the same filesets as sanitize_quota_information."""
+        filesets = benchmark.synthetic_filesets(200)
+        (quota, user_map) = benchmark.synthetic_quota(200, filesets)
+        path_template = benchmark.synthetic_path_template()
+
+        sanitized = []
+        for function in (benchmark.reference_sanitize_quota_information, sanitize_quota_information):
+            maps = get_mmrepquota_maps(quota[benchmark.BENCHMARK_FILESYSTEM], benchmark.BENCHMARK_STORAGE,
+                                       benchmark.BENCHMARK_FILESYSTEM, filesets, 2)
+            for (user_id, user_quota) in maps['USR'].items():
+                function(path_template['user'](user_map[int(user_id)])[1], user_quota)
+            sanitized.append(dict((user_id, sorted(q.quota_map)) for (user_id, q) in maps['USR'].items()))
+
+        self.assertEqual(sanitized[0], sanitized[1])
+        self.assertFalse(any('apps' in filesets for filesets in sanitized[0].values()))
+
+    def test_measure(self):
+        """Every run starts from the data of the setup, the time is not measured while tracing."""
+        runs = []
+
+        def setup():
+            runs.append(benchmark.tracemalloc is not None and benchmark.tracemalloc.is_tracing())
+            return ([],)
+
+        def function(data):
+            traced = benchmark.tracemalloc is not None and benchmark.tracemalloc.is_tracing()
+            data.append(traced)
+            runs.append(data)
+
+        result = benchmark.measure('append', 1, function, setup)
+        self.assertEqual(result.name, 'append')
+        if benchmark.tracemalloc is None:
+            self.assertEqual(runs, [False, [False]])
+        else:
+            self.assertEqual(runs, [False, [False], False, [True]])
+
+    def test_run_and_compare(self):
+        """The benchmarks run and are compared with the stored baselines."""
+        baselines = os.path.join(self.tmpdir, 'baselines.json')
+
+        results = benchmark.run_benchmarks([20])
+        self.assertEqual([r.name for r in results], [
+            'determine_grace_period',
+            'get_mmrepquota_maps',
+            'sanitize_quota_information_reference',
+            'sanitize_quota_information',
+            'sanitize_quota_map',
+            'push_user_quota_to_django',
+            'process_inodes_information',
+        ])
+
+        self.assertEqual(benchmark.compare_baselines(baselines, results), [])
+
+        benchmark.store_baselines(baselines, results)
+        self.assertEqual(benchmark.compare_baselines(baselines, results), [])
+
+        slower = [r._replace(throughput=r.throughput / 2) for r in results]
+        self.assertEqual([r for (r, _) in benchmark.compare_baselines(baselines, slower)], slower)
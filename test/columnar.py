@@ -0,0 +1,131 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for the columnar quota storage in vsc.filesystem.quota.columnar.
+
+@author: Andy Georges (Ghent University)
+"""
+
+from vsc.config.base import VSC_DATA
+from vsc.filesystem.gpfs import GpfsQuota
+import mock
+
+from vsc.filesystem.quota.entities import QuotaUser
+from vsc.filesystem.quota.tools import UserPushSink, get_mmrepquota_maps, get_mmrepquota_tables
+from vsc.filesystem.quota.tools import iter_mmrepquota_entities
+from vsc.install.testing import TestCase
+
+
+class TestQuotaTable(TestCase):
+    """
+    Check that the columnar tables hold the same information as the quota entities.
+    """
+
+    def setUp(self):
+        super(TestQuotaTable, self).setUp()
+
+        self.filesystem = 'kyukondata'
+        self.filesets = {self.filesystem: {'1': {'filesetName': 'vsc400'}, '2': {'filesetName': 'gvo00002'}}}
+
+        default = GpfsQuota(name="", blockUsage=2048, blockQuota=1024, blockLimit=4096, blockInDoubt=2,
+                            blockGrace="6 days", filesUsage=10, filesQuota=100, filesLimit=200, filesInDoubt=0,
+                            filesGrace="none", remarks="", quota="on", defQuota="off", fid=0, filesetname='1')
+        self.quota = {
+            'USR': {
+                '2540075': [default, default._replace(filesetname='2', blockUsage=10)],
+                '2540076': [default._replace(blockUsage=512, blockGrace="none")],
+                '2540077': [default._replace(blockUsage=0, filesUsage=101, filesGrace="expired")],
+            },
+            'FILESET': {
+                '2': [default._replace(filesetname='2')],
+            },
+        }
+
+    def test_table(self):
+        """The table has a row per (entity, fileset) with the replication factor applied."""
+        tables = get_mmrepquota_tables(self.quota, VSC_DATA, self.filesystem, self.filesets, 2)
+
+        users = tables['USR']
+        self.assertEqual(len(users), 4)
+        self.assertEqual(len(tables['FILESET']), 1)
+        self.assertEqual(sorted(users.ids), ['2540075', '2540076', '2540077'])
+        self.assertEqual(sorted(users.filesets), ['gvo00002', 'vsc400'])
+        self.assertEqual(sorted(users['used']), [0, 5, 256, 1024])
+        self.assertEqual(sorted(users['files_used']), [10, 10, 10, 101])
+
+    def test_exceeding(self):
+        """Entities that exceed their soft limit are reported, as QuotaEntity.exceeds() does."""
+        tables = get_mmrepquota_tables(self.quota, VSC_DATA, self.filesystem, self.filesets, 1)
+        self.assertEqual(tables['USR'].exceeding(), ['2540075'])
+
+        maps = get_mmrepquota_maps(self.quota, VSC_DATA, self.filesystem, self.filesets, 1)
+        for kind in ('USR', 'FILESET'):
+            self.assertEqual(tables[kind].exceeding(),
+                             sorted(entity_id for (entity_id, entity) in maps[kind].items() if entity.exceeds()))
+
+    def test_entities(self):
+        """The entities of get_mmrepquota_maps, built from the tables, match the streamed entities."""
+        maps = get_mmrepquota_maps(self.quota, VSC_DATA, self.filesystem, self.filesets, 2)
+
+        for kind in ('USR', 'FILESET'):
+            streamed = dict(iter_mmrepquota_entities(self.quota, kind, VSC_DATA, self.filesystem, self.filesets, 2))
+            self.assertEqual(sorted(maps[kind].keys()), sorted(streamed.keys()))
+            for (entity_id, entity) in maps[kind].items():
+                expected = streamed[entity_id].quota_map
+                self.assertEqual(sorted(entity.quota_map.keys()), sorted(expected.keys()))
+                for (fileset, quota) in entity.quota_map.items():
+                    self.assertEqual(quota._replace(timestamp=None), expected[fileset]._replace(timestamp=None))
+
+    def test_payloads(self):
+        """The payloads are those the UserPushSink pushes."""
+        tables = get_mmrepquota_tables(self.quota, VSC_DATA, self.filesystem, self.filesets, 2)
+        payloads = list(tables['USR'].payloads('user', {'2540076': 'vsc40076'}))
+        self.assertEqual([entity_id for (entity_id, _) in payloads], ['2540076'])
+
+        sink = UserPushSink({2540076: 'vsc40076'}, VSC_DATA, mock.MagicMock(), mock.MagicMock(), dry_run=True)
+        sink.sanitizer.sanitize_user = mock.MagicMock()
+        sink.pusher.push = mock.MagicMock()
+        for (entity_id, entity) in iter_mmrepquota_entities(self.quota, 'USR', VSC_DATA, self.filesystem,
+                                                            self.filesets, 2):
+            sink.consume(entity_id, entity)
+
+        self.assertEqual([c[0][1] for c in sink.pusher.push.call_args_list], [payloads[0][1]])
+        self.assertEqual(payloads[0][1], {
+            'fileset': 'vsc400',
+            'user': 'vsc40076',
+            'used': 256,
+            'soft': 512,
+            'hard': 2048,
+            'doubt': 1,
+            'expired': False,
+            'remaining': 0,
+            'files_used': 10,
+            'files_soft': 100,
+            'files_hard': 200,
+            'files_doubt': 0,
+            'files_expired': False,
+            'files_remaining': None,
+        })
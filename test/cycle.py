@@ -0,0 +1,212 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for the quota check cycle in vsc.filesystem.quota.cycle.
+
+@author: Andy Georges (Ghent University)
+"""
+import mock
+import os
+import shutil
+import tempfile
+
+import vsc.config.base as config
+
+from vsc.config.base import VSC_DATA
+from vsc.filesystem.gpfs import GpfsQuota
+from vsc.filesystem.quota.cycle import QuotaCycle, nagios_exit
+from vsc.filesystem.quota.exceed import EXCEED_RECOVERED, EXCEED_STARTED, ExceedState
+from vsc.filesystem.quota.metrics import QuotaMetrics
+from vsc.filesystem.quota.snapshot import GpfsSnapshot
+from vsc.filesystem.quota.tools import UidResolver
+from vsc.install.testing import TestCase
+from vsc.utils.nagios import NAGIOS_EXIT_CRITICAL, NAGIOS_EXIT_OK, NAGIOS_EXIT_WARNING
+
+config.STORAGE_CONFIGURATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'filesystem_info.conf')
+
+
+class TestQuotaCycle(TestCase):
+    """
+    Check running the cycle repeatedly with warm caches.
+    """
+
+    def setUp(self):
+        super(TestQuotaCycle, self).setUp()
+
+        default = GpfsQuota(name="", blockUsage=2048, blockQuota=1024, blockLimit=4096, blockInDoubt=0,
+                            blockGrace="6 days", filesUsage=10, filesQuota=100, filesLimit=200, filesInDoubt=0,
+                            filesGrace="none", remarks="", quota="on", defQuota="off", fid=0, filesetname='1')
+
+        self.gpfs = mock.MagicMock()
+        self.gpfs.list_filesystems.return_value = {'kyukondata': {}}
+        self.gpfs.list_filesets.return_value = {
+            'kyukondata': {'1': {'filesetName': 'vsc400'}, '2': {'filesetName': 'gvo00002'}},
+        }
+        self.gpfs.list_quota.return_value = {
+            'kyukondata': {
+                'USR': {
+                    '2540075': [default._replace(name='vsc40075')],
+                    '2540076': [default._replace(name='vsc40076', blockUsage=512, blockGrace="none")],
+                },
+                'FILESET': {
+                    '2': [default._replace(name='gvo00002', filesetname='2')],
+                },
+            },
+        }
+
+    @mock.patch('vsc.filesystem.quota.tools.pwd.getpwuid')
+    def test_cycles(self, mock_getpwuid):
+        """The stats are those of dquota, and only the quota is listed again in the next cycle."""
+        mock_getpwuid.side_effect = lambda uid: mock.MagicMock(pw_name="vsc%d" % (uid - 2500000))
+        client = mock.MagicMock()
+
+        cycle = QuotaCycle(GpfsSnapshot(self.gpfs), config.VscStorage(), [VSC_DATA], client, UidResolver())
+
+        for _ in range(0, 3):
+            stats = cycle.run()
+            cycle.refresh()
+
+        self.assertEqual(stats, {
+            'VSC_DATA_fileset': 1,
+            'VSC_DATA_fileset_critical': 1,
+            'VSC_DATA_users': 1,
+            'VSC_DATA_users_warning': 20,
+            'VSC_DATA_users_critical': 40,
+        })
+        self.assertEqual(cycle.cycles, 3)
+        self.assertEqual(self.gpfs.list_quota.call_count, 3)
+        self.assertEqual(self.gpfs.list_filesets.call_count, 1)
+        self.assertEqual(self.gpfs.list_filesystems.call_count, 1)
+        self.assertEqual(mock_getpwuid.call_count, 2)
+
+        put = client.usage.storage.__getitem__.return_value
+        self.assertEqual(put.vo.size.put.call_count, 3)
+
+        cycle.refresh(full=True)
+        cycle.run()
+        self.assertEqual(self.gpfs.list_filesets.call_count, 2)
+
+    @mock.patch('vsc.filesystem.quota.cycle.ThreadPool')
+    @mock.patch('vsc.filesystem.quota.tools.pwd.getpwuid')
+    def test_workers(self, mock_getpwuid, mock_pool):
+        """No thread pool is started for fewer than two storages, whatever the number of workers."""
+        mock_getpwuid.side_effect = lambda uid: mock.MagicMock(pw_name="vsc%d" % (uid - 2500000))
+
+        cycle = QuotaCycle(GpfsSnapshot(self.gpfs), config.VscStorage(), [], mock.MagicMock(), UidResolver(),
+                           workers=4)
+        self.assertEqual(cycle.run(), {})
+
+        cycle = QuotaCycle(GpfsSnapshot(self.gpfs), config.VscStorage(), [VSC_DATA], mock.MagicMock(), UidResolver(),
+                           workers=4)
+        self.assertEqual(cycle.run()['VSC_DATA_users'], 1)
+        self.assertFalse(mock_pool.called)
+
+    @mock.patch('vsc.filesystem.quota.tools.pwd.getpwuid')
+    def test_user_filter(self, mock_getpwuid):
+        """Only the users in the uid ranges are resolved, and users without a matching name are not pushed."""
+        mock_getpwuid.side_effect = lambda uid: mock.MagicMock(pw_name="vsc%d" % (uid - 2500000))
+        client = mock.MagicMock()
+        metrics = QuotaMetrics('dquota')
+
+        cycle = QuotaCycle(GpfsSnapshot(self.gpfs), config.VscStorage(), [VSC_DATA], client, UidResolver(),
+                           uid_ranges=[(2540076, 2549999)])
+        stats = cycle.run(metrics)
+
+        self.assertEqual(stats['VSC_DATA_users'], 0)
+        mock_getpwuid.assert_called_once_with(2540076)
+        self.assertEqual(metrics.counters[('skipped_entities', (('kind', 'USR'), ('storage', VSC_DATA)))], 1)
+
+        put = client.usage.storage.__getitem__.return_value
+        pushed_users = [r['user'] for c in put.user.size.put.call_args_list for r in c[1]['body']]
+        self.assertEqual(pushed_users, ['vsc40076'])
+
+        cycle = QuotaCycle(GpfsSnapshot(self.gpfs), config.VscStorage(), [VSC_DATA], client, UidResolver(),
+                           user_prefixes=('vsc3',))
+        self.assertEqual(cycle.run()['VSC_DATA_users'], 0)
+
+    @mock.patch('vsc.filesystem.quota.tools.pwd.getpwuid')
+    def test_user_prefixes(self, mock_getpwuid):
+        """The users that pass the user prefixes are also pushed and checked."""
+        names = {2540075: 'vsc30075', 2540076: 'vsc40076'}
+        mock_getpwuid.side_effect = lambda uid: mock.MagicMock(pw_name=names[uid])
+        client = mock.MagicMock()
+
+        cycle = QuotaCycle(GpfsSnapshot(self.gpfs), config.VscStorage(), [VSC_DATA], client, UidResolver(),
+                           user_prefixes=('vsc3', 'vsc4'))
+        self.assertEqual(cycle.run()['VSC_DATA_users'], 1)
+
+        put = client.usage.storage.__getitem__.return_value
+        pushed_users = [r['user'] for c in put.user.size.put.call_args_list for r in c[1]['body']]
+        self.assertEqual(sorted(set(pushed_users)), ['vsc30075', 'vsc40076'])
+
+    @mock.patch('vsc.filesystem.quota.cycle.log_transitions')
+    @mock.patch('vsc.filesystem.quota.tools.pwd.getpwuid')
+    def test_exceed_state(self, mock_getpwuid, mock_log_transitions):
+        """With an exceed state, only the changes in the exceeding users and filesets are logged."""
+        mock_getpwuid.side_effect = lambda uid: mock.MagicMock(pw_name="vsc%d" % (uid - 2500000))
+        tmpdir = tempfile.mkdtemp()
+        state_path = os.path.join(tmpdir, 'exceeding.json')
+
+        try:
+            cycle = QuotaCycle(GpfsSnapshot(self.gpfs), config.VscStorage(), [VSC_DATA], mock.MagicMock(),
+                               UidResolver(), exceed_state=ExceedState(state_path))
+            stats = cycle.run()
+            self.assertEqual([(t.kind, t.name, t.transition) for t in mock_log_transitions.call_args[0][0]],
+                             [('FILESET', 'gvo00002', EXCEED_STARTED), ('USR', 'vsc40075', EXCEED_STARTED)])
+
+            cycle.refresh()
+            self.assertEqual(cycle.run(), stats)
+            mock_log_transitions.assert_called_with([])
+
+            # a new cycle, e.g., in the next run of dquota, continues from the stored state
+            self.gpfs.list_quota.return_value['kyukondata']['USR'].pop('2540075')
+            cycle = QuotaCycle(GpfsSnapshot(self.gpfs), config.VscStorage(), [VSC_DATA], mock.MagicMock(),
+                               UidResolver(), exceed_state=ExceedState(state_path))
+            cycle.run()
+            self.assertEqual([(t.kind, t.name, t.transition) for t in mock_log_transitions.call_args[0][0]],
+                             [('USR', 'vsc40075', EXCEED_RECOVERED)])
+
+            # a dry run does not store the state
+            dry_state_path = os.path.join(tmpdir, 'dry.json')
+            cycle = QuotaCycle(GpfsSnapshot(self.gpfs), config.VscStorage(), [VSC_DATA], mock.MagicMock(),
+                               UidResolver(), dry_run=True, exceed_state=ExceedState(dry_state_path))
+            cycle.run()
+            self.assertEqual([(t.kind, t.name, t.transition) for t in mock_log_transitions.call_args[0][0]],
+                             [('FILESET', 'gvo00002', EXCEED_STARTED)])
+            self.assertFalse(os.path.exists(dry_state_path))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_nagios_exit(self):
+        """The stats are evaluated against their thresholds."""
+        self.assertEqual(nagios_exit({'a_users': 10, 'a_users_warning': 20, 'a_users_critical': 40}), NAGIOS_EXIT_OK)
+        self.assertEqual(nagios_exit({'a_users': 30, 'a_users_warning': 20, 'a_users_critical': 40}),
+                         NAGIOS_EXIT_WARNING)
+        self.assertEqual(nagios_exit({'a_users': 0, 'b_fileset': 2, 'b_fileset_critical': 1}), NAGIOS_EXIT_CRITICAL)
+        # the thresholds are nagios ranges, as in the epilogue
+        self.assertEqual(nagios_exit({'a_users': 5, 'a_users_critical': '10:'}), NAGIOS_EXIT_CRITICAL)
+        self.assertEqual(nagios_exit({'a_users': 5, 'a_users_warning': '@0:10'}), NAGIOS_EXIT_WARNING)
+        self.assertEqual(nagios_exit({'a_users': 20, 'a_users_warning': '@0:10'}), NAGIOS_EXIT_OK)
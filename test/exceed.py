@@ -0,0 +1,98 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for tracking the exceeding users and filesets with vsc.filesystem.quota.exceed.
+
+@author: Andy Georges (Ghent University)
+"""
+import os
+import shutil
+import tempfile
+
+from vsc.config.base import VSC_DATA
+from vsc.filesystem.quota.entities import QuotaUser
+from vsc.filesystem.quota.exceed import EXCEED_GRACE_EXPIRED, EXCEED_RECOVERED, EXCEED_STARTED, ExceedState
+from vsc.filesystem.quota.tools import determine_grace_period
+from vsc.install.testing import TestCase
+
+
+class TestExceedState(TestCase):
+    """
+    Check the transitions between the runs.
+    """
+
+    def setUp(self):
+        super(TestExceedState, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.tmpdir, 'exceeding.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(TestExceedState, self).tearDown()
+
+    def quota(self, name, grace="6 days", files_grace="none"):
+        quota = QuotaUser(VSC_DATA, 'kyukondata', name)
+        quota.update('vsc400', used=1230, soft=456, hard=789, doubt=0, expired=determine_grace_period(grace),
+                     files_expired=determine_grace_period(files_grace), timestamp=None)
+        return quota
+
+    def test_transitions(self):
+        """Only the entities that start or stop exceeding their quota, or whose grace expires, are reported."""
+        state = ExceedState(self.state_path)
+
+        transitions = state.update(VSC_DATA, 'USR', [('vsc40075', self.quota('vsc40075'))], timestamp=100)
+        self.assertEqual([(t.name, t.transition, t.since) for t in transitions], [('vsc40075', EXCEED_STARTED, 100)])
+
+        self.assertEqual(state.update(VSC_DATA, 'USR', [('vsc40075', self.quota('vsc40075'))], timestamp=200), [])
+        state.store()
+
+        state = ExceedState(self.state_path)
+        self.assertEqual(state.exceeding(VSC_DATA, 'USR'), ['vsc40075'])
+        self.assertEqual(state.exceeding(VSC_DATA, 'FILESET'), [])
+
+        exceeding = [('vsc40075', self.quota('vsc40075', grace="expired")), ('vsc40076', self.quota('vsc40076'))]
+        transitions = state.update(VSC_DATA, 'USR', exceeding, timestamp=300)
+        self.assertEqual([(t.name, t.transition, t.since) for t in transitions],
+                         [('vsc40075', EXCEED_GRACE_EXPIRED, 100), ('vsc40076', EXCEED_STARTED, 300)])
+        self.assertEqual(state.update(VSC_DATA, 'USR', exceeding, timestamp=400), [])
+
+        transitions = state.update(VSC_DATA, 'USR', exceeding[1:], timestamp=500)
+        self.assertEqual([(t.name, t.transition, t.since, t.quota) for t in transitions],
+                         [('vsc40075', EXCEED_RECOVERED, 100, None)])
+        self.assertEqual(state.exceeding(VSC_DATA, 'USR'), ['vsc40076'])
+
+    def test_files_grace(self):
+        """A running grace period is not expired, for blocks nor for files."""
+        state = ExceedState(self.state_path)
+
+        exceeding = [('vsc40075', self.quota('vsc40075', grace="none", files_grace="13 hours"))]
+        transitions = state.update(VSC_DATA, 'USR', exceeding, timestamp=100)
+        self.assertEqual([t.transition for t in transitions], [EXCEED_STARTED])
+        self.assertFalse(state.state[VSC_DATA]['USR']['vsc40075']['expired'])
+
+        exceeding = [('vsc40075', self.quota('vsc40075', grace="none", files_grace="expired"))]
+        transitions = state.update(VSC_DATA, 'USR', exceeding, timestamp=200)
+        self.assertEqual([t.transition for t in transitions], [EXCEED_GRACE_EXPIRED])
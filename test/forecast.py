@@ -0,0 +1,130 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for the inode exhaustion forecasts in vsc.filesystem.quota.forecast.
+
+@author: Andy Georges (Ghent University)
+"""
+import mock
+import os
+import shutil
+import tempfile
+
+from vsc.filesystem.gpfs import GpfsQuota
+from vsc.filesystem.quota.forecast import DAY, InodeForecaster
+from vsc.filesystem.quota.tools import InodeCritical, mail_admins
+from vsc.install.testing import TestCase
+
+START = 1559347200
+
+
+class TestInodeForecaster(TestCase):
+    """
+    Check the growth rates and projected exhaustion of the filesets.
+    """
+
+    def setUp(self):
+        super(TestInodeForecaster, self).setUp()
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.tmpdir, 'forecast.json')
+        self.default = GpfsQuota(name="", blockUsage=2048, blockQuota=1024, blockLimit=4096, blockInDoubt=0,
+                                 blockGrace="none", filesUsage=10, filesQuota=100, filesLimit=200, filesInDoubt=0,
+                                 filesGrace="none", remarks="", quota="on", defQuota="off", fid=0, filesetname='1')
+        self.filesets = {
+            'kyukondata': {
+                '1': {'filesetName': 'gvo00001', 'allocInodes': 20000, 'maxInodes': 20000},
+                '2': {'filesetName': 'gvo00002', 'allocInodes': 20000, 'maxInodes': 20000},
+            },
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(TestInodeForecaster, self).tearDown()
+
+    def quota(self, day):
+        return {
+            'kyukondata': {
+                'FILESET': {
+                    '1': [self.default._replace(filesUsage=5000 + 1000 * day)],
+                    '2': [self.default._replace(filesUsage=5000, filesetname='2')],
+                },
+            },
+        }
+
+    def test_forecast(self):
+        """A steadily growing fileset is projected to run out, a stable one is not."""
+        for day in range(0, 3):
+            forecaster = InodeForecaster(self.state_path)
+            forecasts = forecaster.update(self.filesets, self.quota(day), START + day * DAY)
+            forecaster.store()
+            if day < 2:
+                self.assertEqual(forecasts, {})
+
+        self.assertEqual(list(forecasts), ['kyukondata'])
+        self.assertEqual(list(forecasts['kyukondata']), ['gvo00001'])
+
+        forecast = forecasts['kyukondata']['gvo00001']
+        self.assertEqual(forecast.used, 7000)
+        self.assertAlmostEqual(forecast.rate, 1000.0, places=6)
+        self.assertAlmostEqual(forecast.exhausted, START + 15 * DAY, delta=1)
+
+        # beyond the horizon
+        forecaster = InodeForecaster(self.state_path, horizon=7 * DAY)
+        self.assertEqual(forecaster.update(self.filesets, self.quota(3), START + 3 * DAY), {})
+
+    def test_missing_quota(self):
+        """Filesets without quota information are skipped."""
+        quota = self.quota(0)
+        quota['kyukondata']['FILESET']['2'] = []
+        del quota['kyukondata']['FILESET']['1']
+
+        forecaster = InodeForecaster(self.state_path)
+        self.assertEqual(forecaster.update(self.filesets, quota, START), {})
+        self.assertEqual(forecaster.state, {})
+
+    @mock.patch('vsc.filesystem.quota.tools.VscMail')
+    def test_mail_admins(self, mock_mail):
+        """The projected filesets are part of the mail to the admins."""
+        forecaster = InodeForecaster(self.state_path)
+        for day in range(0, 3):
+            forecasts = forecaster.update(self.filesets, self.quota(day), START + day * DAY)
+
+        mail_admins({}, dry_run=False, projected_filesets=forecasts)
+
+        message = mock_mail.return_value.sendTextMail.call_args[1]['message']
+        self.assertTrue("kyukondata - gvo00001: used 7000 of max 20000, growing 1000 inodes/day" in message)
+        # no empty list of critical filesets, and the sign-off comes last
+        self.assertFalse("running out of inodes soon" in message)
+        self.assertTrue(message.index("projected to run out") < message.index("Kind regards"))
+
+        critical = {'kyukondata': {'gvo00001': InodeCritical(used=19000, allocated=20000, maxinodes=20000)}}
+        mail_admins(critical, dry_run=False, projected_filesets=forecasts)
+
+        message = mock_mail.return_value.sendTextMail.call_args[1]['message']
+        self.assertTrue("kyukondata - gvo00001: used 19000 (95%) of max 20000 [allocated: 20000]" in message)
+        self.assertTrue(message.index("Dear HPC admins") < message.index("running out of inodes soon") <
+                        message.index("projected to run out") < message.index("Kind regards"))
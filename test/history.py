@@ -0,0 +1,157 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for the quota history store in vsc.filesystem.quota.history.
+
+@author: Andy Georges (Ghent University)
+"""
+import os
+import shutil
+import tempfile
+
+from vsc.filesystem.gpfs import GpfsQuota
+from vsc.filesystem.quota.history import HISTORY_COLUMNS, QuotaHistory
+from vsc.filesystem.quota.tools import QuotaException
+from vsc.install.testing import TestCase
+
+# 2019-05-31 and 2019-06-01, in different partitions
+MAY = 1559260800
+JUNE = 1559347200
+
+
+class TestQuotaHistory(TestCase):
+    """
+    Check appending to and reading from the history store.
+    """
+
+    def setUp(self):
+        super(TestQuotaHistory, self).setUp()
+
+        self.root = tempfile.mkdtemp()
+        self.default = GpfsQuota(name="", blockUsage=2048, blockQuota=1024, blockLimit=4096, blockInDoubt=0,
+                                 blockGrace="6 days", filesUsage=10, filesQuota=100, filesLimit=200, filesInDoubt=0,
+                                 filesGrace="none", remarks="", quota="on", defQuota="off", fid=0, filesetname='1')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        super(TestQuotaHistory, self).tearDown()
+
+    def quota(self, usage):
+        return {
+            'USR': {
+                '2540075': [
+                    self.default._replace(name='vsc40075', blockUsage=usage),
+                    self.default._replace(name='vsc40075', blockUsage=usage * 2, filesetname='2'),
+                ],
+                '2540076': [self.default._replace(name='vsc40076', blockUsage=1)],
+            },
+            'FILESET': {
+                '2': [self.default._replace(name='gvo00002', filesetname='2', blockUsage=usage * 10)],
+            },
+        }
+
+    def test_history(self):
+        """The history of an entity spans the partitions, sorted by time."""
+        history = QuotaHistory(self.root)
+
+        self.assertEqual(history.append('kyukondata', self.quota(100), MAY), 4)
+        self.assertEqual(history.append('kyukondata', self.quota(200), JUNE), 4)
+        self.assertEqual(history.append('kyukondata', self.quota(300), JUNE + 3600), 4)
+
+        self.assertEqual(sorted(os.listdir(os.path.join(self.root, 'kyukondata'))), ['201905', '201906'])
+        for column in HISTORY_COLUMNS:
+            path = os.path.join(self.root, 'kyukondata', '201906', "%s.col" % column)
+            self.assertEqual(os.path.getsize(path), 8 * 8)
+
+        records = history.history('kyukondata', 'USR', '2540075')
+        self.assertEqual([(r.timestamp, r.fileset, r.blockUsage) for r in records], [
+            (MAY, '1', 100), (MAY, '2', 200),
+            (JUNE, '1', 200), (JUNE, '2', 400),
+            (JUNE + 3600, '1', 300), (JUNE + 3600, '2', 600),
+        ])
+        self.assertEqual(records[0].filesLimit, 200)
+
+        records = history.history('kyukondata', 'FILESET', '2', start=JUNE)
+        self.assertEqual([(r.timestamp, r.blockUsage) for r in records], [(JUNE, 2000), (JUNE + 3600, 3000)])
+
+        records = history.history('kyukondata', 'USR', '2540076', end=JUNE)
+        self.assertEqual([r.timestamp for r in records], [MAY, JUNE])
+
+        self.assertEqual(history.history('kyukondata', 'USR', '666'), [])
+        self.assertEqual(history.history('kyukonscratch', 'USR', '2540075'), [])
+
+    def test_interrupted_append(self):
+        """Rows beyond those in the segments are ignored and overwritten."""
+        history = QuotaHistory(self.root)
+        history.append('kyukondata', self.quota(100), MAY)
+
+        path = os.path.join(self.root, 'kyukondata', '201905', 'blockUsage.col')
+        with open(path, 'ab') as column_file:
+            column_file.write(b'\0' * 24)
+
+        history.append('kyukondata', self.quota(200), MAY + 60)
+        self.assertEqual(os.path.getsize(path), 8 * 8)
+        records = history.history('kyukondata', 'FILESET', '2')
+        self.assertEqual([r.blockUsage for r in records], [1000, 2000])
+
+    def test_segments(self):
+        """Each append writes a segment with an entry per entity, holding its rows contiguously."""
+        history = QuotaHistory(self.root)
+        history.append('kyukondata', self.quota(100), MAY)
+        history.append('kyukondata', self.quota(200), MAY + 60)
+
+        partition = os.path.join(self.root, 'kyukondata', '201905')
+        segments = sorted(name for name in os.listdir(partition) if name.endswith('.seg'))
+        self.assertEqual(segments, ["000000000000-000000000004-%d.seg" % MAY,
+                                    "000000000004-000000000008-%d.seg" % (MAY + 60)])
+        for segment in segments:
+            # three entities, of 20 bytes each
+            self.assertEqual(os.path.getsize(os.path.join(partition, segment)), 3 * 20)
+
+        records = history.history('kyukondata', 'USR', '2540075', start=MAY + 60)
+        self.assertEqual([(r.fileset, r.blockUsage) for r in records], [('1', 200), ('2', 400)])
+
+    def test_root_fileset(self):
+        """The root fileset has id 0, records without a fileset have None."""
+        history = QuotaHistory(self.root)
+        quota = {'USR': {'2540075': [self.default._replace(filesetname='0'), self.default._replace(filesetname='')]}}
+        history.append('kyukondata', quota, MAY)
+
+        records = history.history('kyukondata', 'USR', '2540075')
+        self.assertEqual([r.fileset for r in records], ['0', None])
+
+    def test_corrupt_column(self):
+        """Column files that hold fewer rows than the segments refer to are reported."""
+        history = QuotaHistory(self.root)
+        history.append('kyukondata', self.quota(100), MAY)
+
+        path = os.path.join(self.root, 'kyukondata', '201905', 'filesUsage.col')
+        with open(path, 'r+b') as column_file:
+            column_file.truncate(16)
+
+        self.assertRaises(QuotaException, history.append, 'kyukondata', self.quota(200), MAY + 60)
+        self.assertEqual(os.path.getsize(os.path.join(self.root, 'kyukondata', '201905', 'blockUsage.col')), 4 * 8)
+        self.assertRaises(QuotaException, history.history, 'kyukondata', 'FILESET', '2')
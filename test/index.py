@@ -0,0 +1,70 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for the sorted key index in vsc.filesystem.quota.index.
+
+@author: Andy Georges (Ghent University)
+"""
+import os
+import shutil
+import tempfile
+
+from vsc.filesystem.quota.index import IndexReader, key_hash, write_index
+from vsc.install.testing import TestCase
+
+
+class TestIndex(TestCase):
+    """
+    Check writing and looking up an index.
+    """
+
+    def setUp(self):
+        super(TestIndex, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(TestIndex, self).tearDown()
+
+    def test_index(self):
+        """All the entries of a key hash are found, in order, and nothing else."""
+        path = os.path.join(self.tmpdir, 'test.idx')
+        hashes = [key_hash("USR:%d" % uid) for uid in range(100)]
+        entries = [(hashed, number, 2 * number) for (number, hashed) in enumerate(hashes)]
+        entries.append((hashes[42], 1000, 1))
+        self.assertEqual(write_index(path, reversed(entries)), 101)
+
+        with IndexReader(path) as index:
+            self.assertEqual(index.find(hashes[0]), [(0, 0)])
+            self.assertEqual(index.find(hashes[42]), [(42, 84), (1000, 1)])
+            self.assertEqual(index.find(key_hash("USR:100")), [])
+
+    def test_empty(self):
+        """An empty index has no entries."""
+        path = os.path.join(self.tmpdir, 'empty.idx')
+        self.assertEqual(write_index(path, []), 0)
+        with IndexReader(path) as index:
+            self.assertEqual(index.find(key_hash("USR:0")), [])
@@ -30,7 +30,8 @@ Tests for the inode_log.py script in vsc-filesystem-quota.
 """
 
 from vsc.filesystem.gpfs import GpfsQuota
-from vsc.filesystem.quota.tools import InodeCritical, process_inodes_information
+from vsc.filesystem.quota.tools import InodeCritical, evaluate_inodes_all, inode_severity, process_inodes_information
+from vsc.filesystem.quota.tools import process_inodes_information_all
 
 from vsc.install.testing import TestCase
 
@@ -101,3 +102,62 @@ class TestProcessInodesInformation(TestCase):
             },
             "computed dict with critical filesets is the expected dict"
         )
+
+    def testAllFilesystems(self):
+        """
+        Verify that all filesystems are evaluated at once, with their own threshold.
+        """
+        filesets = {'fs1': self.filesets, 'fs2': self.filesets, 'fs3': self.filesets}
+        quota = {'fs1': {'FILESET': self.usage}, 'fs2': {'FILESET': self.usage}}
+
+        critical = process_inodes_information_all(filesets, quota, threshold=0.9, thresholds={'fs2': 0.99})
+
+        self.assertEqual(critical, {'fs1': process_inodes_information(self.filesets, self.usage, threshold=0.9)})
+
+        critical = process_inodes_information_all(filesets, quota, threshold=0.05)
+        self.assertEqual(sorted(critical.keys()), ['fs1', 'fs2'])
+        self.assertEqual(sorted(critical['fs2'].keys()), ['10', '95'])
+
+        # a fileset without quota information is skipped, the others are still evaluated
+        quota['fs2'] = {'FILESET': {self.names[1]: self.usage[self.names[1]]}}
+        critical = process_inodes_information_all(filesets, quota, threshold=0.05)
+        self.assertEqual(sorted(critical['fs1'].keys()), ['10', '95'])
+        self.assertEqual(sorted(critical['fs2'].keys()), ['95'])
+
+    def testSeverity(self):
+        """
+        Verify that the highest exceeded severity level is reported.
+        """
+        levels = (0.8, 0.9, 0.95)
+        self.assertEqual(inode_severity(InodeCritical(used=10, allocated=90, maxinodes=100), levels), None)
+        self.assertEqual(inode_severity(InodeCritical(used=85, allocated=90, maxinodes=100), levels), 0.8)
+        self.assertEqual(inode_severity(InodeCritical(used=96, allocated=90, maxinodes=100), levels), 0.95)
+        self.assertEqual(inode_severity(InodeCritical(used=96, allocated=90, maxinodes=0), levels), None)
+
+    def testSeverities(self):
+        """
+        Verify that the severity of all filesets is determined, with every level for every filesystem.
+        """
+        filesets = dict(self.filesets)
+        filesets[85] = {'allocInodes': 90, 'filesetName': '85', 'maxInodes': 100}
+        usage = dict(self.usage)
+        usage[85] = [self.defaultQuota._replace(filesUsage=85)]
+
+        filesets = {'fs1': filesets, 'fs2': self.filesets, 'fs3': filesets}
+        quota = {'fs1': {'FILESET': usage}, 'fs3': {'FILESET': usage}}
+        (critical, severities) = evaluate_inodes_all(filesets, quota, threshold=0.9, thresholds={'fs3': 0.8},
+                                                     levels=(0.95, 0.8, 0.9))
+
+        # the critical filesets are those of the separate evaluation, with the threshold of each filesystem
+        self.assertEqual(critical, process_inodes_information_all(filesets, quota, 0.9, {'fs3': 0.8}))
+        self.assertEqual(sorted(critical['fs1'].keys()), ['95'])
+        self.assertEqual(sorted(critical['fs3'].keys()), ['85', '95'])
+
+        self.assertEqual(sorted(severities.keys()), ['fs1', 'fs2', 'fs3'])
+        self.assertEqual(dict((level, [name for (name, _) in names]) for (level, names) in severities['fs1'].items()),
+                         {0.8: ['85'], 0.9: ['95'], 0.95: []})
+        self.assertEqual(severities['fs2'], {0.8: [], 0.9: [], 0.95: []})
+        self.assertEqual(severities['fs3'], severities['fs1'])
+        for (level, level_filesets) in severities['fs1'].items():
+            for (_, inode_info) in level_filesets:
+                self.assertEqual(inode_severity(inode_info, (0.8, 0.9, 0.95)), level)
@@ -0,0 +1,118 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for profiling the memory usage of the quota scripts with vsc.filesystem.quota.memory.
+
+@author: Andy Georges (Ghent University)
+"""
+import os
+import shutil
+import tempfile
+
+from vsc.filesystem.quota.memory import MemoryProfiler, report_memory_profile, start_memory_profiler
+from vsc.filesystem.quota.metrics import QuotaMetrics
+from vsc.install.testing import TestCase
+
+
+class TestMemoryProfiler(TestCase):
+    """
+    Check the memory profile of the phases.
+    """
+
+    def setUp(self):
+        super(TestMemoryProfiler, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(TestMemoryProfiler, self).tearDown()
+
+    def test_profile(self):
+        """The allocations of nested phases are reported per phase, with their allocation sites."""
+        self.assertEqual(start_memory_profiler(False), None)
+        if not MemoryProfiler.available():
+            self.skipTest("tracemalloc is not available")
+
+        profiler = start_memory_profiler(True, top=3)
+        metrics = QuotaMetrics('dquota', profiler)
+        try:
+            with metrics.phase('cycle'):
+                with metrics.phase('list_quota', storage='VSC_DATA'):
+                    kept = [str(i) * 100 for i in range(0, 10000)]
+                with metrics.phase('process_user_quota', storage='VSC_DATA'):
+                    dropped = [str(i) * 100 for i in range(0, 20000)]
+                    del dropped
+        finally:
+            profiler.stop()
+
+        self.assertEqual(sorted(profiler.phases),
+                         ['cycle', 'list_quota storage=VSC_DATA', 'process_user_quota storage=VSC_DATA'])
+        self.assertTrue(('list_quota', (('storage', 'VSC_DATA'),)) in metrics.durations)
+
+        listing = profiler.phases['list_quota storage=VSC_DATA']
+        self.assertTrue(listing.end - listing.start > 1000000)
+        self.assertTrue(listing.peak >= listing.end)
+        self.assertTrue(listing.top[0].site.startswith(__file__.replace('.pyc', '.py')))
+        self.assertTrue(len(listing.top) <= 3)
+
+        processing = profiler.phases['process_user_quota storage=VSC_DATA']
+        self.assertTrue(processing.end - processing.start < 1000000)
+        self.assertTrue(processing.peak - processing.start > 2000000)
+        self.assertTrue(profiler.phases['cycle'].peak >= processing.peak)
+
+        path = os.path.join(self.tmpdir, 'memory.txt')
+        report_memory_profile(profiler, path)
+        with open(path) as report:
+            lines = report.read().splitlines()
+        self.assertEqual(lines, profiler.report())
+        self.assertEqual([line for line in lines if line.startswith('phase')],
+                         ['phase cycle', 'phase list_quota storage=VSC_DATA',
+                          'phase process_user_quota storage=VSC_DATA'])
+        del kept
+
+    def test_rss_fallback(self):
+        """Without tracemalloc, the resident set size is profiled per phase, including that of a stream."""
+        profiler = MemoryProfiler()
+        profiler.available = lambda: False
+        self.assertFalse(profiler.start(fallback=False))
+
+        self.assertTrue(profiler.start())
+        self.assertEqual(profiler.mode, 'rss')
+        metrics = QuotaMetrics('dquota', profiler)
+        with metrics.phase('process_user_quota', storage='VSC_DATA'):
+            stream = metrics.timed_iter(iter(range(0, 10)), 'build_maps', storage='VSC_DATA', kind='USR')
+            kept = [str(i) * 1000000 for i in stream]
+        profiler.stop()
+
+        self.assertEqual(sorted(profiler.phases),
+                         ['build_maps kind=USR storage=VSC_DATA', 'process_user_quota storage=VSC_DATA'])
+        self.assertTrue(('build_maps', (('kind', 'USR'), ('storage', 'VSC_DATA'))) in metrics.durations)
+        for memory in profiler.phases.values():
+            self.assertTrue(memory.start > 0)
+            self.assertTrue(memory.peak >= max(memory.start, memory.end))
+            self.assertEqual(memory.top, [])
+        self.assertEqual(profiler.report()[0], 'profile rss')
+        del kept
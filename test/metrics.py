@@ -0,0 +1,105 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for the instrumentation in vsc.filesystem.quota.metrics.
+
+@author: Andy Georges (Ghent University)
+"""
+import mock
+import os
+import shutil
+import tempfile
+
+from vsc.filesystem.quota.metrics import QuotaMetrics
+from vsc.filesystem.quota.tools import DjangoPusher, QUOTA_VO_KIND
+from vsc.install.testing import TestCase
+
+
+class TestQuotaMetrics(TestCase):
+    """
+    Check the collection and export of the metrics.
+    """
+
+    @mock.patch('vsc.filesystem.quota.metrics.time')
+    def test_phases(self, mock_time):
+        """Durations of phases with the same labels are summed."""
+        mock_time.time.side_effect = [0.0, 1.5, 10.0, 10.25, 20.0, 22.0]
+
+        metrics = QuotaMetrics('dquota')
+        with metrics.phase('list_quota'):
+            pass
+        with metrics.phase('push', storage='VSC_DATA'):
+            pass
+        with metrics.phase('push', storage='VSC_DATA'):
+            pass
+
+        self.assertEqual(metrics.perfdata(), {
+            'list_quota_seconds': 1.5,
+            'VSC_DATA_push_seconds': 2.25,
+        })
+
+    @mock.patch('vsc.filesystem.quota.metrics.time')
+    def test_timed_iter(self, mock_time):
+        """Only the time spent producing items is counted."""
+        mock_time.time.side_effect = [0.0, 1.0, 5.0, 6.0, 10.0, 10.5]
+
+        metrics = QuotaMetrics('dquota')
+        self.assertEqual(list(metrics.timed_iter([1, 2], 'build_maps', kind='USR')), [1, 2])
+        self.assertEqual(metrics.perfdata(), {'USR_build_maps_seconds': 2.5})
+
+    def test_textfile(self):
+        """The textfile is in the Prometheus exposition format."""
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, 'dquota.prom')
+
+        metrics = QuotaMetrics('dquota')
+        metrics.add_duration('list_quota', 3)
+        metrics.count('pushed_records', 10, storage='VSC_DATA', kind='user')
+        metrics.count('pushed_records', 5, storage='VSC_DATA', kind='user')
+        metrics.write_textfile(path)
+
+        try:
+            lines = open(path).read().splitlines()
+        finally:
+            shutil.rmtree(tmpdir)
+
+        self.assertTrue('# TYPE vsc_quota_phase_duration_seconds gauge' in lines)
+        self.assertTrue('vsc_quota_phase_duration_seconds{script="dquota",phase="list_quota"} 3.0' in lines)
+        self.assertTrue('vsc_quota_pushed_records{script="dquota",kind="user",storage="VSC_DATA"} 15.0' in lines)
+        self.assertTrue([l for l in lines if l.startswith('vsc_quota_last_run_timestamp_seconds{script="dquota"} ')])
+
+    def test_pusher_metrics(self):
+        """The DjangoPusher reports its statistics."""
+        metrics = QuotaMetrics('dquota')
+
+        with DjangoPusher("my_storage", mock.MagicMock(), QUOTA_VO_KIND, False, metrics=metrics) as pusher:
+            for i in range(0, 150):
+                pusher.push("my_storage", "pushing %d" % i)
+
+        labels = (('kind', QUOTA_VO_KIND), ('storage', 'my_storage'))
+        self.assertEqual(metrics.counters[('pushed_records', labels)], 150)
+        self.assertEqual(metrics.counters[('pushed_batches', labels)], 2)
+        self.assertTrue(('push', labels) in metrics.durations)
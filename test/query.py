@@ -0,0 +1,129 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for querying the archived logs with vsc.filesystem.quota.query.
+
+@author: Andy Georges (Ghent University)
+"""
+import os
+import shutil
+import tempfile
+
+from vsc.filesystem.gpfs import GpfsQuota
+from vsc.filesystem.quota.archive import archive_filename, write_json_archive
+from vsc.filesystem.quota.query import QueryIndex, parse_archive_name
+from vsc.install.testing import TestCase
+
+
+class TestQueryIndex(TestCase):
+    """
+    Check indexing and querying the archived quota and inode information.
+    """
+
+    def setUp(self):
+        super(TestQueryIndex, self).setUp()
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.quota_dir = os.path.join(self.tmpdir, 'zips')
+        self.inode_dir = os.path.join(self.tmpdir, 'inode-zips')
+        self.index_dir = os.path.join(self.tmpdir, 'index')
+        os.makedirs(self.quota_dir)
+        os.makedirs(self.inode_dir)
+
+        self.default = GpfsQuota(name="", blockUsage=2048, blockQuota=1024, blockLimit=4096, blockInDoubt=0,
+                                 blockGrace="6 days", filesUsage=10, filesQuota=100, filesLimit=200, filesInDoubt=0,
+                                 filesGrace="none", remarks="", quota="on", defQuota="off", fid=0, filesetname='1')
+
+        self.timestamps = [1559347200, 1559368800, 1559606400]
+        for (i, timestamp) in enumerate(self.timestamps):
+            quota = {
+                'USR': {
+                    '2540075': [self.default._replace(name='vsc40075', blockUsage=i)],
+                    '2540076': [self.default._replace(name='vsc40076')],
+                },
+                'FILESET': {
+                    '2': [self.default._replace(name='gvo00002', filesetname='2', blockUsage=10 * i)],
+                    '3': [self.default._replace(name='gvos00002', filesetname='3')],
+                },
+            }
+            self.write(self.quota_dir, 'gpfs_quota', quota, timestamp)
+            inodes = {
+                '2': {'filesetName': 'gvo00002', 'allocInodes': 100 * i, 'maxInodes': 1000},
+            }
+            self.write(self.inode_dir, 'gpfs_inodes', inodes, timestamp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(TestQueryIndex, self).tearDown()
+
+    def write(self, location, prefix, data, timestamp):
+        path = os.path.join(location, archive_filename(prefix, 'kyukondata', 'gzip', timestamp))
+        write_json_archive(path, data)
+        return path
+
+    def test_parse_archive_name(self):
+        """The source, time and filesystem are taken from the names of the archived logs."""
+        filename = archive_filename('gpfs_inodes', 'kyukondata', 'bz2', self.timestamps[0])
+        self.assertEqual(parse_archive_name(filename), ('inodes', self.timestamps[0], 'kyukondata'))
+        self.assertEqual(parse_archive_name('.' + filename), None)
+        self.assertEqual(parse_archive_name('README'), None)
+
+    def test_query(self):
+        """Users and filesets are found by id and by name, within the time range."""
+        index = QueryIndex(self.index_dir)
+        self.assertEqual(index.update([self.quota_dir, self.inode_dir, '/nonexistent']), 6)
+
+        by_name = index.query('USR', ['vsc40075'])
+        by_id = index.query('USR', ['2540075'])
+        self.assertEqual(by_name, by_id)
+        self.assertEqual([(r.timestamp, r.source) for r in by_name], [(t, 'quota') for t in self.timestamps])
+        self.assertEqual([r.record['quota'][0]['blockUsage'] for r in by_name], [0, 1, 2])
+
+        results = index.query('FILESET', ['gvo00002', 'gvos00002'], start=self.timestamps[1], end=self.timestamps[1])
+        self.assertEqual([(r.source, r.record['id']) for r in results],
+                         [('inodes', '2'), ('quota', '2'), ('quota', '3')])
+        self.assertEqual(results[0].record['inodes']['allocInodes'], 100)
+
+        self.assertEqual(index.query('USR', ['vsc40075'], filesystem='kyukonscratch'), [])
+        self.assertEqual(index.query('USR', ['vsc99999']), [])
+
+    def test_update(self):
+        """Only new or changed logs are indexed, and the segments of removed logs are dropped."""
+        index = QueryIndex(self.index_dir)
+        self.assertEqual(index.update([self.quota_dir, self.inode_dir]), 6)
+
+        index = QueryIndex(self.index_dir)
+        self.assertEqual(index.update([self.quota_dir, self.inode_dir]), 0)
+        self.assertEqual(len(index.query('USR', ['vsc40076'])), 3)
+
+        shutil.rmtree(self.inode_dir)
+        self.write(self.quota_dir, 'gpfs_quota', {'USR': {'2540076': [self.default._replace(name='vsc40076')]}},
+                   self.timestamps[-1] + 3600)
+        self.assertEqual(index.update([self.quota_dir, self.inode_dir]), 1)
+
+        self.assertEqual(len(index.query('USR', ['vsc40076'])), 4)
+        self.assertEqual(index.query('FILESET', ['gvo00002'], start=self.timestamps[2])[0].source, 'quota')
+        self.assertEqual(len(os.listdir(self.index_dir)), 1 + 2 * 4)
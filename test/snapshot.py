@@ -0,0 +1,175 @@
+#
+# Copyright 2019-2019 Ghent University
+#
+# This file is part of vsc-filesystems-quota,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.ugent.be/hpcugent/vsc-filesystems-quota
+#
+# vsc-filesystems-quota is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-filesystems-quota is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-filesystems-quota. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for the GPFS snapshot in vsc.filesystem.quota.snapshot.
+
+@author: Andy Georges (Ghent University)
+"""
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from vsc.filesystem.quota.snapshot import GpfsSnapshot
+from vsc.filesystem.quota.tools import FilesetIndex
+from vsc.install.testing import TestCase
+
+
+class TestGpfsSnapshot(TestCase):
+    """
+    Check that the GPFS listings are only obtained once.
+    """
+
+    def setUp(self):
+        super(TestGpfsSnapshot, self).setUp()
+
+        self.gpfs = mock.MagicMock()
+        self.gpfs.list_filesystems.return_value = {'kyukondata': {}}
+        self.gpfs.list_filesets.return_value = {'kyukondata': {'1': {'filesetName': 'gvo00002'}}}
+        self.gpfs.list_quota.return_value = {'kyukondata': {'USR': {}, 'FILESET': {}}}
+
+    def test_memoize(self):
+        """Each listing is obtained once per set of arguments."""
+        snapshot = GpfsSnapshot(self.gpfs)
+
+        for _ in range(0, 3):
+            self.assertEqual(snapshot.list_filesystems(['kyukondata']), {'kyukondata': {}})
+            filesets = snapshot.list_filesets()
+            snapshot.list_quota()
+
+        self.assertEqual(self.gpfs.list_filesystems.call_count, 1)
+        self.assertEqual(self.gpfs.list_filesets.call_count, 1)
+        self.assertEqual(self.gpfs.list_quota.call_count, 1)
+        self.assertEqual(snapshot.stats, {'hits': 6, 'misses': 3, 'shared': 0})
+
+        self.assertTrue(isinstance(filesets['kyukondata'], FilesetIndex))
+        self.assertEqual(filesets['kyukondata'].name('1'), 'gvo00002')
+
+        snapshot.list_filesystems(['kyukondata', 'kyukonscratch'])
+        self.assertEqual(self.gpfs.list_filesystems.call_count, 2)
+
+        snapshot.refresh()
+        snapshot.list_quota()
+        self.assertEqual(self.gpfs.list_quota.call_count, 2)
+
+    def test_delegate(self):
+        """Other operations are those of the wrapped GpfsOperations."""
+        snapshot = GpfsSnapshot(self.gpfs)
+        self.gpfs.is_symlink.return_value = True
+
+        self.assertTrue(snapshot.is_symlink('/some/path'))
+        self.gpfs.is_symlink.assert_called_with('/some/path')
+
+    def test_concurrent(self):
+        """Concurrent users share a single listing."""
+        snapshot = GpfsSnapshot(self.gpfs)
+
+        threads = [threading.Thread(target=snapshot.list_filesets) for _ in range(0, 8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.gpfs.list_filesets.call_count, 1)
+
+    def test_shared(self):
+        """Listings stored by another process are reused while they are fresh."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            GpfsSnapshot(self.gpfs, tmpdir, 60).list_quota()
+            self.assertEqual(self.gpfs.list_quota.call_count, 1)
+
+            other = mock.MagicMock()
+            other.list_quota.return_value = {'kyukonscratch': {}}
+            snapshot = GpfsSnapshot(other, tmpdir, 60)
+            self.assertEqual(snapshot.list_quota(), self.gpfs.list_quota.return_value)
+            self.assertEqual(other.list_quota.call_count, 0)
+            self.assertEqual(snapshot.stats['shared'], 1)
+
+            # the filesets are still indexed
+            filesets = GpfsSnapshot(self.gpfs, tmpdir, 60).list_filesets()
+            filesets = GpfsSnapshot(other, tmpdir, 60).list_filesets()
+            self.assertEqual(filesets['kyukondata'].name('1'), 'gvo00002')
+            self.assertEqual(other.list_filesets.call_count, 0)
+
+            with mock.patch('vsc.filesystem.quota.snapshot.time.time', return_value=time.time() + 120):
+                GpfsSnapshot(other, tmpdir, 60).list_quota()
+            self.assertEqual(other.list_quota.call_count, 1)
+
+            # a different listing is not shared
+            GpfsSnapshot(other, tmpdir, 60).list_quota('kyukondata')
+            self.assertEqual(other.list_quota.call_count, 2)
+
+            self.assertEqual(len([f for f in os.listdir(tmpdir) if f.endswith('.pickle')]), 3)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_shared_stampede(self):
+        """Concurrent scripts wait for the single listing."""
+        tmpdir = tempfile.mkdtemp()
+
+        def slow_quota():
+            time.sleep(0.1)
+            return {'kyukondata': {}}
+        self.gpfs.list_quota.side_effect = slow_quota
+
+        try:
+            threads = [threading.Thread(target=GpfsSnapshot(self.gpfs, tmpdir, 60).list_quota) for _ in range(0, 4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(self.gpfs.list_quota.call_count, 1)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_shared_untrusted(self):
+        """Listings are only shared through a directory and files that nobody else can write to."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            GpfsSnapshot(self.gpfs, tmpdir, 60).list_quota()
+            (path,) = [os.path.join(tmpdir, f) for f in os.listdir(tmpdir) if f.endswith('.pickle')]
+
+            os.chmod(path, 0o666)
+            GpfsSnapshot(self.gpfs, tmpdir, 60).list_quota()
+            self.assertEqual(self.gpfs.list_quota.call_count, 2)
+            # the untrusted file is replaced
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+            os.chmod(tmpdir, 0o777)
+            snapshot = GpfsSnapshot(self.gpfs, tmpdir, 60)
+            snapshot.list_quota()
+            self.assertEqual(self.gpfs.list_quota.call_count, 3)
+            self.assertEqual(snapshot.stats['shared'], 0)
+
+            os.chmod(tmpdir, 0o700)
+            GpfsSnapshot(self.gpfs, tmpdir, 60).list_quota()
+            self.assertEqual(self.gpfs.list_quota.call_count, 3)
+        finally:
+            shutil.rmtree(tmpdir)
@@ -28,14 +28,19 @@ Tests for all helper functions in vsc.filesystems.quota.tools.
 
 @author: Andy Georges (Ghent University)
 """
+import json
 import mock
 import os
+import shutil
+import tempfile
 
 import vsc.filesystem.quota.tools as tools
 import vsc.config.base as config
 
-from vsc.config.base import VSC_DATA
+from vsc.config.base import STORAGE_SHARED_SUFFIX, VSC_DATA
+from vsc.filesystem.gpfs import GpfsQuota
 from vsc.filesystem.quota.entities import QuotaUser, QuotaFileset
+from vsc.filesystem.quota.metrics import QuotaMetrics
 from vsc.filesystem.quota.tools import push_vo_quota_to_django, DjangoPusher, QUOTA_USER_KIND
 from vsc.filesystem.quota.tools import push_user_quota_to_django, determine_grace_period
 from vsc.install.testing import TestCase
@@ -43,6 +48,33 @@ from vsc.install.testing import TestCase
 config.STORAGE_CONFIGURATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'filesystem_info.conf')
 
 
+class AccountpageStandIn(object):
+    """
+    Local stand-in for the quota endpoints of the account page REST API.
+
+    Bodies go through JSON as with the REST client, and are decoded into the received records
+    per (storage, kind) with decode_payload.
+    """
+
+    def __init__(self):
+        self.usage = self
+        self.storage = self
+        self.bodies = []
+        self.records = {}
+
+    def __getitem__(self, storage_name):
+        return mock.Mock(
+            user=mock.Mock(size=mock.Mock(put=lambda body: self.put(storage_name, 'user', body))),
+            vo=mock.Mock(size=mock.Mock(put=lambda body: self.put(storage_name, 'vo', body))),
+        )
+
+    def put(self, storage_name, kind, body):
+        body = json.loads(json.dumps(body))
+        self.bodies.append(body)
+        self.records.setdefault((storage_name, kind), []).extend(tools.decode_payload(body))
+        return (200, '')
+
+
 class TestAuxiliary(TestCase):
     """
     Stuff that does not belong anywhere else :)
@@ -60,6 +92,67 @@ class TestAuxiliary(TestCase):
 
         self.assertEqual(res, {3: 1, 6: 4, 9: 7})
 
+    @mock.patch('vsc.filesystem.quota.tools.pwd.getpwuid')
+    def test_uid_resolver(self, mock_getpwuid):
+        """
+        Check that only the requested uids are looked up, and that the results are cached
+        """
+        def getpwuid(uid):
+            if uid == 666:
+                raise KeyError(uid)
+            return mock.MagicMock(pw_name="vsc%d" % uid)
+
+        mock_getpwuid.side_effect = getpwuid
+        tmpdir = tempfile.mkdtemp()
+        cache_path = os.path.join(tmpdir, 'uids.json')
+
+        try:
+            res = tools.map_uids_to_names(['2540075', 2540076, 666], cache_path)
+            self.assertEqual(res, {2540075: 'vsc2540075', 2540076: 'vsc2540076'})
+            self.assertEqual(mock_getpwuid.call_count, 3)
+
+            resolver = tools.UidResolver(cache_path)
+            self.assertEqual(resolver.resolve([2540075, 666]), {2540075: 'vsc2540075'})
+            self.assertEqual(mock_getpwuid.call_count, 3)
+
+            resolver.invalidate([2540075])
+            self.assertEqual(resolver.resolve([2540075, 666]), {2540075: 'vsc2540075'})
+            self.assertEqual(mock_getpwuid.call_count, 4)
+
+            self.assertEqual(tools.UidResolver(cache_path, ttl=0).resolve([2540076]), {2540076: 'vsc2540076'})
+            self.assertEqual(mock_getpwuid.call_count, 5)
+
+            # the expired uids that were not asked for are dropped from the cache
+            self.assertEqual(sorted(tools.UidResolver(cache_path).cache), ['2540076', '666'])
+
+            # uids without a passwd entry are looked up again after the (shorter) miss ttl
+            self.assertEqual(tools.UidResolver(cache_path, miss_ttl=0).resolve([666, 2540076]), {2540076: 'vsc2540076'})
+            self.assertEqual(mock_getpwuid.call_count, 6)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @mock.patch('vsc.filesystem.quota.tools.time')
+    @mock.patch('vsc.filesystem.quota.tools.pwd.getpwuid')
+    def test_uid_resolver_jitter(self, mock_getpwuid, mock_time):
+        """The uids that were looked up together expire at different times within the ttl."""
+        mock_getpwuid.side_effect = lambda uid: mock.MagicMock(pw_name="vsc%d" % uid)
+        uids = range(2540000, 2541000)
+
+        mock_time.time.return_value = 1000
+        resolver = tools.UidResolver(ttl=1000, jitter=0.5)
+        resolver.resolve(uids)
+        self.assertEqual(mock_getpwuid.call_count, 1000)
+
+        lookups = []
+        for now in (1499, 1750, 2000):
+            mock_time.time.return_value = now
+            resolver.resolve(uids)
+            lookups.append(mock_getpwuid.call_count - 1000 - sum(lookups))
+
+        self.assertEqual(lookups[0], 0)
+        self.assertTrue(300 < lookups[1] < 700)
+        self.assertEqual(sum(lookups), 1000)
+
     def test_determine_grace_period(self):
         """
         Check the determine_grace_period function
@@ -69,12 +162,90 @@ class TestAuxiliary(TestCase):
         self.assertEqual(determine_grace_period("13 minutes"), (True, 13 * 60))
         self.assertEqual(determine_grace_period("expired"), (True, 0))
         self.assertEqual(determine_grace_period("none"), (False, None))
+        self.assertEqual(determine_grace_period("1 day"), (True, 86400))
+        self.assertEqual(determine_grace_period("7days"), (True, 7 * 86400))
+        self.assertEqual(determine_grace_period("NONE"), (False, None))
+        self.assertRaises(tools.QuotaException, determine_grace_period, "whenever")
+
+    def test_determine_grace_period_cache(self):
+        """
+        Check that determine_grace_period memoises its results
+        """
+        tools.clear_grace_cache()
+        for _ in xrange(0, 3):
+            self.assertEqual(determine_grace_period("6 days"), (True, 6 * 86400))
+            self.assertEqual(determine_grace_period("none"), (False, None))
+
+        self.assertEqual(tools.GRACE_CACHE_STATS, {'hits': 4, 'misses': 2})
+
+        tools.clear_grace_cache()
+        self.assertEqual(tools.GRACE_CACHE_STATS, {'hits': 0, 'misses': 0})
+
+    def test_fileset_index(self):
+        """
+        Check the names and VO derivations in the FilesetIndex
+        """
+        filesets = {
+            'kyukondata': {
+                '1': {'filesetName': 'vsc400'},
+                '2': {'filesetName': 'gvo00002'},
+                '3': {'filesetName': 'gvos00003'},
+            },
+        }
+        indexed = tools.index_filesets(filesets)
+        index = indexed['kyukondata']
+
+        self.assertEqual(index, filesets['kyukondata'])
+        self.assertTrue(tools.fileset_index(indexed, 'kyukondata') is index)
+
+        self.assertEqual(index.name('1'), 'vsc400')
+        self.assertFalse(index.is_vo('1'))
+        self.assertTrue(index.is_vo('3'))
+        self.assertEqual(index.vo('1', VSC_DATA), None)
+        self.assertEqual(index.vo('2', VSC_DATA), ('gvo00002', VSC_DATA))
+        self.assertEqual(index.vo('3', VSC_DATA), ('gvo00003', VSC_DATA + STORAGE_SHARED_SUFFIX))
+
+    def test_sanitize(self):
+        """
+        Check that only the allowed filesets remain, for a single user and for all users at once
+        """
+        storage = config.VscStorage()
+        path_template = {'user': lambda name: ('/user/%s' % name, 'home%s' % name[3:])}
+
+        def quota_map():
+            qm = {}
+            for (uid, user_name) in [(2540075, 'vsc40075'), (2540076, 'vsc40076')]:
+                quota = QuotaUser(storage, 'kyukondata', user_name)
+                for fileset in ('vsc400', 'gvo00002', 'gvos00003', 'home40075', 'project', 'other'):
+                    quota.update(fileset, used=1, soft=2, hard=3, doubt=0, expired=(False, None), timestamp=None)
+                qm[str(uid)] = quota
+            return qm
+
+        user_map = {2540075: 'vsc40075', 2540076: 'vsc40076'}
+        expected = {
+            '2540075': ['gvo00002', 'gvos00003', 'home40075', 'vsc400'],
+            '2540076': ['gvo00002', 'gvos00003', 'vsc400'],
+        }
+
+        single = quota_map()
+        for (user_id, quota) in single.items():
+            tools.sanitize_quota_information(path_template['user'](user_map[int(user_id)])[1], quota)
+        self.assertEqual(dict((u, sorted(q.quota_map)) for (u, q) in single.items()), expected)
+
+        bulk = quota_map()
+        self.assertEqual(tools.sanitize_quota_map(bulk, user_map, path_template), 5)
+        self.assertEqual(dict((u, sorted(q.quota_map)) for (u, q) in bulk.items()), expected)
+
+        sanitizer = tools.FilesetSanitizer(path_template)
+        self.assertTrue(sanitizer.allowed('gvo00002'))
+        self.assertTrue(sanitizer.allowed('project1', 'project'))
+        self.assertFalse(sanitizer.allowed('project1'))
 
 
 class TestProcessing(TestCase):
 
-    @mock.patch('vsc.filesystem.quota.tools.push_user_quota_to_django')
-    def test_process_user_quota_no_store(self, mock_push_quota):
+    @mock.patch('vsc.filesystem.quota.tools.UserPushSink')
+    def test_process_user_quota_no_store(self, mock_push_sink):
 
         storage_name = VSC_DATA
         item = 'vsc40075'
@@ -93,16 +264,19 @@ class TestProcessing(TestCase):
         quota_map = {'2540075': quota}
         user_map = {2540075: 'vsc40075'}
 
-        tools.process_user_quota(
+        exceeding_users = tools.process_user_quota(
             storage, gpfs, storage_name, None, quota_map, user_map, client, dry_run=False
         )
 
-        mock_push_quota.assert_called_with(
-            user_map, storage_name, storage.path_templates['gent'][storage_name], quota_map, client, False
+        mock_push_sink.assert_called_with(
+            user_map, storage_name, storage.path_templates['gent'][storage_name], client, False, ('vsc4',)
         )
+        mock_push_sink.return_value.consume.assert_called_once_with('2540075', quota)
+        mock_push_sink.return_value.close.assert_called_once_with()
+        self.assertEqual(exceeding_users, [('vsc40075', quota)])
 
-    @mock.patch('vsc.filesystem.quota.tools.push_vo_quota_to_django')
-    def test_process_fileset_quota_no_store(self, mock_push_quota):
+    @mock.patch('vsc.filesystem.quota.tools.VoPushSink')
+    def test_process_fileset_quota_no_store(self, mock_push_sink):
 
         storage_name = VSC_DATA
         filesystem = 'vulpixdata'
@@ -127,11 +301,49 @@ class TestProcessing(TestCase):
 
         quota_map = {fileset: quota}
 
-        tools.process_fileset_quota(
+        exceeding_filesets = tools.process_fileset_quota(
             storage, gpfs, storage_name, filesystem, quota_map, client, dry_run=False
         )
 
-        mock_push_quota.assert_called_with(storage_name, quota_map, client, False, filesets, filesystem)
+        mock_push_sink.assert_called_with(storage_name, client, filesets[filesystem], False)
+        mock_push_sink.return_value.consume.assert_called_once_with(fileset, quota)
+        mock_push_sink.return_value.close.assert_called_once_with()
+        self.assertEqual(exceeding_filesets, [(fileset, quota)])
+
+    def test_quota_pipeline(self):
+        """Every sink sees each entity once, in order, and all sinks are closed, also when one fails."""
+        quota = QuotaUser(VSC_DATA, 'kyukondata', 'vsc40075')
+        quota.update('vsc400', used=1230, soft=456, hard=789, doubt=0, expired=(False, None), timestamp=None)
+        other = QuotaUser(VSC_DATA, 'kyukondata', 'vsc40076')
+        other.update('vsc400', used=10, soft=456, hard=789, doubt=0, expired=(False, None), timestamp=None)
+
+        seen = []
+        first = mock.MagicMock()
+        first.consume.side_effect = lambda entity_id, _: seen.append(('first', entity_id))
+        second = mock.MagicMock()
+        second.consume.side_effect = lambda entity_id, _: seen.append(('second', entity_id))
+        exceeding = tools.ExceedCollector(tools.user_name_lookup({2540075: "vsc40075", 2540076: "vsc40076"}))
+        metrics = QuotaMetrics('dquota')
+        counter = tools.QuotaCounter(metrics, kind='USR')
+
+        stream = iter([('2540075', quota), ('2540076', other)])
+        pipeline = tools.QuotaPipeline([first, second, exceeding, counter])
+        self.assertEqual(pipeline.run(stream), 2)
+
+        self.assertEqual(seen, [('first', '2540075'), ('second', '2540075'),
+                                ('first', '2540076'), ('second', '2540076')])
+        first.close.assert_called_once_with()
+        self.assertEqual(exceeding.exceeding, [('vsc40075', quota)])
+        self.assertEqual(metrics.counters, {
+            ('quota_entities', (('kind', 'USR'),)): 2,
+            ('exceeding_entities', (('kind', 'USR'),)): 1,
+        })
+
+        second.reset_mock()
+        first.consume.side_effect = tools.QuotaException("failed")
+        self.assertRaises(tools.QuotaException, tools.QuotaPipeline([first, second]).run, {'2540075': quota})
+        self.assertFalse(second.consume.called)
+        self.assertEqual(second.close.call_args[0][0][0], tools.QuotaException)
 
     def test_push_vo_quota_to_django(self):
 
@@ -181,7 +393,248 @@ class TestProcessing(TestCase):
         client = mock.MagicMock()
 
         with DjangoPusher("my_storage", client, QUOTA_USER_KIND, False) as pusher:
-            for i in xrange(0, 101):
+            for i in xrange(0, 100):
                 pusher.push("my_storage", "pushing %d" % i)
 
             self.assertEqual(pusher.payload, {"my_storage": [], "my_storage_SHARED": []})
+
+    def test_django_pusher_concurrent(self):
+
+        client = mock.MagicMock()
+
+        with DjangoPusher("my_storage", client, QUOTA_USER_KIND, False, concurrency=4, target_latency=None) as pusher:
+            for i in xrange(0, 1000):
+                pusher.push("my_storage", "pushing %d" % i)
+                pusher.push("my_storage_SHARED", "pushing %d" % i)
+
+        self.assertEqual(pusher.pools, {})
+        self.assertEqual(pusher.payload, {"my_storage": [], "my_storage_SHARED": []})
+
+        pushed = [c[1]['body'] for c in client.usage.storage.__getitem__.return_value.user.size.put.call_args_list]
+        self.assertEqual(len(pushed), 20)
+        self.assertEqual(sum(len(p) for p in pushed), 2000)
+
+    def test_django_pusher_concurrent_error(self):
+
+        client = mock.MagicMock()
+        client.usage.storage.__getitem__.return_value.user.size.put.side_effect = RuntimeError("boom")
+
+        def run():
+            with DjangoPusher("my_storage", client, QUOTA_USER_KIND, False, concurrency=2) as pusher:
+                for i in xrange(0, 10):
+                    pusher.push("my_storage", "pushing %d" % i)
+
+        self.assertRaises(RuntimeError, run)
+
+    @mock.patch('vsc.filesystem.quota.tools.logging')
+    def test_django_pusher_error_in_body(self, mock_logging):
+        """An exception in the with block is not masked by the push errors, which are logged."""
+        client = mock.MagicMock()
+        client.usage.storage.__getitem__.return_value.user.size.put.side_effect = RuntimeError("boom")
+
+        def run():
+            with DjangoPusher("my_storage", client, QUOTA_USER_KIND, False, concurrency=2) as pusher:
+                for i in xrange(0, 10):
+                    pusher.push("my_storage", "pushing %d" % i)
+                raise KeyError("body")
+
+        self.assertRaises(KeyError, run)
+        errors = [c[0][0] for c in mock_logging.error.call_args_list]
+        self.assertTrue("Failed to push %s quota records: %s" in errors)
+
+    @mock.patch('vsc.filesystem.quota.tools.time')
+    def test_token_bucket(self, mock_time):
+
+        mock_time.time.return_value = 1000.0
+
+        bucket = tools.TokenBucket(2, burst=3)
+        for _ in xrange(0, 3):
+            bucket.consume()
+        self.assertFalse(mock_time.sleep.called)
+
+        def sleep(seconds):
+            mock_time.time.return_value += seconds
+
+        mock_time.sleep.side_effect = sleep
+        bucket.consume()
+        mock_time.sleep.assert_called_once_with(0.5)
+
+    def test_django_pusher_delta(self):
+
+        delta_dir = tempfile.mkdtemp()
+        records = [{"user": "vsc4000%d" % i, "fileset": "vsc400", "used": i} for i in xrange(0, 3)]
+
+        def run(records, full_resync=3600):
+            client = mock.MagicMock()
+            with DjangoPusher("my_storage", client, QUOTA_USER_KIND, False,
+                              delta_dir=delta_dir, full_resync=full_resync) as pusher:
+                for record in records:
+                    pusher.push("my_storage", record)
+            put = client.usage.storage.__getitem__.return_value.user.size.put
+            return [r for c in put.call_args_list for r in c[1]['body']]
+
+        try:
+            self.assertEqual(run(records), records)
+            self.assertEqual(run(records), [])
+
+            records[1] = dict(records[1], used=100)
+            self.assertEqual(run(records), [records[1]])
+
+            self.assertEqual(run(records, full_resync=0), records)
+        finally:
+            shutil.rmtree(delta_dir)
+
+    @mock.patch('vsc.filesystem.quota.tools.time')
+    def test_django_pusher_adaptive(self, mock_time):
+
+        clock = [0.0]
+        latencies = [0.25, 0.25, 5.0, 0.25]
+
+        def put(body):
+            clock[0] += latencies[len(pusher.stats['latencies'])]
+
+        mock_time.time.side_effect = lambda: clock[0]
+        client = mock.MagicMock()
+        client.usage.storage.__getitem__.return_value.user.size.put.side_effect = put
+
+        with DjangoPusher("my_storage", client, QUOTA_USER_KIND, False, max_batch_records=300) as pusher:
+            for i in xrange(0, 750):
+                pusher.push("my_storage", "pushing %d" % i)
+
+        self.assertEqual(pusher.stats['batch_sizes'], [100, 200, 300, 150])
+        self.assertEqual(pusher.stats['latencies'], latencies)
+        self.assertEqual(pusher.stats['records'], 750)
+        self.assertEqual(pusher.stats['batches'], 4)
+        self.assertEqual(pusher.batch_size, 300)
+
+    def test_django_pusher_encoding(self):
+        """The compact encodings deliver the same records as the list of records, in smaller bodies."""
+        storage = config.VscStorage()
+        path_template = storage.path_templates['gent'][VSC_DATA]
+        user_map = {}
+        quota_map = {}
+        for uid in xrange(2540000, 2540300):
+            user_map[uid] = "vsc%d" % (uid - 2500000)
+            quota = QuotaUser(storage, 'kyukondata', user_map[uid])
+            quota.update('vsc400', used=uid, soft=456, hard=789, doubt=0, expired=(False, None), timestamp=None)
+            quota_map[str(uid)] = quota
+
+        received = {}
+        sizes = {}
+        for encoding in tools.PUSH_ENCODINGS:
+            client = AccountpageStandIn()
+            push_user_quota_to_django(user_map, VSC_DATA, path_template, quota_map, client, False, encoding=encoding)
+            received[encoding] = sorted(client.records[(VSC_DATA, 'user')], key=lambda r: r['user'])
+            sizes[encoding] = sum(len(json.dumps(body)) for body in client.bodies)
+
+        self.assertEqual(len(received[tools.PUSH_ENCODING_RECORDS]), 300)
+        self.assertEqual(received[tools.PUSH_ENCODING_COMPACT], received[tools.PUSH_ENCODING_RECORDS])
+        self.assertEqual(received[tools.PUSH_ENCODING_COMPACT_GZIP], received[tools.PUSH_ENCODING_RECORDS])
+        self.assertTrue(sizes[tools.PUSH_ENCODING_COMPACT] < sizes[tools.PUSH_ENCODING_RECORDS] * 0.7)
+        self.assertTrue(sizes[tools.PUSH_ENCODING_COMPACT_GZIP] < sizes[tools.PUSH_ENCODING_COMPACT])
+
+        self.assertRaises(tools.QuotaException, DjangoPusher, VSC_DATA, client, QUOTA_USER_KIND, False,
+                          encoding='xml')
+
+    def test_django_pusher_max_bytes(self):
+
+        client = mock.MagicMock()
+
+        with DjangoPusher("my_storage", client, QUOTA_USER_KIND, False, max_batch_bytes=250) as pusher:
+            for _ in xrange(0, 5):
+                pusher.push("my_storage", "x" * 98)  # 100 bytes once serialised
+
+        self.assertEqual(pusher.stats['batch_sizes'], [2, 2, 1])
+        self.assertEqual(pusher.stats['bytes'], 500)
+
+
+class TestMmrepquotaMaps(TestCase):
+    """
+    Tests for building the quota entities from the mmrepquota information.
+    """
+
+    def setUp(self):
+        super(TestMmrepquotaMaps, self).setUp()
+
+        self.filesystem = 'kyukondata'
+        self.filesets = {self.filesystem: {'1': {'filesetName': 'vsc400'}, '2': {'filesetName': 'gvo00002'}}}
+
+        default = GpfsQuota(name="", blockUsage=2048, blockQuota=1024, blockLimit=4096, blockInDoubt=0,
+                            blockGrace="6 days", filesUsage=10, filesQuota=100, filesLimit=200, filesInDoubt=0,
+                            filesGrace="none", remarks="", quota="on", defQuota="off", fid=0, filesetname='1')
+        self.quota = {
+            'USR': {
+                '2540075': [default._replace(name='vsc40075')],
+                '2540076': [default._replace(name='vsc40076', blockUsage=512, blockGrace="none")],
+            },
+            'FILESET': {
+                '2': [default._replace(name='gvo00002', filesetname='2')],
+            },
+        }
+
+    def test_iter_mmrepquota_entities(self):
+        """The streaming variant yields the same entities as the dict-returning one."""
+        maps = tools.get_mmrepquota_maps(self.quota, VSC_DATA, self.filesystem, self.filesets, 2)
+
+        for kind in ('USR', 'FILESET'):
+            stream = tools.iter_mmrepquota_entities(self.quota, kind, VSC_DATA, self.filesystem, self.filesets, 2)
+            streamed = dict(stream)
+            self.assertEqual(sorted(streamed.keys()), sorted(maps[kind].keys()))
+            for (key, entity) in streamed.items():
+                self.assertEqual(
+                    [q._replace(timestamp=None) for q in entity.quota_map.values()],
+                    [q._replace(timestamp=None) for q in maps[kind][key].quota_map.values()],
+                )
+
+        self.assertEqual(maps['USR']['2540075'].quota_map['vsc400'].used, 1024)
+        self.assertEqual(maps['USR']['2540075'].quota_map['vsc400'].expired, (True, 6 * 86400))
+
+    def test_entity_filter(self):
+        """Users outside of the uid ranges or without a matching name are skipped before their entity is created."""
+        self.assertEqual(tools.parse_id_ranges(['2540000-2540075', '100']), [(2540000, 2540075), (100, 100)])
+        self.assertRaises(tools.QuotaException, tools.parse_id_ranges, ['vsc40075'])
+
+        quota = dict(self.quota, USR=dict(self.quota['USR'], **{
+            '0': [self.quota['USR']['2540075'][0]._replace(name='root')],
+        }))
+
+        user_filter = tools.EntityFilter(name_prefixes=('vsc4',))
+        maps = tools.get_mmrepquota_maps(quota, VSC_DATA, self.filesystem, self.filesets, 2, user_filter)
+        self.assertEqual(sorted(maps['USR'].keys()), ['2540075', '2540076'])
+        self.assertEqual(sorted(maps['FILESET'].keys()), ['2'])
+        self.assertEqual(user_filter.skipped, 1)
+
+        user_filter = tools.EntityFilter([(2540000, 2540075)], ('vsc4',), {2540075: 'vsc40075', 0: 'root'})
+        users = tools.iter_mmrepquota_entities(quota, 'USR', VSC_DATA, self.filesystem, self.filesets,
+                                               entity_filter=user_filter)
+        self.assertEqual([user_id for (user_id, _) in users], ['2540075'])
+        self.assertEqual(user_filter.skipped, 2)
+
+        with mock.patch('vsc.filesystem.quota.tools._update_quota_entity') as mock_update:
+            user_filter = tools.EntityFilter([(1, 2)])
+            self.assertEqual(list(tools.iter_mmrepquota_entities(quota, 'USR', VSC_DATA, self.filesystem,
+                                                                 self.filesets, entity_filter=user_filter)), [])
+            self.assertFalse(mock_update.called)
+            self.assertEqual(user_filter.skipped, 3)
+
+    def test_process_streamed_quota(self):
+        """The process functions consume a stream of entities in a single pass."""
+        storage = config.VscStorage()
+        client = mock.MagicMock()
+        gpfs = mock.MagicMock()
+        gpfs.list_filesets.return_value = self.filesets
+        user_map = {2540075: 'vsc40075', 2540076: 'vsc40076'}
+
+        users = tools.iter_mmrepquota_entities(self.quota, 'USR', VSC_DATA, self.filesystem, self.filesets)
+        exceeding_users = tools.process_user_quota(storage, gpfs, VSC_DATA, None, users, user_map, client)
+        self.assertEqual([name for (name, _) in exceeding_users], ['vsc40075'])
+
+        filesets = tools.iter_mmrepquota_entities(self.quota, 'FILESET', VSC_DATA, self.filesystem, self.filesets)
+        exceeding_filesets = tools.process_fileset_quota(storage, gpfs, VSC_DATA, self.filesystem, filesets, client)
+        self.assertEqual([name for (name, _) in exceeding_filesets], ['gvo00002'])
+
+        put = client.usage.storage.__getitem__.return_value
+        pushed_users = [r['user'] for c in put.user.size.put.call_args_list for r in c[1]['body']]
+        self.assertEqual(sorted(pushed_users), ['vsc40075', 'vsc40076'])
+        pushed_vos = [r['vo'] for c in put.vo.size.put.call_args_list for r in c[1]['body']]
+        self.assertEqual(pushed_vos, ['gvo00002'])